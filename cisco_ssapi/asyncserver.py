@@ -0,0 +1,179 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.asyncserver')
+
+import threading
+
+from workers import Scheduler
+
+# Most lookups consuming responses at once.
+CONCURRENCY = 16
+
+
+class AsyncServer(object):
+    """
+    Runs lookups of an eox.Server in the background and hands each response
+    to a callback as it arrives.
+
+    Every method takes the same arguments as the Server method of the same
+    name followed by callback, which is called with each response, and an
+    optional errback, which is called with the exception if the lookup
+    fails. Each returns a Lookup right away. callback is required, even by
+    the methods whose optional arguments come before it; pass it by name.
+
+    Any number of lookups can be started. At most concurrency of them are
+    consumed at once and the rest wait their turn. Their pages are all
+    requested through the Server's own scheduler, so no more than the
+    Server's threads requests are in flight however many lookups overlap.
+    Callbacks are called from a background thread and should return quickly.
+    """
+
+    def __init__(self, server, concurrency=CONCURRENCY):
+        self._server = server
+        self._scheduler = Scheduler(concurrency, name='eox lookup')
+
+
+    def getAll(self, callback, errback=None):
+        return self.submit(self._server.getAll, (), callback, errback)
+
+
+    def getAllProductIDs(self, callback, errback=None):
+        return self.submit(
+            self._server.getAllProductIDs, (), callback, errback)
+
+
+    def getEOXByDates(self, startDate, endDate, eoxAttrib=None,
+        callback=None, errback=None):
+
+        return self.submit(self._server.getEOXByDates,
+            (startDate, endDate, eoxAttrib), callback, errback)
+
+
+    def getEOXByOID(self, oids, hardwareType=None, callback=None,
+        errback=None):
+
+        return self.submit(self._server.getEOXByOID,
+            (oids, hardwareType), callback, errback)
+
+
+    def getEOXByProductID(self, productIDs, callback, errback=None):
+        return self.submit(self._server.getEOXByProductID,
+            (productIDs,), callback, errback)
+
+
+    def getEOXBySWReleaseString(self, swReleaseStrings, osType=None,
+        callback=None, errback=None):
+
+        return self.submit(self._server.getEOXBySWReleaseString,
+            (swReleaseStrings, osType), callback, errback)
+
+
+    def getEOXBySerialNumber(self, serialNumbers, callback, errback=None):
+        return self.submit(self._server.getEOXBySerialNumber,
+            (serialNumbers,), callback, errback)
+
+
+    def submit(self, func, args, callback, errback=None):
+        """
+        Start a lookup of the responses generated by func called with args.
+        """
+        if callback is None:
+            raise ValueError('a callback is required')
+
+        lookup = Lookup(callback, errback)
+        self._scheduler.submit(self._consume, (func, args, lookup),
+            None, lookup)
+
+        return lookup
+
+
+    def close(self):
+        """
+        Stop the lookup threads and the Server's worker threads.
+        """
+        self._scheduler.stop(timeout=1)
+        self._server.close()
+
+
+    def _consume(self, func, args, lookup):
+        if lookup.cancelled:
+            return
+
+        # pylint: disable-msg=W0142
+        gen = func(*args)
+        try:
+            for response in gen:
+                if lookup.cancelled:
+                    break
+
+                lookup.callback(response)
+        finally:
+            gen.close()
+
+
+class Lookup(object):
+    """
+    A lookup started by an AsyncServer.
+    """
+
+    def __init__(self, callback, errback=None):
+        self.callback = callback
+        self.errback = errback
+        self.cancelled = False
+        self.error = None
+        self._done = threading.Event()
+
+
+    def cancel(self):
+        """
+        Stop the lookup after the response being handled. Pages already
+        requested are still received but no callbacks are made for them.
+        """
+        self.cancelled = True
+
+
+    def isDone(self):
+        return self._done.isSet()
+
+
+    def wait(self, timeout=None):
+        """
+        Block until the lookup is done or timeout seconds pass. Return True
+        if it is done.
+        """
+        self._done.wait(timeout)
+        return self._done.isSet()
+
+
+    def put(self, completion):
+        # Called by the scheduler with the outcome of the lookup.
+        error = completion[2]
+        if error is not None:
+            self.error = error
+            if self.errback:
+                try:
+                    self.errback(error)
+                except Exception, ex:
+                    log.error('lookup errback failed: %s', ex)
+            else:
+                log.error('lookup failed: %s', error)
+
+        self._done.set()
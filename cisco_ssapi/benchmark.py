@@ -0,0 +1,367 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.benchmark')
+
+import multiprocessing
+import optparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import eox
+import mockserver
+import retry
+import transport
+import writers
+import wsdlbundle
+from records import EOXRecord, Response
+
+SIZES = [1000, 10000]
+THREADS = [1, 4, 16]
+CASES = ['getAll', 'getEOXByDates', 'getEOXBySerialNumber', 'writers',
+    'startup']
+
+# Ways of starting a script measured by the startup case: without any cached
+# WSDL, with the WSDLs in the disk cache and with them in a WSDL bundle.
+STARTUP_MODES = ['fetch', 'cache', 'bundle']
+STARTUP_RUNS = 10
+
+# Report columns as (heading, width, format).
+COLUMNS = [
+    ('case', 24, '%s'),
+    ('size', 8, '%s'),
+    ('threads', 7, '%s'),
+    ('records', 8, '%s'),
+    ('seconds', 8, '%.2f'),
+    ('records/s', 9, '%.0f'),
+    ('p50 ms', 7, '%.1f'),
+    ('p90 ms', 7, '%.1f'),
+    ('p99 ms', 7, '%.1f'),
+    ('peak MB', 7, '%.1f'),
+    ('cpu s', 6, '%.2f'),
+    ]
+
+
+class TimedServer(eox.Server):
+    """
+    Server keeping the latency of every page it requests.
+    """
+
+    def __init__(self, *args, **kwargs):
+        eox.Server.__init__(self, *args, **kwargs)
+        self.latencies = []
+
+
+    def getPage(self, method, args, page):
+        start = time.time()
+        try:
+            return eox.Server.getPage(self, method, args, page)
+        finally:
+            self.latencies.append(time.time() - start)
+
+
+def runServerCase(case, size, threads, options, wsdl, bulkWSDL):
+    """
+    Return the number of records case gets from the mock server and the
+    latencies of its pages.
+    """
+    connection_pool = None
+    if options.keepAlive:
+        connection_pool = transport.ConnectionPool()
+
+    server = TimedServer('user', 'password', threads,
+        cacheLocation=options.wsdlCache,
+        fastParse=options.fastParse,
+        wsdl=wsdl,
+        bulkWSDL=bulkWSDL,
+        rateLimiter=options.rate and retry.RateLimiter(options.rate),
+        connectionPool=connection_pool)
+
+    # Build the clients first so parsing the WSDLs isn't measured.
+    server.getClient('showAllProductIDs')
+    server.getClient('showEOXBySerialNumber')
+
+    if case == 'getAll':
+        gen = server.getAll()
+    elif case == 'getEOXByDates':
+        gen = server.getEOXByDates('2010-01-01', '2010-12-31')
+    else:
+        gen = server.getEOXBySerialNumber(
+            'SN%08d' % i for i in xrange(size))
+
+    records = 0
+    for response in gen:
+        records += len(response.EOXRecord)
+
+    server.close()
+    if connection_pool is not None:
+        connection_pool.close()
+    return records, server.latencies
+
+
+def runWriterCase(size, format, directory):
+    """
+    Write size records through the CLI writer for format and return the
+    number written.
+    """
+    import scripts
+
+    record = EOXRecord.fromValues(
+        dict([(name, 'mock %s' % name) for name in eox.RECORD_COLUMNS]))
+
+    def getResponses():
+        for start in xrange(0, size, eox.GROUP_LIMIT):
+            yield Response.fromRecords(
+                [record] * min(eox.GROUP_LIMIT, size - start))
+
+    output = os.devnull
+    if format == 'sqlite':
+        output = os.path.join(directory, 'benchmark.db')
+
+    scripts.writeEOXRecords(getResponses(), optparse.Values({
+        'format': format,
+        'output': output,
+        'delimiter': ',',
+        'flushInterval': writers.FLUSH_INTERVAL,
+        }))
+
+    return size
+
+
+def runStartupCase(mode, runs, wsdl, bulkWSDL, directory):
+    """
+    Time runs single serial number lookups, each by a new
+    get_eox_by_serial process started the way mode says, and return the
+    number of runs and the seconds each took.
+    """
+    cache_location = os.path.join(directory, 'startup-%s' % mode)
+    bundle = os.path.join(directory, 'startup.bundle')
+    if mode == 'bundle':
+        wsdlbundle.buildBundle(bundle, [wsdl, bulkWSDL])
+
+    command = [sys.executable, '-c',
+        'import sys; sys.path.insert(0, %r); import scripts; '
+        'scripts.getEOXBySerialNumber()' % os.path.dirname(
+            os.path.abspath(__file__)),
+        '-u', 'user', '-p', 'password',
+        '--wsdl', wsdl, '--bulk-wsdl', bulkWSDL,
+        '--wsdl-bundle', mode == 'bundle' and bundle or '',
+        '--output', os.devnull, 'SN00000001']
+
+    devnull = open(os.devnull, 'w')
+    try:
+        if mode == 'cache':
+            subprocess.check_call(
+                command + ['--wsdl-cache', cache_location], stderr=devnull)
+
+        seconds = []
+        for run in xrange(runs):
+            if mode != 'cache':
+                shutil.rmtree(cache_location, True)
+
+            start = time.time()
+            subprocess.check_call(
+                command + ['--wsdl-cache', cache_location], stderr=devnull)
+
+            seconds.append(time.time() - start)
+    finally:
+        devnull.close()
+
+    return runs, seconds
+
+
+def measure(function, args, results):
+    """
+    Call function with args in this process and put its records, page
+    latencies, elapsed seconds, peak memory and CPU seconds on results.
+    """
+    logging.getLogger().setLevel(logging.WARN)
+    try:
+        start_times = os.times()
+        start = time.time()
+        outcome = function(*args)
+        elapsed = time.time() - start
+        end_times = os.times()
+
+        if isinstance(outcome, tuple):
+            records, latencies = outcome
+        else:
+            records, latencies = outcome, []
+
+        results.put((None, {
+            'records': records,
+            'latencies': latencies,
+            'seconds': elapsed,
+            'peak': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'cpu': (end_times[0] - start_times[0]) + \
+                (end_times[1] - start_times[1]),
+            }))
+    except Exception, ex:
+        results.put((ex, None))
+
+
+def run(function, args):
+    """
+    Measure function called with args in a child process of its own, so
+    that its peak memory and CPU aren't mixed with other cases or with the
+    mock server's.
+    """
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=measure, args=(function, args, results))
+
+    process.start()
+    error, result = results.get()
+    process.join()
+    if error:
+        raise error
+
+    return result
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def formatRow(row, heading=False):
+    cells = []
+    for (name, width, format), value in zip(COLUMNS, row):
+        if not heading:
+            value = format % value
+
+        if cells:
+            cells.append(value.rjust(width))
+        else:
+            cells.append(value.ljust(width))
+
+    return ' '.join(cells)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--cases', dest='cases', default=','.join(CASES),
+        help='Comma-separated cases to run: %s' % ', '.join(CASES))
+    parser.add_option('--sizes', dest='sizes',
+        default=','.join(map(str, SIZES)),
+        help='Comma-separated numbers of products or inputs to run with')
+    parser.add_option('--threads', dest='threads',
+        default=','.join(map(str, THREADS)),
+        help='Comma-separated numbers of Server threads to run with')
+    parser.add_option('--page-size', dest='pageSize', type='int',
+        default=mockserver.PAGE_SIZE,
+        help='Records on each page of the mock server')
+    parser.add_option('--latency', dest='latency', type='float',
+        default=0.05, help='Seconds each mock request waits')
+    parser.add_option('--jitter', dest='jitter', type='float',
+        default=0.0, help='Most random seconds added to the latency')
+    parser.add_option('--fault-rate', dest='faultRate', type='float',
+        default=0.0, help='Fraction of mock requests failing with Timeout')
+    parser.add_option('--fast-parse', dest='fastParse',
+        action='store_true', default=False,
+        help='Parse EOX responses without suds where possible')
+    parser.add_option('--quota', dest='quota', type='int',
+        help='Most mock requests a second before failing with Timeout')
+    parser.add_option('--rate', dest='rate', type='float',
+        help='Limit the Server to this many requests a second')
+    parser.add_option('--keep-alive', dest='keepAlive',
+        action='store_true', default=False,
+        help='Make requests on pooled keep-alive, compressed connections')
+    options = parser.parse_args()[0]
+
+    logging.basicConfig(level=logging.WARN)
+    cases = options.cases.split(',')
+    sizes = [int(size) for size in options.sizes.split(',')]
+    thread_counts = [int(threads) for threads in options.threads.split(',')]
+
+    options.wsdlCache = tempfile.mkdtemp(prefix='eox-benchmark-')
+    print formatRow([column[0] for column in COLUMNS], heading=True)
+    try:
+        for size in sizes:
+            server = mockserver.MockServer(
+                productCount=size,
+                pageSize=options.pageSize,
+                latency=options.latency,
+                jitter=options.jitter,
+                faultRate=options.faultRate,
+                quota=options.quota).start()
+
+            try:
+                for case in cases:
+                    if case == 'startup':
+                        if size != sizes[0]:
+                            continue
+
+                        for mode in STARTUP_MODES:
+                            result = run(runStartupCase, (mode,
+                                STARTUP_RUNS, server.getWSDL(),
+                                server.getBulkWSDL(), options.wsdlCache))
+
+                            report('startup.%s' % mode, STARTUP_RUNS, '-',
+                                result)
+
+                        continue
+
+                    if case == 'writers':
+                        for format in sorted(writers.FORMATS.keys()):
+                            result = run(runWriterCase,
+                                (size, format, options.wsdlCache))
+
+                            report('writers.%s' % format, size, '-', result)
+
+                        continue
+
+                    for threads in thread_counts:
+                        result = run(runServerCase, (case, size, threads,
+                            options, server.getWSDL(), server.getBulkWSDL()))
+
+                        report(case, size, threads, result)
+            finally:
+                server.stop()
+    finally:
+        shutil.rmtree(options.wsdlCache, True)
+
+
+def report(case, size, threads, result):
+    latencies = result['latencies']
+    seconds = result['seconds']
+    print formatRow([
+        case,
+        size,
+        threads,
+        result['records'],
+        seconds,
+        result['records'] / (seconds or 1e-9),
+        percentile(latencies, 0.5) * 1000,
+        percentile(latencies, 0.9) * 1000,
+        percentile(latencies, 0.99) * 1000,
+        result['peak'] / 1024.0,
+        result['cpu'],
+        ])
+
+    sys.stdout.flush()
@@ -0,0 +1,212 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.cache')
+
+import cPickle as pickle
+import sqlite3
+import threading
+import time
+
+TTL = 7 * 24 * 60 * 60
+NEGATIVE_TTL = 24 * 60 * 60
+MAX_ENTRIES = 1000000
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS records (
+        method TEXT NOT NULL,
+        value TEXT NOT NULL,
+        records BLOB NOT NULL,
+        negative INTEGER NOT NULL,
+        expires REAL NOT NULL,
+        accessed REAL NOT NULL,
+        PRIMARY KEY (method, value))""",
+    """CREATE INDEX IF NOT EXISTS records_accessed ON records (accessed)""",
+    ]
+
+
+class RecordCache(object):
+    """
+    Persistent cache of EOX records keyed by lookup method and input value.
+
+    Records are stored as lists of the (values, error) pairs returned by
+    eox.getRecordValues. Entries answered with an EOXError, or with nothing
+    at all, are negative entries and expire after negativeTTL seconds
+    instead of ttl. Once there are more than maxEntries entries the least
+    recently used ones are evicted.
+    """
+
+    def __init__(self, path, ttl=TTL, negativeTTL=NEGATIVE_TTL,
+        maxEntries=MAX_ENTRIES):
+
+        self.path = path
+        self.ttl = ttl
+        self.negativeTTL = negativeTTL
+        self.maxEntries = maxEntries
+        self.hits = 0
+        self.negativeHits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        for statement in SCHEMA:
+            self._connection.execute(statement)
+
+        self._connection.commit()
+
+        # Upper bound on the number of entries. Replaced entries are counted
+        # again so the real count is only taken once this passes maxEntries.
+        self._count = self._getCount()
+
+
+    def get(self, method, value):
+        """
+        Return the cached records for value or None if it isn't cached.
+        """
+        now = time.time()
+        self._lock.acquire()
+        try:
+            row = self._connection.execute(
+                "SELECT records, negative, expires FROM records "
+                "WHERE method = ? AND value = ?", (method, value)).fetchone()
+
+            if row is None or row[2] < now:
+                self.misses += 1
+                return None
+
+            self._connection.execute(
+                "UPDATE records SET accessed = ? "
+                "WHERE method = ? AND value = ?", (now, method, value))
+
+            if row[1]:
+                self.negativeHits += 1
+            else:
+                self.hits += 1
+
+            return pickle.loads(str(row[0]))
+        finally:
+            self._lock.release()
+
+
+    def put(self, entries):
+        """
+        Store a dict of method and value tuples mapped to their records.
+        """
+        now = time.time()
+        rows = []
+        for (method, value), records in entries.items():
+            negative = 1
+            for values, error in records:
+                if not error:
+                    negative = 0
+                    break
+
+            if negative:
+                expires = now + self.negativeTTL
+            else:
+                expires = now + self.ttl
+
+            rows.append((method, value,
+                sqlite3.Binary(pickle.dumps(records, 2)),
+                negative, expires, now))
+
+        self._lock.acquire()
+        try:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO records "
+                "(method, value, records, negative, expires, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+            self._count += len(rows)
+            if self._count > self.maxEntries:
+                self._evict()
+
+            self._connection.commit()
+        finally:
+            self._lock.release()
+
+
+    def extend(self, entries):
+        """
+        Add records to the entries already cached for each method and value
+        tuple in the dict. Used when a value's records span several pages.
+        """
+        self._lock.acquire()
+        try:
+            for key, records in entries.items():
+                row = self._connection.execute(
+                    "SELECT records FROM records "
+                    "WHERE method = ? AND value = ?", key).fetchone()
+
+                if row is not None:
+                    entries[key] = pickle.loads(str(row[0])) + records
+        finally:
+            self._lock.release()
+
+        self.put(entries)
+
+
+    def purge(self):
+        """
+        Delete expired entries.
+        """
+        self._lock.acquire()
+        try:
+            self._connection.execute(
+                "DELETE FROM records WHERE expires < ?", (time.time(),))
+
+            self._connection.commit()
+        finally:
+            self._lock.release()
+
+
+    def getStats(self):
+        return {
+            'hits': self.hits,
+            'negativeHits': self.negativeHits,
+            'misses': self.misses,
+            }
+
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            self._connection.commit()
+            self._connection.close()
+        finally:
+            self._lock.release()
+
+
+    def _getCount(self):
+        return self._connection.execute(
+            "SELECT COUNT(*) FROM records").fetchone()[0]
+
+
+    def _evict(self):
+        count = self._getCount()
+        if count > self.maxEntries:
+            log.debug('evicting %s cached entries', count - self.maxEntries)
+            self._connection.execute(
+                "DELETE FROM records WHERE rowid IN ("
+                "SELECT rowid FROM records ORDER BY accessed LIMIT ?)",
+                (count - self.maxEntries,))
+
+            count = self.maxEntries
+
+        self._count = count
@@ -0,0 +1,304 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.checkpoint')
+
+import sqlite3
+import threading
+
+from collections import deque
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS pages (
+        page INTEGER PRIMARY KEY,
+        done INTEGER NOT NULL,
+        complete INTEGER NOT NULL,
+        failed TEXT NOT NULL,
+        output_offset INTEGER)""",
+    """CREATE TABLE IF NOT EXISTS crawl (
+        name TEXT PRIMARY KEY,
+        value INTEGER)""",
+    ]
+
+
+class Checkpoint(object):
+    """
+    Journal of the progress of a getAll crawl, for resuming it after a
+    failure.
+
+    For each showAllProductIDs page it keeps how many of the page's product
+    IDs, counted from the first, have had all their records yielded, whether
+    that is all of them, and which of them failed. Each update is journaled
+    with the output offset returned by getOffset at that point. The output
+    offset of the last update is where the output of a resumed crawl
+    continues from. Only the product IDs that failed and those past the
+    done ones are requested again.
+
+    getOffset is called with no arguments and must account for every record
+    yielded so far, so writers have to flush before they answer.
+    """
+
+    def __init__(self, path, getOffset=None):
+        self.path = path
+        self.getOffset = getOffset
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        for statement in SCHEMA:
+            self._connection.execute(statement)
+
+        self._connection.commit()
+
+
+    def getLastIndex(self):
+        """
+        Return the number of showAllProductIDs pages or None if the crawl
+        never got that far.
+        """
+        row = self._connection.execute(
+            "SELECT value FROM crawl WHERE name = 'lastIndex'").fetchone()
+
+        if row is None:
+            return None
+
+        return row[0]
+
+
+    def getMissingPages(self):
+        """
+        Return the numbers of the pages not complete yet, or None if the
+        number of pages isn't known.
+        """
+        last_index = self.getLastIndex()
+        if last_index is None:
+            return None
+
+        complete = {}
+        cursor = self._connection.execute(
+            "SELECT page FROM pages WHERE complete")
+
+        for row in cursor:
+            complete[row[0]] = True
+
+        return [page for page in range(1, last_index + 1)
+            if page not in complete]
+
+
+    def getDone(self):
+        """
+        Return a dict of incomplete page numbers mapped to how many of their
+        product IDs are done.
+        """
+        return dict(self._connection.execute(
+            "SELECT page, done FROM pages WHERE NOT complete").fetchall())
+
+
+    def getFailed(self):
+        """
+        Return a dict of page numbers mapped to the lists of their product
+        IDs that failed.
+        """
+        failed = {}
+        cursor = self._connection.execute(
+            "SELECT page, failed FROM pages WHERE failed != ''")
+
+        for page, values in cursor:
+            failed[page] = values.split(',')
+
+        return failed
+
+
+    def update(self, pages, lastIndex=None):
+        """
+        Journal a list of (page, done, complete, failed) tuples and, if
+        given, the number of pages.
+        """
+        offset = None
+        if self.getOffset is not None:
+            offset = self.getOffset()
+
+        if lastIndex is not None:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO crawl (name, value) "
+                "VALUES ('lastIndex', ?)", (lastIndex,))
+
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO pages "
+            "(page, done, complete, failed, output_offset) "
+            "VALUES (?, ?, ?, ?, ?)", [
+                (page, done, int(complete), ','.join(failed), offset)
+                for page, done, complete, failed in pages])
+
+        self._connection.commit()
+        for page, done, complete, failed in pages:
+            if complete:
+                log.info('checkpoint: page %s done, %s product IDs failed',
+                    page, len(failed))
+
+
+    def setFailed(self, page, failed):
+        """
+        Journal the product IDs of page that still failed when requested
+        again.
+        """
+        offset = None
+        if self.getOffset is not None:
+            offset = self.getOffset()
+
+        self._connection.execute(
+            "UPDATE pages SET failed = ?, output_offset = ? WHERE page = ?",
+            (','.join(failed), offset, page))
+
+        self._connection.commit()
+
+
+    def getOutputOffset(self):
+        """
+        Return the output offset of the last update, or None. Output only
+        grows, so that is the largest offset.
+        """
+        return self._connection.execute(
+            "SELECT MAX(output_offset) FROM pages").fetchone()[0]
+
+
+    def clear(self):
+        """
+        Forget all progress to start a new crawl.
+        """
+        self._connection.execute("DELETE FROM pages")
+        self._connection.execute("DELETE FROM crawl")
+        self._connection.commit()
+
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+
+class PageTracker(object):
+    """
+    Follows the product IDs of showAllProductIDs pages through an ordered
+    lookup of their records and journals each page's progress in a
+    Checkpoint.
+
+    Pages are added as they are read, from any thread. done must be called
+    on the consuming thread with the values of each lookup request, in
+    order, once all its records have been yielded, and fail with the values
+    of a failed request before that. Values that never reach done, such as
+    cache hits and repeated product IDs, are covered by the next call that
+    passes them. finish completes every page once the lookup is over.
+    """
+
+    def __init__(self, checkpoint):
+        self.checkpoint = checkpoint
+        self._lastIndex = None
+
+        # [page, product IDs, done, failed, total] of each page not complete,
+        # in the order of the lookup, and the page and position of every
+        # value.
+        self._pages = deque()
+        self._positions = {}
+        self._lock = threading.Lock()
+
+
+    def addPage(self, page, productIDs, done=0, failed=(), lastIndex=None):
+        """
+        Add the product IDs of page after the done ones, which are skipped.
+        failed lists the done ones that failed.
+        """
+        values = [value.strip() for value in productIDs]
+        entry = [page, values, done, list(failed), done + len(values)]
+        self._lock.acquire()
+        try:
+            if lastIndex is not None:
+                self._lastIndex = lastIndex
+
+            self._pages.append(entry)
+            for index, value in enumerate(values):
+                self._positions.setdefault(value, (entry, done + index + 1))
+        finally:
+            self._lock.release()
+
+
+    def fail(self, values):
+        self._lock.acquire()
+        try:
+            for value in values:
+                position = self._positions.get(value)
+                if position is not None:
+                    position[0][3].append(value)
+        finally:
+            self._lock.release()
+
+
+    def done(self, values):
+        self._lock.acquire()
+        try:
+            last = None
+            for value in values:
+                position = self._positions.get(value)
+                if position is not None:
+                    last = position
+
+            if last is None:
+                return
+
+            entry, done = last
+            updates = []
+            while self._pages[0] is not entry:
+                updates.append(self._complete())
+
+            entry[2] = max(entry[2], done)
+            if entry[2] >= entry[4]:
+                updates.append(self._complete())
+            else:
+                updates.append((entry[0], entry[2], False, list(entry[3])))
+
+            last_index = self._lastIndex
+        finally:
+            self._lock.release()
+
+        self.checkpoint.update(updates, last_index)
+
+
+    def finish(self):
+        self._lock.acquire()
+        try:
+            updates = []
+            while self._pages:
+                updates.append(self._complete())
+
+            last_index = self._lastIndex
+        finally:
+            self._lock.release()
+
+        if updates:
+            self.checkpoint.update(updates, last_index)
+
+
+    def _complete(self):
+        """
+        Remove the first page and return its update as complete.
+        """
+        entry = self._pages.popleft()
+        for value in entry[1]:
+            position = self._positions.get(value)
+            if position is not None and position[0] is entry:
+                del self._positions[value]
+
+        return (entry[0], entry[4], True, entry[3])
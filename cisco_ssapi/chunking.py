@@ -0,0 +1,154 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.chunking')
+
+import threading
+import types
+
+# Seconds a request may take before chunks start shrinking.
+TARGET_LATENCY = 20.0
+
+
+class ChunkSizer(object):
+    """
+    Adapts how many values go into each request of a lookup method.
+
+    The size starts at initial and grows by one after every full request
+    that completes within targetLatency. It halves after a timeout, shrinks
+    in proportion when a request is slower than targetLatency and shrinks
+    to fit one page when a response needs more than one page, because the
+    remaining pages then cost extra requests of their own. It always stays
+    between 1 and maximum.
+    """
+
+    def __init__(self, maximum, initial=None, maxLength=None,
+        targetLatency=TARGET_LATENCY):
+
+        if initial is None:
+            initial = maximum
+
+        self.maximum = maximum
+        self.maxLength = maxLength
+        self.targetLatency = targetLatency
+        self._size = max(1, min(initial, maximum))
+        self._lock = threading.Lock()
+
+
+    def getSize(self):
+        return self._size
+
+
+    def observe(self, count, latency, timeouts=0, pager=None):
+        """
+        Adjust the size after a request for count values that took latency
+        seconds, hit timeouts Timeout faults and returned pager as its
+        PaginationResponseRecord.
+        """
+        self._lock.acquire()
+        try:
+            size = self._size
+            if timeouts:
+                size = size // 2
+            elif latency > self.targetLatency:
+                size = int(count * self.targetLatency / latency)
+            elif pager and pager.LastIndex > 1 and pager.TotalRecords:
+                size = count * pager.PageRecords // pager.TotalRecords
+            elif count >= size:
+                size += 1
+
+            size = max(1, min(size, self.maximum))
+            if size != self._size:
+                log.debug('chunk size %s -> %s', self._size, size)
+                self._size = size
+        finally:
+            self._lock.release()
+
+
+class Chunker(object):
+    """
+    Collects values into chunks one value at a time.
+
+    size is either the number of values per chunk or a callable returning
+    the size to use for the next chunk. When maxLength is given, chunks of
+    strings are also kept short enough to join with commas into at most
+    maxLength characters.
+    """
+
+    def __init__(self, size, maxLength=None):
+        if not callable(size):
+            size = _constant(size)
+
+        self.maxLength = maxLength
+        self._size = size
+        self._chunk = []
+        self._length = 0
+        self._limit = size()
+
+
+    def add(self, value):
+        """
+        Add value and return a list of the chunks it completed, usually
+        none or one.
+        """
+        chunks = []
+        string = isinstance(value, types.StringTypes)
+        if self._chunk and self.maxLength and string \
+            and self._length + len(value) + 1 > self.maxLength:
+
+            chunks.append(self.flush())
+
+        self._chunk.append(value)
+        if string:
+            self._length += len(value) + 1
+
+        if len(self._chunk) >= self._limit:
+            chunks.append(self.flush())
+
+        return chunks
+
+
+    def flush(self):
+        """
+        Return the values collected so far as a chunk and start a new one.
+        """
+        chunk = self._chunk
+        self._chunk = []
+        self._length = 0
+        self._limit = self._size()
+        return chunk
+
+
+def iterChunks(values, size, maxLength=None):
+    """
+    Lazily yield lists of consecutive values chunked by a Chunker.
+    """
+    chunker = Chunker(size, maxLength)
+    for value in values:
+        for chunk in chunker.add(value):
+            yield chunk
+
+    chunk = chunker.flush()
+    if chunk:
+        yield chunk
+
+
+def _constant(value):
+    return lambda: value
@@ -0,0 +1,207 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.clients')
+
+import base64
+import cPickle as pickle
+import httplib
+import threading
+import time
+
+from StringIO import StringIO
+
+# The suds parts of the clients a Server builds and of WSDL bundles. Some
+# suds versions import suds.client, and most of suds with it, on any suds
+# import, so this module is only imported once the first client, or a
+# bundle, is built.
+from suds.cache import Cache, ObjectCache
+from suds.plugin import MessagePlugin
+from suds.transport import Reply, Transport, TransportError
+
+from transport import ACCEPT_ENCODING
+
+
+class WSDLCache(Cache):
+    """
+    Process-wide cache of parsed WSDL definitions and schema documents.
+
+    Entries are held in memory as pickles and backed by a suds ObjectCache on
+    disk. The entries of a bundle, as returned by wsdlbundle.loadBundle, are
+    held from the start and never expire. Every get returns a fresh copy
+    because suds keeps per-request state in the definitions.
+    """
+
+    def __init__(self, location, days, bundle=None):
+        self._disk = ObjectCache(location=location, days=days)
+        self._pickles = dict(bundle or {})
+        self._lock = threading.Lock()
+
+
+    def get(self, id):
+        self._lock.acquire()
+        try:
+            data = self._pickles.get(id)
+            if data is None:
+                obj = self._disk.get(id)
+                if obj is not None:
+                    self._pickles[id] = pickle.dumps(obj, 2)
+
+                return obj
+        finally:
+            self._lock.release()
+
+        return pickle.loads(data)
+
+
+    def put(self, id, object):
+        data = pickle.dumps(object, 2)
+        self._lock.acquire()
+        try:
+            self._pickles[id] = data
+            self._disk.put(id, object)
+        finally:
+            self._lock.release()
+
+        return object
+
+
+    def purge(self, id):
+        self._lock.acquire()
+        try:
+            self._pickles.pop(id, None)
+            self._disk.purge(id)
+        finally:
+            self._lock.release()
+
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._pickles.clear()
+            self._disk.clear()
+        finally:
+            self._lock.release()
+
+
+class RecordingCache(Cache):
+    """
+    Suds cache that never hits and keeps everything put in it as pickles.
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+
+    def get(self, id):
+        return None
+
+
+    def put(self, id, object):
+        self.entries[id] = pickle.dumps(object, 2)
+        return object
+
+
+    def purge(self, id):
+        self.entries.pop(id, None)
+
+
+    def clear(self):
+        self.entries.clear()
+
+
+class PooledTransport(Transport):
+    """
+    Suds transport making its requests through a ConnectionPool.
+
+    Every request asks for a gzip or deflate encoded reply and, when the
+    client has a username and password, carries them as a basic
+    Authorization header built once, rather than waiting to be challenged
+    for them on each request as the suds HttpAuthenticated transport does.
+    Proxies aren't supported.
+    """
+
+    def __init__(self, pool):
+        Transport.__init__(self)
+        self.pool = pool
+        self._authorization = None
+
+
+    def open(self, request):
+        status, reason, headers, body = self.pool.request('GET',
+            request.url, None, self.getHeaders(request),
+            self.options.timeout)
+
+        if status != httplib.OK:
+            raise TransportError(reason, status, StringIO(body))
+
+        return StringIO(body)
+
+
+    def send(self, request):
+        status, reason, headers, body = self.pool.request('POST',
+            request.url, request.message, self.getHeaders(request),
+            self.options.timeout)
+
+        if status in (httplib.ACCEPTED, httplib.NO_CONTENT):
+            return None
+
+        if status != httplib.OK:
+            raise TransportError(reason, status, StringIO(body))
+
+        return Reply(status, headers, body)
+
+
+    def getHeaders(self, request):
+        headers = dict(request.headers)
+        headers['Accept-Encoding'] = ACCEPT_ENCODING
+        if self._authorization is None:
+            username = self.options.username
+            password = self.options.password
+            if username is not None and password is not None:
+                self._authorization = 'Basic %s' % base64.b64encode(
+                    '%s:%s' % (username, password))
+
+        if self._authorization is not None:
+            headers['Authorization'] = self._authorization
+
+        return headers
+
+
+class ReplyMeter(MessagePlugin):
+    """
+    Suds plugin noting the size and arrival time of each reply received by
+    the clients of one thread, before suds parses it, whichever transport
+    brought it and whether or not suds unmarshals it.
+    """
+
+    def __init__(self):
+        self.replySize = None
+        self.replyTime = None
+
+
+    def clear(self):
+        self.replySize = None
+        self.replyTime = None
+
+
+    def received(self, context):
+        self.replySize = len(context.reply)
+        self.replyTime = time.time()
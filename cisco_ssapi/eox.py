@@ -20,227 +20,1169 @@
 import logging
 log = logging.getLogger('cisco_ssapi.eox')
 
+import heapq
+import Queue
 import threading
+import time
 import types
 
-from suds.client import Client, WebFault
+from collections import deque
+
+from checkpoint import PageTracker
+from chunking import Chunker, ChunkSizer, iterChunks
+from fastparse import parseResponse
+from records import EOXError, EOXRecord, Response, convertResponse
+from records import ERROR_COLUMNS, RECORD_COLUMNS
+from retry import CircuitBreaker, RetryBudget, RetryPolicy
+from workers import Feeder, Scheduler
+from wsdlbundle import BUNDLE_LOCATION, loadBundle
 
 WSDL = "http://www.cisco.com/web/tsweb/ssapi/v1/downloads/eoxlookupservice-1.xml"
 WSDL_BULK = "http://www.cisco.com/web/tsweb/ssapi/v1/downloads/bulkeoxlookupservice-1.xml"
 THREADS = 4
 GROUP_LIMIT = 20
 
-RECORD_COLUMNS = [
-    'EOLProductID',
-    'ProductIDDescription',
-    'ProductBulletinNumber',
-    'LinkToProductBulletinURL',
-    'EOXExternalAnnouncementDate',
-    'EndOfSaleDate',
-    'EndOfSWMaintenanceReleases',
-    'EndOfRoutineFailureAnalysisDate',
-    'EndOfServiceContractRenewal',
-    'LastDateOfSupport',
-    'EndOfSvcAttachDate',
-    'UpdatedTimeStamp',
-    'EOXInputType',
-    'EOXInputValue',
-    ]
+# Most characters of comma-separated values sent in one request.
+MAX_ARGUMENT_LENGTH = 1024
+
+# showEOXByDates attribute used to find records changed since the last sync.
+SYNC_ATTRIBUTE = 'UPDATED_TIMESTAMP'
+
+# Most responses a response generator holds at once, counting pages queued,
+# in flight and received but not yet yielded. None means twice the threads.
+MAX_BUFFERED = None
+
+# Most recent distinct input values a lookup remembers to drop repeats.
+UNIQUE_WINDOW = 100000
+
+# Query types of getEOXBatch and the lookup method answering each. The
+# qualifier of oid inputs is their hardware type and of sw inputs their OS
+# type.
+BATCH_TYPES = {
+    'serial': 'getEOXBySerialNumber',
+    'product': 'getEOXByProductID',
+    'oid': 'getEOXByOID',
+    'sw': 'getEOXBySWReleaseString',
+    }
 
+# Parsed WSDL definitions are pickled here so new processes can skip parsing.
+# None uses the suds default location in the system temporary directory.
+CACHE_LOCATION = None
+CACHE_DAYS = 1
 
 class Server(object):
     bulkMethods = ['showAllProductIDs', 'showEOXByDates']
+    cachedMethods = ['showEOXByProductID', 'showEOXBySerialNumber']
+    coalescedMethods = ['showEOXByProductID', 'showEOXBySerialNumber']
+
+    # ChunkSizer arguments overriding the Server's defaults for a method.
+    chunkPolicies = {
+        'showEOXByOID': {'maxLength': None},
+        'showEOXBySWReleseString': {'maxLength': None},
+        }
+
+    def __init__(self, username, password, threads=THREADS,
+        cacheLocation=CACHE_LOCATION, cacheDays=CACHE_DAYS,
+        ordered=False, maxBuffered=MAX_BUFFERED, cache=None,
+        groupLimit=GROUP_LIMIT, maxArgumentLength=MAX_ARGUMENT_LENGTH,
+        retryPolicy=None, retryBudget=None, circuitBreaker=None,
+        fastParse=False, wsdl=WSDL, bulkWSDL=WSDL_BULK, observers=(),
+        rateLimiter=None, wsdlBundle=BUNDLE_LOCATION, store=None,
+        connectionPool=None):
 
-    def __init__(self, username, password, threads=THREADS):
         self._username = username
         self._password = password
         self._threads = threads
+        self._ordered = ordered
+        self._maxBuffered = maxBuffered
+        self._cache = cache
+        self._store = store
+        self._connectionPool = connectionPool
+        self._groupLimit = groupLimit
+        self._maxArgumentLength = maxArgumentLength
+        self._sizers = {}
+        self._sizersLock = threading.Lock()
+        self._cacheLocation = cacheLocation
+        self._cacheDays = cacheDays
+        self._local = threading.local()
+        self._scheduler = None
+        self._schedulerLock = threading.Lock()
+        self._flights = {}
+        self._flightsLock = threading.Lock()
+        self._retryPolicy = retryPolicy or RetryPolicy()
+        self._retryBudget = retryBudget or RetryBudget()
+        self._circuitBreaker = circuitBreaker or CircuitBreaker()
+        self._rateLimiter = rateLimiter
+        self._failures = []
+        self._failuresLock = threading.Lock()
+        self._fastParse = fastParse
+        self._wsdl = wsdl
+        self._bulkWSDL = bulkWSDL
+        self._wsdlBundle = wsdlBundle
+        self._observers = list(observers)
 
 
-    def getAll(self):
-        for response in self.getAllProductIDs():
-            product_ids = []
-            for record in response.ProductIDRecord:
-                product_ids.append(record.ProductID)
+    def getAll(self, checkpoint=None, pages=None):
+        """
+        Yield the EOX records of every product ID.
 
-            for record in self.getEOXByProductID(product_ids):
-                yield record
+        Product IDs are looked up as their pages arrive rather than a page
+        at a time, so the listing and the lookups overlap and lookup
+        requests are filled across page boundaries. Both share the Server's
+        threads. Pages of product IDs that fail are yielded as the lookups
+        go.
+
+        With a checkpoint.Checkpoint the lookups are ordered, so that the
+        progress of each page can be journaled as its records are yielded.
+        If the checkpoint already holds progress, only the product IDs that
+        failed and those not done yet are requested.
+
+        pages limits the crawl to the product IDs on the given page numbers
+        of showAllProductIDs.
+        """
+        tracker = None
+        ordered = self._ordered
+        done = None
+        if checkpoint is not None:
+            for page, product_ids in sorted(checkpoint.getFailed().items()):
+                log.info('retrying %s failed product IDs of page %s',
+                    len(product_ids), page)
+
+                failed = []
+                for response in self.getEOXByProductID(product_ids):
+                    if isinstance(response, FailedResponse):
+                        failed.extend(response.getInputValues())
+
+                    yield response
+
+                checkpoint.setFailed(page, failed)
+
+            missing = checkpoint.getMissingPages()
+            if pages is None:
+                pages = missing
+            elif missing is not None:
+                missing = dict.fromkeys(missing)
+                pages = [page for page in pages if page in missing]
+
+            partial = checkpoint.getDone()
+            partial_failed = checkpoint.getFailed()
+            tracker = PageTracker(checkpoint)
+            ordered = True
+            done = tracker.done
+
+        # Pages of product IDs that failed, put here by the thread reading
+        # the product IDs.
+        failures = deque()
+
+        def getProductIDs():
+            for response in self.getAllProductIDs(pages):
+                if isinstance(response, FailedResponse):
+                    failures.append(response)
+                    continue
+
+                product_ids = []
+                for record in response.ProductIDRecord:
+                    product_ids.append(record.ProductID)
+
+                pager = response.PaginationResponseRecord
+                if tracker is not None and pager:
+                    page = pager.PageIndex
+                    skip = partial.get(page, 0)
+                    product_ids = product_ids[skip:]
+                    tracker.addPage(page, product_ids, skip,
+                        partial_failed.get(page, ()), pager.LastIndex)
+
+                for product_id in product_ids:
+                    yield product_id
+
+        gen = self.getLookupResponses('showEOXByProductID',
+            uniqueInputs(getProductIDs()), ordered,
+            self._maxBuffered or self._threads * 2, done)
+
+        for response in gen:
+            while failures:
+                yield failures.popleft()
+
+            if tracker is not None and isinstance(response, FailedResponse):
+                tracker.fail(response.getInputValues())
+
+            yield response
+
+        while failures:
+            yield failures.popleft()
+
+        if tracker is not None:
+            tracker.finish()
+
+
+    def syncAll(self, snapshot, full=False):
+        """
+        Yield the full EOX dataset and keep a sync.Snapshot of it up to date.
+
+        The first sync, or any sync with full set, crawls everything through
+        getAll and stores it in snapshot. Later syncs only request the
+        records whose UpdatedTimeStamp changed since the last sync, merge
+        them into snapshot and then yield every record in snapshot.
+
+        The last sync date only moves forward when every page was received,
+        so records on failed pages are requested again by the next sync.
+        """
+        today = time.strftime('%Y-%m-%d')
+        last_sync = snapshot.getLastSync()
+        failed = False
+
+        if full or last_sync is None:
+            log.info('starting full sync')
+            snapshot.clear()
+            for response in self.getAll():
+                if isinstance(response, FailedResponse):
+                    failed = True
+                else:
+                    records = getattr(response, 'EOXRecord', None) or []
+                    snapshot.update([getRecordValues(r) for r in records])
+
+                yield response
+
+            if failed:
+                log.error('incomplete sync, the next sync will be full')
+            else:
+                snapshot.setLastSync(today)
+
+            return
+
+        log.info('syncing records updated since %s', last_sync)
+        updated = 0
+        gen = self.getEOXByDates(last_sync, today, SYNC_ATTRIBUTE)
+        for response in gen:
+            if isinstance(response, FailedResponse):
+                failed = True
+                yield response
+                continue
+
+            records = []
+            for record in getattr(response, 'EOXRecord', None) or []:
+                values, error = getRecordValues(record)
+                if error:
+                    continue
+
+                # Keep the input the record was first crawled with.
+                stored = snapshot.get(values['EOLProductID'])
+                if stored:
+                    values['EOXInputType'] = stored[0]['EOXInputType']
+                    values['EOXInputValue'] = stored[0]['EOXInputValue']
+
+                records.append((values, error))
+
+            snapshot.update(records)
+            updated += len(records)
+
+        if failed:
+            log.error('incomplete sync, keeping last sync date %s', last_sync)
+        else:
+            snapshot.setLastSync(today)
+
+        log.info('updated %s of %s records', updated, snapshot.getCount())
+
+        records = []
+        for values, error in snapshot.getRecords():
+            records.append(EOXRecord.fromValues(values, error))
+            if len(records) >= GROUP_LIMIT:
+                yield CachedResponse.fromRecords(records)
+                records = []
+
+        if records:
+            yield CachedResponse.fromRecords(records)
 
 
-    def getAllProductIDs(self):
-        for product in self.getResponses('showAllProductIDs', []):
+    def getAllProductIDs(self, pages=None):
+        """
+        Yield every page of product IDs, or only the given page numbers.
+        """
+        if pages is None:
+            gen = self.getResponses('showAllProductIDs', [])
+        else:
+            gen = self.dispatchRequests('showAllProductIDs',
+                [PageRequest([], page) for page in pages], self._ordered,
+                self._maxBuffered or self._threads * 2)
+
+        for product in gen:
             yield product
 
 
-    def getEOXByDates(self, startDate, endDate, eoxAttrib=None):
-        gen = self.getResponses('showEOXByDates',
-            [startDate, endDate, eoxAttrib])
+    def getPageCount(self, method, args=()):
+        """
+        Request the first page of method called with args and return the
+        number of pages it has.
+        """
+        response = self.getPage(method, list(args), 1)
+        pager = getattr(response, 'PaginationResponseRecord', None)
+        if not pager:
+            return 1
+
+        return pager.LastIndex
+
+
+    def getEOXByDates(self, startDate, endDate, eoxAttrib=None, pages=None):
+        """
+        Yield every page of records updated between the dates, or only the
+        given page numbers.
+        """
+        args = [startDate, endDate, eoxAttrib]
+        if pages is None:
+            gen = self.getResponses('showEOXByDates', args)
+        else:
+            gen = self.dispatchRequests('showEOXByDates',
+                [PageRequest(args, page) for page in pages], self._ordered,
+                self._maxBuffered or self._threads * 2)
 
         for record in gen:
             yield record        
 
 
-    def getEOXByOID(self, oids, hardwareType=None):
+    def getEOXByOID(self, oids, hardwareType=None, index=None):
         method = 'showEOXByOID'
         client = self.getClient(method)
 
-        oid_records = []
-        for oid in oids:
-            record = client.factory.create('OIDType')
-            record.OID = oid
-            record.HardwareType = hardwareType
-            oid_records.append(record)
-        
-        for record in self.getResponses(method, [oid_records]):
+        def getOIDRecords():
+            for oid in uniqueInputs(oids, normalizeInput, index):
+                record = client.factory.create('OIDType')
+                record.OID = oid
+                record.HardwareType = hardwareType
+                yield record
+
+        for record in self.getResponses(method, [getOIDRecords()]):
             yield record
 
 
-    def getEOXByProductID(self, productIDs):
+    def getEOXByProductID(self, productIDs, index=None):
+        productIDs = uniqueInputs(productIDs, normalizeInput, index)
         for record in self.getResponses('showEOXByProductID', [productIDs]):
             yield record
 
 
-    def getEOXBySWReleaseString(self, swReleaseStrings, osType=None):
+    def getEOXBySWReleaseString(self, swReleaseStrings, osType=None,
+        index=None):
+
         method = 'showEOXBySWReleseString'
         client = self.getClient(method)
         
-        swReleaseString_records = []
-        for swReleaseString in swReleaseStrings:
-            record = client.factory.create('SWReleaseStringType')
-            record.SWReleaseString = swReleaseString
-            record.OSType = osType
-            swReleaseString_records.append(record)
-
-        for record in self.getResponses(method, [swReleaseString_records]):
+        def getSWReleaseStringRecords():
+            unique = uniqueInputs(swReleaseStrings, normalizeInput, index)
+            for swReleaseString in unique:
+                record = client.factory.create('SWReleaseStringType')
+                record.SWReleaseString = swReleaseString
+                record.OSType = osType
+                yield record
+
+        gen = self.getResponses(method, [getSWReleaseStringRecords()])
+        for record in gen:
             yield record
 
 
-    def getEOXBySerialNumber(self, serialNumbers):
+    def getEOXBySerialNumber(self, serialNumbers, index=None):
+        serialNumbers = uniqueInputs(
+            serialNumbers, normalizeSerialNumber, index)
+
         gen = self.getResponses('showEOXBySerialNumber', [serialNumbers])
         for record in gen:
             yield record
 
 
+    def getEOXBatch(self, inputs):
+        """
+        Yield the responses to a mixed stream of lookups given as
+        (queryType, value, qualifier) tuples, where queryType is one of
+        BATCH_TYPES and qualifier is None or the hardware or OS type of an
+        oid or sw value.
+
+        Values are passed, as they are read, to one lookup for each query
+        type and qualifier, and every lookup runs at once on the Server's
+        threads and clients. Responses of different lookups are yielded as
+        they come, so with ordered only those of each lookup are in input
+        order. Each record's EOXInputType and EOXInputValue tell which
+        lookup it answers.
+
+        Inputs are read on a Feeder thread, at most GROUP_LIMIT times
+        maxBuffered values ahead of the lookups taking them.
+        """
+        read_ahead = self._maxBuffered or self._threads * 2
+        responses = Queue.Queue()
+        reader = Feeder(iter(inputs), responses, read_ahead * GROUP_LIMIT,
+            name='eox batch reader').start()
+
+        def getValues(values):
+            while True:
+                value = values.get()
+                if value is None:
+                    return
+
+                reader.take()
+                yield value
+
+        # Values waiting for each lookup, keyed by query type and qualifier,
+        # and the Feeder yielding each lookup's responses.
+        queues = {}
+        lookups = {}
+        exhausted = False
+        try:
+            while not exhausted or lookups:
+                tag, item, error = responses.get()
+                if tag is reader:
+                    if error is None:
+                        queryType, value, qualifier = item
+                        key = (queryType, qualifier)
+                        values = queues.get(key)
+                        if values is None:
+                            if queryType not in BATCH_TYPES:
+                                raise ValueError(
+                                    'unknown query type %s' % queryType)
+
+                            values = queues[key] = Queue.Queue()
+                            method = getattr(self, BATCH_TYPES[queryType])
+                            if queryType in ('oid', 'sw'):
+                                gen = method(getValues(values), qualifier)
+                            else:
+                                gen = method(getValues(values))
+
+                            lookup = Feeder(gen, responses, read_ahead,
+                                name='eox batch %s' % queryType).start()
+
+                            lookups[lookup] = key
+
+                        values.put(value)
+                    elif isinstance(error, StopIteration):
+                        exhausted = True
+                        for values in queues.values():
+                            values.put(None)
+                    else:
+                        raise error
+
+                    continue
+
+                if error is None:
+                    tag.take()
+                    yield item
+                elif isinstance(error, StopIteration):
+                    del lookups[tag]
+                else:
+                    raise error
+        finally:
+            reader.stop()
+            for lookup in lookups:
+                lookup.stop()
+
+            for values in queues.values():
+                values.put(None)
+
+
+    def getCache(self):
+        return self._cache
+
+
+    def getStore(self):
+        return self._store
+
+
+    def getConnectionPool(self):
+        return self._connectionPool
+
+
+    def getFailures(self):
+        """
+        Return the FailedResponse of every page that couldn't be retrieved.
+        """
+        self._failuresLock.acquire()
+        try:
+            return list(self._failures)
+        finally:
+            self._failuresLock.release()
+
+
+    def addObserver(self, observer):
+        """
+        Have a metrics.Observer told about every page requested from now on.
+        """
+        self._observers = self._observers + [observer]
+
+
+    def getObservers(self):
+        return list(self._observers)
+
+
+    def notify(self, event, *args):
+        for observer in self._observers:
+            try:
+                getattr(observer, event)(*args)
+            except Exception:
+                log.exception('observer %r failed handling %s', observer,
+                    event)
+
+
     def getClient(self, method):
+        """
+        Return a ready client for method owned by the calling thread.
+
+        Each thread keeps one client per WSDL built from the process-wide
+        WSDL cache so that the WSDL is only fetched and parsed once, or not
+        at all if it is in the Server's WSDL bundle. Suds clients can't be
+        shared safely between threads. With fastParse the clients return the
+        raw XML of each reply. With a transport.ConnectionPool the clients
+        of every thread make their requests through it. The thread's
+        clients.ReplyMeter measures the replies of all its clients.
+        """
         wsdl = None
         if method in self.bulkMethods:
-            wsdl = WSDL_BULK
+            wsdl = self._bulkWSDL
         else:
-            wsdl = WSDL
+            wsdl = self._wsdl
+
+        clients = getattr(self._local, 'clients', None)
+        if clients is None:
+            clients = self._local.clients = {}
 
-        return Client(wsdl, username=self._username, password=self._password)
+        client = clients.get(wsdl)
+        if client is None:
+            # Imported here so that scripts answered without a request, from
+            # the record cache or with a usage error, never pay for it.
+            from suds.client import Client
 
+            kwargs = {'plugins': [self.getReplyMeter()]}
+            if self._connectionPool is not None:
+                from clients import PooledTransport
+                kwargs['transport'] = PooledTransport(self._connectionPool)
+
+            # pylint: disable-msg=W0142
+            client = Client(wsdl,
+                cache=getWSDLCache(self._cacheLocation, self._cacheDays,
+                    self._wsdlBundle),
+                cachingpolicy=1,
+                retxml=self._fastParse,
+                username=self._username,
+                password=self._password,
+                **kwargs)
+
+            if self._fastParse:
+                setInjectable(client)
+
+            clients[wsdl] = client
+
+        return client
+
+
+    def getReplyMeter(self):
+        """
+        Return the clients.ReplyMeter of the calling thread's clients.
+        """
+        meter = getattr(self._local, 'meter', None)
+        if meter is None:
+            from clients import ReplyMeter
+            meter = self._local.meter = ReplyMeter()
+
+        return meter
+
+
+    def getResponses(self, method, args, ordered=None, maxBuffered=None):
+        """
+        Return a generator of the responses to method called with args.
+
+        The first argument of a lookup method may be any iterable, such as
+        a file. It is read lazily as requests are dispatched.
+
+        When ordered is true responses are yielded in input and page order,
+        otherwise each one is yielded as soon as it is received. maxBuffered
+        caps how many responses are held in memory at once; no new requests
+        are made, and no more input is read, while the cap is reached. Both
+        default to the values the Server was created with.
+        """
+        if ordered is None:
+            ordered = self._ordered
+
+        if maxBuffered is None:
+            maxBuffered = self._maxBuffered or self._threads * 2
 
-    def getResponses(self, method, args):
         if method in self.bulkMethods:
-            return self.getPaginatedResponses(method, args)
+            return self.getPaginatedResponses(
+                method, args, ordered, maxBuffered)
+
+        if method in self.coalescedMethods or (
+            self._cache is not None and method in self.cachedMethods):
+
+            return self.getLookupResponses(
+                method, args[0], ordered, maxBuffered)
+
+        return self.getChunkedResponses(method, args, ordered, maxBuffered)
+
+
+    def getPaginatedResponses(self, method, args, ordered=False,
+        maxBuffered=None):
+
+        return self.dispatchRequests(method, [args], ordered, maxBuffered)
+
+
+    def getChunkedResponses(self, method, args, ordered=False,
+        maxBuffered=None):
+
+        return self.dispatchRequests(
+            method, self.getChunkedArgs(method, args[0]), ordered,
+            maxBuffered)
+
+
+    def getLookupResponses(self, method, values, ordered=False,
+        maxBuffered=None, done=None):
+        """
+        Yield responses to method for string input values, answering what
+        it can from the Server's record cache and sharing in-flight
+        requests with other callers of this Server.
+
+        Cached records are yielded GROUP_LIMIT at a time as their values are
+        read and only the values that missed the cache are requested. Their
+        records are added to the cache as they arrive. Values that get no
+        records back are cached as negative entries, unless their request
+        failed.
+
+        Values already being requested by another caller aren't requested
+        again. Their records are collected while that request is in flight
+        and yielded once it completes. If the other caller gives up before
+        then the values are requested here after all.
+
+        done is called with the list of values of each request once its
+        last page has been yielded or has failed. Values aren't shared with
+        other callers when done is given, so that every value requested is
+        in the list of one call.
+        """
+        cache = None
+        if self._cache is not None and method in self.cachedMethods:
+            cache = self._cache
+
+        coalesce = method in self.coalescedMethods and done is None
+
+        # Values this call is requesting that other callers may wait on,
+        # values waited on instead of requested, and values of requests in
+        # flight that already have records in the cache or have failed.
+        owned = {}
+        shared = []
+        stored = {}
+        failed = {}
+
+        def getRequests():
+            sizer = self.getSizer(method)
+            chunker = Chunker(sizer.getSize, sizer.maxLength)
+            hits = []
+            try:
+                for value in values:
+                    if cache is not None:
+                        cached = cache.get(method, value)
+                        if cached is not None:
+                            for record_values, error in cached:
+                                hits.append(EOXRecord.fromValues(
+                                    record_values, error))
+
+                            if len(hits) >= GROUP_LIMIT:
+                                yield CachedResponse.fromRecords(hits)
+                                hits = []
+
+                            continue
+
+                    if coalesce:
+                        flight = self._boardFlight(method, value)
+                        if flight is not None:
+                            shared.append((value, flight))
+                            continue
+
+                        owned[value] = True
+
+                    for chunk in chunker.add(value):
+                        yield [','.join(chunk)]
+
+                if hits:
+                    yield CachedResponse.fromRecords(hits)
+
+                chunk = chunker.flush()
+                if chunk:
+                    yield [','.join(chunk)]
+            except GeneratorExit:
+                # Requests are read on a Feeder thread, which may board
+                # flights after this call has given up on its own.
+                self._landFlights(method, owned.keys(), False)
+                raise
+
+        def requestDone(args):
+            request_values = args[0].split(',')
+            if coalesce:
+                self._landFlights(method, request_values, True)
+
+            negative = {}
+            for value in request_values:
+                owned.pop(value, None)
+                if not stored.pop(value, False) \
+                    and not failed.pop(value, False):
+
+                    negative[(method, value)] = []
+
+            if cache is not None and negative:
+                cache.put(negative)
+
+            if done is not None:
+                done(request_values)
+
+        try:
+            gen = self.dispatchRequests(
+                method, getRequests(), ordered, maxBuffered, requestDone)
+
+            for response in gen:
+                if isinstance(response, FailedResponse):
+                    request_values = response.getInputValues()
+                    for value in request_values:
+                        failed[value] = True
+
+                    # Waiters request these again rather than go without.
+                    if coalesce:
+                        self._landFlights(method, request_values, False)
+
+                elif not isinstance(response, CachedResponse):
+                    self._storeRecords(method, response.EOXRecord, cache,
+                        stored)
+
+                yield response
+        finally:
+            # Let anyone waiting on values this call never finished request
+            # them themselves.
+            self._landFlights(method, owned.keys(), False)
+
+        retry = []
+        records = []
+        for value, flight in shared:
+            flight.wait()
+            if not flight.completed:
+                retry.append(value)
+                continue
+
+            records.extend(flight.records)
+            if len(records) >= GROUP_LIMIT:
+                yield CachedResponse.fromRecords(records)
+                records = []
+
+        if records:
+            yield CachedResponse.fromRecords(records)
+
+        if retry:
+            gen = self.getLookupResponses(method, retry, ordered, maxBuffered)
+            for response in gen:
+                yield response
+
+
+    def _storeRecords(self, method, records, cache, stored):
+        """
+        Add records to the flights waiting on them and to the cache. Values
+        in stored already have records in the cache, so later pages are
+        appended to them.
+        """
+        entries = {}
+        for record in records:
+            record_values = None
+            for value in getInputValues(record):
+                flight = self._flights.get((method, value))
+                if flight is not None:
+                    flight.records.append(record)
+
+                if cache is not None:
+                    if record_values is None:
+                        record_values = getRecordValues(record)
+
+                    entries.setdefault(value, []).append(record_values)
+
+        new = {}
+        old = {}
+        for value, value_records in entries.items():
+            if value in stored:
+                old[(method, value)] = value_records
+            else:
+                new[(method, value)] = value_records
+                stored[value] = True
+
+        if new:
+            cache.put(new)
+
+        if old:
+            cache.extend(old)
+
+
+    def _boardFlight(self, method, value):
+        """
+        Return the Flight of another caller already requesting value, or
+        None after starting a Flight for this caller to request it.
+        """
+        key = (method, value)
+        self._flightsLock.acquire()
+        try:
+            flight = self._flights.get(key)
+            if flight is None:
+                self._flights[key] = Flight()
+
+            return flight
+        finally:
+            self._flightsLock.release()
+
+
+    def _landFlights(self, method, values, completed):
+        self._flightsLock.acquire()
+        try:
+            for value in values:
+                flight = self._flights.pop((method, value), None)
+                if flight is not None:
+                    flight.land(completed)
+        finally:
+            self._flightsLock.release()
+
+
+    def getChunkedArgs(self, method, values):
+        """
+        Lazily yield request arguments for values split into chunks sized by
+        the method's ChunkSizer. Chunks of strings are joined into one
+        comma-separated string.
+        """
+        sizer = self.getSizer(method)
+        for chunk in iterChunks(values, sizer.getSize, sizer.maxLength):
+            if isinstance(chunk[0], types.StringTypes):
+                chunk = ','.join(chunk)
+
+            yield [chunk]
+
+
+    def getSizer(self, method):
+        """
+        Return the ChunkSizer adapting the request size of method.
+        """
+        self._sizersLock.acquire()
+        try:
+            sizer = self._sizers.get(method)
+            if sizer is None:
+                policy = {
+                    'maximum': self._groupLimit,
+                    'maxLength': self._maxArgumentLength,
+                    }
+
+                policy.update(self.chunkPolicies.get(method, {}))
+                sizer = self._sizers[method] = ChunkSizer(**policy)
+
+            return sizer
+        finally:
+            self._sizersLock.release()
+
+
+    def dispatchRequests(self, method, requests, ordered=False,
+        maxBuffered=None, done=None):
+        """
+        Yield every page of every request.
+
+        Each request is a list of arguments for method, a PageRequest for
+        just one page of method or a Response already at hand, which is
+        yielded in its turn without requesting anything.
+        Every page is a separate unit of work for the Server's scheduler,
+        grouped by request so that pages of different requests are
+        interleaved fairly. Pages after the first are queued once the first
+        page reports how many there are.
+
+        Requests other than a list or tuple of them are read on a Feeder
+        thread, at most maxBuffered ahead, so pages keep being yielded while
+        the next request is waiting on slow input.
+
+        At most maxBuffered pages are queued, in flight or waiting to be
+        yielded at once, so nothing more is requested until the consumer
+        catches up. When ordered is true pages are yielded in request and
+        page order and held in a reorder buffer until their turn. The page
+        due next is always requested, even when the buffer is full, so the
+        buffer can exceed maxBuffered by one page at most.
+
+        done is called with a request's arguments once its last page has
+        been yielded or has failed. It isn't called for Responses.
+
+        A page that fails for good is yielded as a FailedResponse and kept
+        in the Server's failures. If it was the first page of its request
+        none of the request's later pages are requested.
+        """
+        if maxBuffered is None:
+            maxBuffered = self._threads * 2
+
+        scheduler = self.getScheduler()
+        completions = Queue.Queue()
+        token = object()
+        arguments = {}
+        next_request = 0
+
+        # Requests read but not yet submitted.
+        waiting = deque()
+        feeder = None
+        exhausted = True
+        if isinstance(requests, (list, tuple)):
+            waiting.extend(requests)
         else:
-            return self.getChunkedResponses(method, args)
+            exhausted = False
+            feeder = Feeder(iter(requests), completions, maxBuffered,
+                name='eox feeder').start()
 
+        # (request, page) keys of pages waiting to be submitted.
+        pending = []
+        outstanding = 0
 
-    def getPaginatedResponses(self, method, args):
-        client = self.getClient(method)
+        # Reorder state: the next page due and the pages received early.
+        head = (0, 1)
+        last_pages = {}
+        remaining = {}
+        received = {}
 
-        first_thread = PagingThread(client, method, args, 1)
-        first_thread.start()
-        first_thread.join()
-        first_response = first_thread.getResponse()
-        if not first_response:
-            return
-    
-        yield first_response
-    
-        pager = getattr(first_response, 'PaginationResponseRecord', None)
-        if not pager:
-            return
-        
-        total_pages = pager.LastIndex
-        next_page = 2
-    
-        threads = {}
-        while True:
-            for key, thread in threads.items():
-                if not thread.isAlive():
-                    response = thread.getResponse()
-                    yield response
-                    del(threads[key])
-    
-            if len(threads.keys()) == 0 and next_page > total_pages:
-                break
-    
-            while next_page <= total_pages \
-                and len(threads.keys()) < self._threads:
+        try:
+            while True:
+                while outstanding < maxBuffered \
+                    or (ordered and pending and pending[0] == head):
 
-                thread = PagingThread(client, method, args, next_page)
-                threads[next_page] = thread
-                next_page += 1
-                thread.start()
+                    if pending:
+                        request, page = heapq.heappop(pending)
+                    elif waiting:
+                        arguments[next_request] = waiting.popleft()
+                        if feeder is not None:
+                            feeder.take()
 
+                        request, page = next_request, 1
+                        next_request += 1
+                    else:
+                        break
 
-    def getChunkedResponses(self, method, args):
-        chunked_args = chunkList(args[0])
-        total_chunks = len(chunked_args)
-        next_chunk = 1
+                    if isinstance(arguments[request], Response):
+                        completions.put(
+                            ((request, page), arguments[request], None))
+                    else:
+                        request_args, request_page = getPageArgs(
+                            arguments[request], page)
 
-        threads = {}
-        while True:
-            for key, thread in threads.items():
-                if not thread.isAlive():
-                    responses = thread.getResponses()
-                    for response in responses:
+                        scheduler.submit(self.requestPage,
+                            (method, request_args, request_page, time.time()),
+                            (request, page), completions, (token, request))
+
+                    outstanding += 1
+
+                if outstanding == 0 and exhausted and not waiting:
+                    break
+
+                tag, response, error = completions.get()
+                if tag is feeder:
+                    if error is None:
+                        waiting.append(response)
+                    elif isinstance(error, StopIteration):
+                        exhausted = True
+                    else:
+                        raise error
+
+                    continue
+
+                request, page = tag
+
+                if error:
+                    failed_args, failed_page = getPageArgs(
+                        arguments[request], page)
+
+                    log.error('failed requesting page %s of request %s: %s',
+                        failed_page, request + 1, error)
+
+                    response = FailedResponse(
+                        method, failed_args, failed_page, error)
+
+                    self._failuresLock.acquire()
+                    try:
+                        self._failures.append(response)
+                    finally:
+                        self._failuresLock.release()
+
+                if page == 1:
+                    last_page = 1
+                    pager = getattr(response, 'PaginationResponseRecord', None)
+                    if pager and not isinstance(
+                        arguments[request], PageRequest):
+
+                        last_page = pager.LastIndex
+
+                    last_pages[request] = last_page
+                    remaining[request] = last_page
+                    for next_page in range(2, last_page + 1):
+                        heapq.heappush(pending, (request, next_page))
+
+                remaining[request] -= 1
+                if not ordered:
+                    finished = None
+                    if remaining[request] == 0:
+                        del(remaining[request])
+                        del(last_pages[request])
+                        finished = arguments.pop(request)
+
+                    outstanding -= 1
+                    if response:
                         yield response
-                    del(threads[key])
 
-            if len(threads.keys()) == 0 and next_chunk > total_chunks:
-                break
-    
-            while next_chunk <= total_chunks \
-                and len(threads.keys()) < self._threads:
+                    if done and finished is not None \
+                        and not isinstance(finished, Response):
+
+                        done(finished)
+
+                    continue
+
+                if remaining[request] == 0:
+                    del(remaining[request])
+
+                received[(request, page)] = response
+                while head in received:
+                    response = received.pop(head)
+                    outstanding -= 1
+
+                    finished = None
+                    request, page = head
+                    if page < last_pages[request]:
+                        head = (request, page + 1)
+                    else:
+                        del(last_pages[request])
+                        finished = arguments.pop(request)
+                        head = (request + 1, 1)
+
+                    if response:
+                        yield response
+
+                    if done and finished is not None \
+                        and not isinstance(finished, Response):
 
-                parsed_args = chunked_args[next_chunk-1]
-                if isinstance(parsed_args[0], types.StringTypes):
-                    parsed_args = ','.join(parsed_args)
+                        done(finished)
+        finally:
+            if feeder is not None:
+                feeder.stop()
 
-                thread = ChunkingThread(self, method, [parsed_args], next_chunk)
-                threads[next_chunk] = thread
-                next_chunk += 1
-                thread.start()
 
+    def requestPage(self, method, args, page, submitted):
+        """
+        Get a page queued for a worker at submitted and tell the observers
+        how long it waited. Called from the worker threads.
+        """
+        if self._observers:
+            self.notify('requestStarted', method, page,
+                time.time() - submitted)
 
-class PagingThread(threading.Thread):
-    def __init__(self, client, method, args, page):
-        self._client = client
-        self._method = method
-        self._args = args
-        self._page = page
-        self._response = None
-        threading.Thread.__init__(self)
-        self.name = "page %s" % self._page
+        return self.getPage(method, args, page)
 
 
-    def run(self):
-        pr = self._client.factory.create('PaginationRequestRecordType')
-        pr.PageIndex = self._page
-        args = self._args + [pr]
-        log.info('requesting page %s', self._page)
+    def getPage(self, method, args, page):
+        """
+        Request one page of method and return it as a records.Response.
+        Called from the worker threads.
 
+        With fastParse the reply is parsed straight from its XML and only
+        handed to suds when it holds something the fast parser doesn't
+        recognize.
+
+        Failures the Server's RetryPolicy considers transient are retried
+        after a backoff delay while attempts and the RetryBudget last. No
+        request is made while the CircuitBreaker is open. Every attempt
+        waits its turn from the RateLimiter, if there is one, which is told
+        of successes and of throttling.
+
+        Observers are told of each retry and of how the page ended. EOX
+        records received are added to the Server's store.RecordStore, if it
+        has one.
+        """
+        client = self.getClient(method)
+        meter = self.getReplyMeter()
+        pr = client.factory.create('PaginationRequestRecordType')
+        pr.PageIndex = page
+        args = args + [pr]
+        log.info('requesting page %s', page)
+
+        policy = self._retryPolicy
+        breaker = self._circuitBreaker
+        limiter = self._rateLimiter
+        self._retryBudget.deposit()
+
+        attempt = 0
+        timeouts = 0
+        began = time.time()
         while True:
+            attempt += 1
+            breaker.wait()
+            if limiter is not None:
+                limiter.acquire()
+
+            start = time.time()
+            meter.clear()
             try:
                 # pylint: disable-msg=W0142
-                self._response = getattr(
-                    self._client.service, self._method)(*args)
+                response = getattr(client.service, method)(*args)
                 break
-            except WebFault, ex:
-                fault = getattr(ex, 'fault', None)
-                if fault and fault.faultstring == 'Timeout':
-                    log.warn('timeout requesting page %s, retrying', self._page)
-                    continue
+            except Exception, ex:
+                if limiter is not None and policy.isThrottling(ex):
+                    limiter.recordThrottle(start)
+
+                if not policy.isRetryable(ex):
+                    # The service answered, it just didn't like the request.
+                    breaker.recordSuccess()
+                    self.notify('requestFailed', method, page, attempt, ex,
+                        time.time() - began)
+
+                    raise
+
+                timeouts += 1
+                breaker.recordFailure()
+                if not policy.shouldRetry(ex, attempt):
+                    log.error('giving up on page %s after %s attempts',
+                        page, attempt)
 
-                raise ex
+                    self.notify('requestFailed', method, page, attempt, ex,
+                        time.time() - began)
 
-        pager = getattr(
-            self._response, 'PaginationResponseRecord', None)
+                    raise
 
+                if not self._retryBudget.withdraw():
+                    log.error('retry budget spent, giving up on page %s',
+                        page)
+
+                    self.notify('requestFailed', method, page, attempt, ex,
+                        time.time() - began)
+
+                    raise
+
+                delay = policy.getDelay(attempt)
+                log.warn('%s requesting page %s, retrying in %.1f seconds',
+                    describeError(ex), page, delay)
+
+                self.notify('requestRetried', method, page, attempt, ex,
+                    delay)
+
+                time.sleep(delay)
+
+        breaker.recordSuccess()
+        if limiter is not None:
+            limiter.recordSuccess()
+
+        # The reply's size and arrival time are taken before suds or the
+        # fast parser touch it, so parse time covers suds unmarshalling too.
+        received = meter.replyTime or time.time()
+        size = meter.replySize
+        if self._fastParse:
+            xml = response
+            response = parseResponse(xml)
+            if response is None:
+                log.debug('parsing page %s with suds', page)
+                # pylint: disable-msg=W0142
+                response = convertResponse(getattr(client.service, method)(
+                    *args, **{'__inject': {'reply': xml}}))
+        else:
+            response = convertResponse(response)
+
+        records = getattr(response, 'EOXRecord', None)
+        if self._store is not None and records:
+            self._store.update(
+                [getRecordValues(record) for record in records])
+
+        if self._observers:
+            self.notify('requestFinished', method, page, attempt,
+                received - began, size, time.time() - received,
+                len(response.EOXRecord) + len(response.ProductIDRecord))
+
+        pager = getattr(response, 'PaginationResponseRecord', None)
         if pager:
             log.info('received %s of %s records on page %s of %s',
                 pager.PageRecords,
@@ -248,42 +1190,329 @@ class PagingThread(threading.Thread):
                 pager.PageIndex,
                 pager.LastIndex)
 
+        if page == 1 and method not in self.bulkMethods:
+            values = args[0]
+            if isinstance(values, types.StringTypes):
+                values = values.split(',')
 
-    def getResponse(self):
-        return self._response
+            self.getSizer(method).observe(
+                len(values), time.time() - start, timeouts, pager)
 
+        return response
 
-class ChunkingThread(threading.Thread):
-    def __init__(self, server, method, args, chunk):
-        self._server = server
-        self._method = method
-        self._args = args
-        self._chunk = chunk
-        self._responses = []
-        threading.Thread.__init__(self)
-        self.name = "chunk %s" % self._chunk
 
+    def getScheduler(self):
+        """
+        Return the Server's scheduler. Every request made through this Server
+        shares its threads, so threads is the most HTTP requests that will be
+        in flight at once.
+        """
+        self._schedulerLock.acquire()
+        try:
+            if self._scheduler is None:
+                self._scheduler = Scheduler(self._threads, name='eox')
 
-    def run(self):
-        log.info('requesting chunk %s', self._chunk)
-        response_gen = self._server.getPaginatedResponses(
-            self._method, self._args)
+            return self._scheduler
+        finally:
+            self._schedulerLock.release()
 
-        for response in response_gen:
-            self._responses.append(response)
 
-        log.info('received chunk %s', self._chunk)
+    def close(self):
+        """
+        Stop the Server's worker threads.
+        """
+        self._schedulerLock.acquire()
+        try:
+            if self._scheduler is not None:
+                self._scheduler.stop(timeout=1)
+                self._scheduler = None
+        finally:
+            self._schedulerLock.release()
 
 
-    def getResponses(self):
-        return self._responses
+class PageRequest(object):
+    """
+    Request for only the given page of a paginated method called with args.
+    """
 
+    __slots__ = ('args', 'page')
 
-def chunkList(original, size=GROUP_LIMIT):
-    chunked_lists = []
-    while original:
-        newlist = original[:size]
-        original = original[size:]
-        chunked_lists.append(newlist)
+    def __init__(self, args, page):
+        self.args = args
+        self.page = page
+
+
+def getPageArgs(request, page):
+    """
+    Return the arguments and page number to call for page of request.
+    """
+    if isinstance(request, PageRequest):
+        return request.args, request.page
+
+    return request, page
+
+
+class CachedResponse(Response):
+    """
+    Response holding records that were kept locally, such as those answered
+    from a RecordCache or collected from another caller's request.
+    """
+
+    __slots__ = ()
+
+
+class FailedResponse(Response):
+    """
+    Response standing in for a page that couldn't be retrieved. It has no
+    records, only an EOXError describing the failure.
+    """
+
+    __slots__ = ('method', 'args', 'page', 'error')
+
+    def __init__(self, method, args, page, error):
+        # Lookups send their input values comma-separated as the first
+        # argument.
+        value = None
+        if method not in Server.bulkMethods \
+            and isinstance(args[0], types.StringTypes):
+
+            value = args[0]
+
+        error_record = EOXError(
+            'REQUEST_FAILED',
+            'page %s of %s failed: %s' % (page, method, describeError(error)),
+            None,
+            value)
+
+        fields = {
+            'EOXRecord': (),
+            'ProductIDRecord': (),
+            'PaginationResponseRecord': None,
+            'EOXError': error_record,
+            'method': method,
+            'args': args,
+            'page': page,
+            'error': error,
+            }
+
+        for name, field in fields.items():
+            object.__setattr__(self, name, field)
+
+
+    def __reduce__(self):
+        return (self.__class__,
+            (self.method, self.args, self.page, self.error))
+
+
+    def getInputValues(self):
+        """
+        Return the input values whose records were on the failed page.
+        """
+        value = self.EOXError.ErrorDataValue
+        if not value:
+            return []
+
+        return value.split(',')
+
+
+def describeError(error):
+    fault = getattr(error, 'fault', None)
+    if fault is not None:
+        return fault.faultstring
+
+    return str(error) or error.__class__.__name__
+
+
+def setInjectable(client):
+    """
+    Let client's methods be called with an __inject reply along with their
+    arguments. Newer suds versions reject __inject as an extra argument
+    unless told not to, older ones don't have the option.
+    """
+    try:
+        client.set_options(extraArgumentErrors=False)
+    except AttributeError:
+        pass
+
+
+def getRecordValues(record):
+    """
+    Return a dict of the record's RECORD_COLUMNS values as stripped strings
+    and a dict of its EOXError fields, or None if it has no error. Accepts
+    records.EOXRecord objects as well as suds records.
+    """
+    if isinstance(record, EOXRecord):
+        # Its fields are already stripped strings.
+        values = dict(zip(RECORD_COLUMNS, record.getFields()))
+    else:
+        values = {}
+        for column_name in RECORD_COLUMNS:
+            column = getattr(record, column_name, '')
+            value = None
+            if column is None:
+                value = ''
+            elif isinstance(column, types.StringTypes):
+                value = column
+            else:
+                value = column.value or ''
+
+            values[column_name] = value.strip()
+
+    error = getattr(record, 'EOXError', None)
+    if not error:
+        return values, None
+
+    error_values = {}
+    for column_name in ERROR_COLUMNS:
+        error_values[column_name] = getattr(error, column_name, None)
+
+    if error_values['ErrorDataType'] == 'PRODUCT_ID':
+        values['EOLProductID'] = error_values['ErrorDataValue'] or ''
+
+    return values, error_values
+
+
+class Flight(object):
+    """
+    A value being requested by one caller that other callers wait on.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.completed = False
+        self._landed = threading.Event()
 
-    return chunked_lists
+
+    def land(self, completed):
+        self.completed = completed
+        self._landed.set()
+
+
+    def wait(self):
+        self._landed.wait()
+
+
+class InputIndex(object):
+    """
+    Maps the normalized input values of a lookup back to every position
+    they had in the original input.
+
+    Pass an InputIndex to a lookup method and then call getPositions with
+    each record received to find which inputs it answers.
+    """
+
+    def __init__(self):
+        self.normalize = normalizeInput
+        self._positions = {}
+
+
+    def add(self, position, value):
+        """
+        Record value at position. Return True if value wasn't seen before.
+        """
+        positions = self._positions.get(value)
+        if positions is None:
+            self._positions[value] = [position]
+            return True
+
+        positions.append(position)
+        return False
+
+
+    def getPositions(self, record):
+        positions = []
+        for value in getInputValues(record):
+            positions.extend(self._positions.get(self.normalize(value), []))
+
+        return positions
+
+
+def normalizeInput(value):
+    return value.strip()
+
+
+def normalizeSerialNumber(value):
+    return value.strip().upper()
+
+
+def uniqueInputs(values, normalize=normalizeInput, index=None,
+    window=UNIQUE_WINDOW):
+    """
+    Yield each normalized value once, dropping empty values.
+
+    Without an index only the last window distinct values are remembered,
+    so a value repeated after more than window others is looked up again.
+    When index is given every position of every value is recorded in it,
+    which takes memory for every input, and every repeat is dropped.
+    """
+    seen = {}
+    order = deque()
+    if index is not None:
+        index.normalize = normalize
+
+    position = 0
+    for value in values:
+        value = normalize(value)
+        if index is not None:
+            new = index.add(position, value)
+        else:
+            new = value not in seen
+            if new:
+                seen[value] = True
+                order.append(value)
+                if len(order) > window:
+                    del seen[order.popleft()]
+
+        if value and new:
+            yield value
+
+        position += 1
+
+
+def getInputValues(record):
+    """
+    Return the input values a record answers. Records with an error and no
+    EOXInputValue answer their error's ErrorDataValue.
+    """
+    input_values = getattr(record, 'EOXInputValue', None)
+    if not input_values:
+        error = getattr(record, 'EOXError', None)
+        if error:
+            input_values = getattr(error, 'ErrorDataValue', None)
+
+    if not input_values:
+        return []
+
+    values = []
+    for value in input_values.split(','):
+        value = value.strip()
+        if value:
+            values.append(value)
+
+    return values
+
+
+_wsdlCaches = {}
+_wsdlCachesLock = threading.Lock()
+
+def getWSDLCache(location=CACHE_LOCATION, days=CACHE_DAYS, bundle=None):
+    """
+    Return the process-wide clients.WSDLCache for the on-disk cache location,
+    holding the WSDL bundle at path bundle if there is one.
+    """
+    _wsdlCachesLock.acquire()
+    try:
+        cache = _wsdlCaches.get((location, bundle))
+        if cache is None:
+            from clients import WSDLCache
+
+            cache = _wsdlCaches[(location, bundle)] = WSDLCache(
+                location, days, bundle and loadBundle(bundle))
+
+        return cache
+    finally:
+        _wsdlCachesLock.release()
+
+
+def chunkList(original, size=GROUP_LIMIT):
+    return list(iterChunks(original, size))
@@ -0,0 +1,266 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.extsort')
+
+import heapq
+import marshal
+import os
+import shutil
+import tempfile
+
+from records import RECORD_COLUMNS
+
+# Columns identifying a record, in sort order.
+KEY_COLUMNS = ['EOLProductID', 'UpdatedTimeStamp']
+
+# Columns describing the lookup that found a record rather than the record,
+# which diffs ignore.
+INPUT_COLUMNS = ['EOXInputType', 'EOXInputValue']
+
+# Most rows held in memory at once and runs merged at once.
+BUFFER_ROWS = 50000
+MERGE_WIDTH = 64
+
+ADDED = 'added'
+CHANGED = 'changed'
+REMOVED = 'removed'
+
+
+class ExternalSorter(object):
+    """
+    Sorts more rows than fit in memory.
+
+    Rows are read bufferRows at a time, sorted and spilled to a run file in
+    directory, or a temporary directory of their own. Runs are then merged
+    at most mergeWidth at a time, in as many passes as it takes. Runs are
+    written and read back in batches of bufferRows / mergeWidth rows, so a
+    merge holds no more rows than a buffer. Rows that don't fill one buffer
+    are never written to disk.
+
+    Rows with equal keys keep the order they were read in.
+    """
+
+    def __init__(self, key, bufferRows=BUFFER_ROWS, mergeWidth=MERGE_WIDTH,
+        directory=None):
+
+        self.key = key
+        self.bufferRows = bufferRows
+        self.mergeWidth = max(mergeWidth, 2)
+        self.runBatch = max(bufferRows // self.mergeWidth, 1)
+        self.directory = directory
+        self._tempDirectory = None
+        self._runs = 0
+
+
+    def sort(self, rows):
+        """
+        Yield rows, an iterable of lists of values, sorted by key.
+        """
+        key = self.key
+        runs = []
+        buffer = []
+        for row in rows:
+            buffer.append((key(row), len(runs), len(buffer), row))
+            if len(buffer) >= self.bufferRows:
+                buffer.sort()
+                runs.append(self._writeRun(buffer))
+                buffer = []
+
+        buffer.sort()
+        if not runs:
+            for item in buffer:
+                yield item[3]
+
+            return
+
+        if buffer:
+            runs.append(self._writeRun(buffer))
+            buffer = []
+
+        # Merged runs keep the order of the runs they were merged from, so
+        # rows with equal keys stay in the order they were read.
+        while len(runs) > self.mergeWidth:
+            log.info('merging %s sorted runs %s at a time', len(runs),
+                self.mergeWidth)
+
+            merged = []
+            for start in range(0, len(runs), self.mergeWidth):
+                group = runs[start:start + self.mergeWidth]
+                if len(group) == 1:
+                    merged.append(group[0])
+                    continue
+
+                merged.append(self._writeRun(self._merge(group, True)))
+                for path in group:
+                    os.remove(path)
+
+            runs = merged
+
+        for row in self._merge(runs, False):
+            yield row
+
+        for path in runs:
+            os.remove(path)
+
+
+    def close(self):
+        """
+        Remove every run file left behind.
+        """
+        if self._tempDirectory is not None:
+            shutil.rmtree(self._tempDirectory, True)
+            self._tempDirectory = None
+
+
+    def _writeRun(self, items):
+        """
+        Write (key, run, position, row) items in order to a new run file and
+        return its path.
+        """
+        if self._tempDirectory is None:
+            self._tempDirectory = tempfile.mkdtemp(prefix='eox-sort-',
+                dir=self.directory)
+
+        path = os.path.join(self._tempDirectory, 'run-%06d' % self._runs)
+        self._runs += 1
+        output = open(path, 'wb')
+        try:
+            batch = []
+            for item in items:
+                batch.append(item[3])
+                if len(batch) >= self.runBatch:
+                    marshal.dump(batch, output)
+                    batch = []
+
+            if batch:
+                marshal.dump(batch, output)
+        finally:
+            output.close()
+
+        return path
+
+
+    def _merge(self, paths, decorated):
+        """
+        Yield the rows of the run files at paths in key order, as (key, run,
+        position, row) items if decorated.
+        """
+        key = self.key
+
+        def readRun(run, path):
+            input = open(path, 'rb')
+            try:
+                position = 0
+                while True:
+                    try:
+                        batch = marshal.load(input)
+                    except EOFError:
+                        return
+
+                    for row in batch:
+                        yield (key(row), run, position, row)
+                        position += 1
+            finally:
+                input.close()
+
+        for item in heapq.merge(*[readRun(run, path)
+            for run, path in enumerate(paths)]):
+
+            if decorated:
+                yield item
+            else:
+                yield item[3]
+
+
+def getKey(columns=RECORD_COLUMNS, keyColumns=KEY_COLUMNS):
+    """
+    Return a function giving the key of a row of values of columns.
+    """
+    indexes = [columns.index(column) for column in keyColumns]
+
+    def key(row):
+        return tuple([row[index] for index in indexes])
+
+    return key
+
+
+def dedupeRecords(rows, key):
+    """
+    Yield the first of each run of rows sorted by key with equal keys.
+    """
+    last = None
+    first = True
+    for row in rows:
+        row_key = key(row)
+        if first or row_key != last:
+            first = False
+            last = row_key
+            yield row
+
+
+def diffRecords(oldRows, newRows, columns=RECORD_COLUMNS):
+    """
+    Yield (change, row) for each EOLProductID that is new, changed or gone
+    from oldRows to newRows, both rows of values of columns sorted by
+    KEY_COLUMNS. change is ADDED, CHANGED or REMOVED and row is the new row,
+    or the old one for REMOVED.
+
+    Only the last row of each EOLProductID, the most recently updated, is
+    compared, and columns in INPUT_COLUMNS are ignored.
+    """
+    product_index = columns.index('EOLProductID')
+    compared = [index for index, column in enumerate(columns)
+        if column not in INPUT_COLUMNS]
+
+    def getLatest(rows):
+        last = None
+        for row in rows:
+            if last is not None and row[product_index] != last[product_index]:
+                yield last
+
+            last = row
+
+        if last is not None:
+            yield last
+
+    old = getLatest(oldRows)
+    new = getLatest(newRows)
+    old_row = next(old, None)
+    new_row = next(new, None)
+    while old_row is not None or new_row is not None:
+        if new_row is None or (old_row is not None
+            and old_row[product_index] < new_row[product_index]):
+
+            yield REMOVED, old_row
+            old_row = next(old, None)
+        elif old_row is None \
+            or new_row[product_index] < old_row[product_index]:
+
+            yield ADDED, new_row
+            new_row = next(new, None)
+        else:
+            if [old_row[index] for index in compared] \
+                != [new_row[index] for index in compared]:
+
+                yield CHANGED, new_row
+
+            old_row = next(old, None)
+            new_row = next(new, None)
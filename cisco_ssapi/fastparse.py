@@ -0,0 +1,168 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.fastparse')
+
+from cStringIO import StringIO
+
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+from records import EOXError, EOXRecord, Pager, ProductRecord, Response
+from records import ERROR_COLUMNS, PAGER_COLUMNS, PRODUCT_COLUMNS
+from records import RECORD_COLUMNS
+
+
+class Unrecognized(Exception):
+    pass
+
+
+def parseResponse(xml):
+    """
+    Return a records.Response parsed straight from the XML of a SOAP reply,
+    or None if the reply holds anything this parser doesn't recognize and
+    should be left to suds.
+
+    Elements are parsed incrementally and each record's elements are
+    discarded as soon as the record is built.
+    """
+    try:
+        return _parse(xml)
+    except Unrecognized, ex:
+        log.debug('unrecognized response: %s', ex)
+    except (SyntaxError, ValueError), ex:
+        log.debug('unparseable response: %s', ex)
+
+    return None
+
+
+def _parse(xml):
+    records = []
+    products = []
+    pager = None
+    error = None
+
+    depth = 0
+    section = None
+    seen_response = False
+    for event, elem in iterparse(StringIO(xml), ('start', 'end')):
+        name = _localName(elem.tag)
+        if event == 'start':
+            depth += 1
+            if depth == 1 and name != 'Envelope':
+                raise Unrecognized(name)
+            elif depth == 2:
+                section = name
+            elif depth == 3 and section == 'Body':
+                if name == 'Fault' or seen_response:
+                    raise Unrecognized(name)
+
+                seen_response = True
+
+            continue
+
+        depth -= 1
+        if depth != 3 or section != 'Body':
+            continue
+
+        if name == 'EOXRecord':
+            records.append(_parseRecord(elem))
+        elif name == 'ProductIDRecord':
+            products.append(_parseProduct(elem))
+        elif name == 'PaginationResponseRecord':
+            pager = _parsePager(elem)
+        elif name == 'EOXError':
+            error = _parseError(elem)
+        else:
+            raise Unrecognized(name)
+
+        elem.clear()
+
+    if not seen_response:
+        raise Unrecognized('empty body')
+
+    return Response(tuple(records), tuple(products), pager, error)
+
+
+def _parseRecord(elem):
+    fields = dict.fromkeys(RECORD_COLUMNS, u'')
+    error = None
+    for child in elem:
+        name = _localName(child.tag)
+        if name == 'EOXError':
+            error = _parseError(child)
+        elif name in fields and not len(child):
+            fields[name] = _getText(child)
+        else:
+            raise Unrecognized(name)
+
+    return EOXRecord(
+        *([fields[column] for column in RECORD_COLUMNS] + [error]))
+
+
+def _parseProduct(elem):
+    fields = dict.fromkeys(PRODUCT_COLUMNS, u'')
+    error = None
+    for child in elem:
+        name = _localName(child.tag)
+        if name == 'EOXError':
+            error = _parseError(child)
+        elif name in fields and not len(child):
+            fields[name] = _getText(child)
+        else:
+            raise Unrecognized(name)
+
+    return ProductRecord(
+        *([fields[column] for column in PRODUCT_COLUMNS] + [error]))
+
+
+def _parsePager(elem):
+    fields = dict.fromkeys(PAGER_COLUMNS, 0)
+    for child in elem:
+        name = _localName(child.tag)
+        if name not in fields or len(child):
+            raise Unrecognized(name)
+
+        fields[name] = int(child.text or 0)
+
+    return Pager(*[fields[column] for column in PAGER_COLUMNS])
+
+
+def _parseError(elem):
+    fields = dict.fromkeys(ERROR_COLUMNS)
+    for child in elem:
+        name = _localName(child.tag)
+        if name not in fields or len(child):
+            raise Unrecognized(name)
+
+        if child.text:
+            fields[name] = unicode(child.text)
+
+    return EOXError(*[fields[column] for column in ERROR_COLUMNS])
+
+
+def _getText(elem):
+    return unicode(elem.text or u'').strip()
+
+
+def _localName(tag):
+    return tag.rsplit('}', 1)[-1]
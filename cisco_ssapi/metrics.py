@@ -0,0 +1,268 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.metrics')
+
+import bisect
+import json
+import threading
+
+# Upper bounds in seconds of the histogram buckets.
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+    30.0, 60.0]
+
+# Counters and histograms kept per method, with their help text.
+COUNTERS = [
+    ('requests', 'Pages requested'),
+    ('failures', 'Pages that failed for good'),
+    ('retries', 'Attempts made again after a transient failure'),
+    ('faults', 'Attempts that failed'),
+    ('bytes', 'Bytes of raw replies received'),
+    ('records', 'EOX and product ID records received'),
+    ]
+
+HISTOGRAMS = [
+    ('queued_seconds', 'Seconds pages waited for a worker'),
+    ('request_seconds', 'Seconds from the first attempt to the last reply'),
+    ('parse_seconds', 'Seconds spent parsing replies into records'),
+    ]
+
+
+class Observer(object):
+    """
+    Receives the events of every page request made by a Server.
+
+    Events are delivered on the worker thread making the request, so
+    observers must be thread-safe and return quickly. Subclasses override
+    the events they care about.
+    """
+
+    def requestStarted(self, method, page, queued):
+        """
+        Called before the first attempt at a page, which waited queued
+        seconds for a worker.
+        """
+
+
+    def requestRetried(self, method, page, attempt, error, delay):
+        """
+        Called when attempt failed with error and another is made after
+        delay seconds.
+        """
+
+
+    def requestFailed(self, method, page, attempts, error, seconds):
+        """
+        Called when a page failed for good after attempts attempts.
+        """
+
+
+    def requestFinished(self, method, page, attempts, seconds, size,
+        parseSeconds, records):
+        """
+        Called with the page's records once it is received. seconds runs
+        until the reply arrived and parseSeconds from then until its
+        records were built, by suds or the fast parser. size is the length
+        in bytes of the raw reply, after any decompression.
+        """
+
+
+class Histogram(object):
+    """
+    Counts observed values in cumulative buckets.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+    def getCumulative(self):
+        """
+        Return (upper bound, count) pairs with the counts of all values up
+        to each bound, ending with the infinite bound.
+        """
+        pairs = []
+        total = 0
+        for bound, count in zip(self.buckets + ['+Inf'], self.counts):
+            total += count
+            pairs.append((bound, total))
+
+        return pairs
+
+
+    def getQuantile(self, fraction):
+        """
+        Return the upper bound of the bucket holding the fraction quantile,
+        or the largest value seen for the last bucket.
+        """
+        if not self.count:
+            return 0.0
+
+        rank = fraction * self.count
+        for bound, total in self.getCumulative():
+            if total >= rank:
+                if bound == '+Inf':
+                    return self.max
+
+                return min(bound, self.max)
+
+        return self.max
+
+
+    def getSummary(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'p50': self.getQuantile(0.5),
+            'p90': self.getQuantile(0.9),
+            'p99': self.getQuantile(0.99),
+            }
+
+
+class Metrics(Observer):
+    """
+    Observer keeping counters and latency histograms for each method.
+    """
+
+    def __init__(self, prefix='eox'):
+        self.prefix = prefix
+        self._methods = {}
+        self._lock = threading.Lock()
+
+
+    def requestStarted(self, method, page, queued):
+        self._update(method, {'requests': 1}, {'queued_seconds': queued})
+
+
+    def requestRetried(self, method, page, attempt, error, delay):
+        self._update(method, {'retries': 1, 'faults': 1})
+
+
+    def requestFailed(self, method, page, attempts, error, seconds):
+        self._update(method, {'failures': 1, 'faults': 1},
+            {'request_seconds': seconds})
+
+
+    def requestFinished(self, method, page, attempts, seconds, size,
+        parseSeconds, records):
+
+        self._update(method, {'bytes': size or 0, 'records': records},
+            {'request_seconds': seconds, 'parse_seconds': parseSeconds})
+
+
+    def _update(self, method, counters, histograms=None):
+        self._lock.acquire()
+        try:
+            metrics = self._methods.get(method)
+            if metrics is None:
+                metrics = self._methods[method] = (
+                    dict([(name, 0) for name, help in COUNTERS]),
+                    dict([(name, Histogram()) for name, help in HISTOGRAMS]))
+
+            for name, value in counters.items():
+                metrics[0][name] += value
+
+            for name, value in (histograms or {}).items():
+                metrics[1][name].observe(value)
+        finally:
+            self._lock.release()
+
+
+    def getSummary(self):
+        """
+        Return a dict of each method's counters and histogram summaries.
+        """
+        self._lock.acquire()
+        try:
+            summary = {}
+            for method, (counters, histograms) in self._methods.items():
+                entry = summary[method] = dict(counters)
+                for name, histogram in histograms.items():
+                    entry[name] = histogram.getSummary()
+
+            return summary
+        finally:
+            self._lock.release()
+
+
+    def getPrometheus(self):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        self._lock.acquire()
+        try:
+            lines = []
+            methods = sorted(self._methods.items())
+            for name, help in COUNTERS:
+                metric = '%s_%s_total' % (self.prefix, name)
+                lines.append('# HELP %s %s' % (metric, help))
+                lines.append('# TYPE %s counter' % metric)
+                for method, (counters, histograms) in methods:
+                    lines.append('%s{method="%s"} %s' % (
+                        metric, method, counters[name]))
+
+            for name, help in HISTOGRAMS:
+                metric = '%s_%s' % (self.prefix, name)
+                lines.append('# HELP %s %s' % (metric, help))
+                lines.append('# TYPE %s histogram' % metric)
+                for method, (counters, histograms) in methods:
+                    histogram = histograms[name]
+                    for bound, total in histogram.getCumulative():
+                        lines.append('%s_bucket{method="%s",le="%s"} %s' % (
+                            metric, method, bound, total))
+
+                    lines.append('%s_sum{method="%s"} %r' % (
+                        metric, method, histogram.sum))
+
+                    lines.append('%s_count{method="%s"} %s' % (
+                        metric, method, histogram.count))
+
+            return '\n'.join(lines) + '\n'
+        finally:
+            self._lock.release()
+
+
+    def writePrometheus(self, path):
+        output = open(path, 'w')
+        try:
+            output.write(self.getPrometheus())
+        finally:
+            output.close()
+
+
+    def writeJSON(self, path):
+        output = open(path, 'w')
+        try:
+            json.dump(self.getSummary(), output, indent=2, sort_keys=True)
+            output.write('\n')
+        finally:
+            output.close()
@@ -0,0 +1,598 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.mockserver')
+
+import BaseHTTPServer
+import gzip
+import random
+import SocketServer
+import sys
+import threading
+import time
+
+from collections import deque
+from cStringIO import StringIO
+from optparse import OptionParser
+from xml.sax.saxutils import escape
+
+try:
+    from xml.etree.cElementTree import fromstring
+except ImportError:
+    from xml.etree.ElementTree import fromstring
+
+from records import ERROR_COLUMNS, PAGER_COLUMNS, RECORD_COLUMNS
+
+NAMESPACE = 'http://www.cisco.com/ssapi/eox/mock'
+SOAP_NAMESPACE = 'http://schemas.xmlsoap.org/soap/envelope/'
+
+PRODUCT_COUNT = 10000
+PAGE_SIZE = 50
+
+# Arguments of each operation as (name, type, minOccurs, maxOccurs) in the
+# order they are passed. Every operation also takes a PaginationRequestRecord.
+OPERATIONS = {
+    'showEOXByOID': [
+        ('OID', 'tns:OIDType', 1, 'unbounded')],
+    'showEOXByProductID': [
+        ('ProductID', 'xsd:string', 1, 1)],
+    'showEOXBySWReleseString': [
+        ('SWReleaseString', 'tns:SWReleaseStringType', 1, 'unbounded')],
+    'showEOXBySerialNumber': [
+        ('SerialNumber', 'xsd:string', 1, 1)],
+    }
+
+BULK_OPERATIONS = {
+    'showAllProductIDs': [],
+    'showEOXByDates': [
+        ('StartDate', 'xsd:string', 1, 1),
+        ('EndDate', 'xsd:string', 1, 1),
+        ('EOXAttrib', 'xsd:string', 0, 1)],
+    }
+
+INPUT_TYPES = {
+    'showEOXByOID': 'ShowEOXByOID',
+    'showEOXByProductID': 'ShowEOXByPids',
+    'showEOXBySWReleseString': 'ShowEOXBySWReleaseString',
+    'showEOXBySerialNumber': 'ShowEOXBySerialNumber',
+    'showEOXByDates': 'ShowEOXByDates',
+    }
+
+COMPLEX_TYPES = {
+    'PaginationRequestRecordType': [('PageIndex', 'xsd:int')],
+    'PaginationResponseRecordType': [
+        (name, 'xsd:int') for name in PAGER_COLUMNS],
+    'EOXErrorType': [(name, 'xsd:string') for name in ERROR_COLUMNS],
+    'EOXRecordType': [(name, 'xsd:string') for name in RECORD_COLUMNS] + [
+        ('EOXError', 'tns:EOXErrorType')],
+    'ProductIDRecordType': [
+        ('ProductID', 'xsd:string'),
+        ('ProductIDDescription', 'xsd:string'),
+        ('EOXError', 'tns:EOXErrorType')],
+    'OIDType': [('OID', 'xsd:string'), ('HardwareType', 'xsd:string')],
+    'SWReleaseStringType': [
+        ('SWReleaseString', 'xsd:string'), ('OSType', 'xsd:string')],
+    }
+
+RESPONSE_ELEMENTS = [
+    ('EOXRecord', 'tns:EOXRecordType', 'unbounded'),
+    ('ProductIDRecord', 'tns:ProductIDRecordType', 'unbounded'),
+    ('PaginationResponseRecord', 'tns:PaginationResponseRecordType', 1),
+    ('EOXError', 'tns:EOXErrorType', 1),
+    ]
+
+
+class MockServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Local stand-in for the SSAPI EOX services, for measuring Server without
+    Cisco's live service.
+
+    It serves both WSDLs and answers every operation of them from a
+    synthetic dataset of productCount products, pageSize records to a page.
+    Every request, WSDLs included, waits latency seconds, plus up to jitter
+    more, and each operation fails with a Timeout fault with probability
+    faultRate. With a quota, requests beyond quota in any second fail at
+    once with a Timeout fault too, as the service does when a client
+    exceeds its rate limit.
+
+    Connections are kept alive between requests for clients that want them,
+    and replies are gzip compressed for clients that accept it.
+
+    The dataset is generated from the inputs rather than stored, so any
+    size costs the same memory. Serial numbers, OIDs and software releases
+    each map to one product, except those starting with INVALID, which get
+    an error record like unknown product IDs do. Product N was last updated
+    N % 365 days into 2010, which is what showEOXByDates matches.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, host='127.0.0.1', port=0,
+        productCount=PRODUCT_COUNT, pageSize=PAGE_SIZE, latency=0.0,
+        jitter=0.0, faultRate=0.0, quota=None):
+
+        BaseHTTPServer.HTTPServer.__init__(
+            self, (host, port), MockRequestHandler)
+
+        self.productCount = productCount
+        self.pageSize = pageSize
+        self.latency = latency
+        self.jitter = jitter
+        self.faultRate = faultRate
+        self.quota = quota
+        self.requests = 0
+        self.connections = 0
+        self.faults = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+        # Times of the requests within the quota in the last second.
+        self._recent = deque()
+        self._thread = None
+
+
+    def getURL(self, path=''):
+        return 'http://%s:%s/%s' % (
+            self.server_address[0], self.server_address[1], path)
+
+
+    def getWSDL(self):
+        return self.getURL('eoxlookupservice-1.xml')
+
+
+    def getBulkWSDL(self):
+        return self.getURL('bulkeoxlookupservice-1.xml')
+
+
+    def start(self):
+        """
+        Serve requests on a background thread until stop is called.
+        """
+        self._thread = threading.Thread(
+            target=self.serve_forever, name='mock ssapi')
+
+        self._thread.setDaemon(True)
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+    def getStats(self):
+        return {
+            'requests': self.requests,
+            'connections': self.connections,
+            'faults': self.faults,
+            'throttled': self.throttled,
+            }
+
+
+    def answer(self, method, args):
+        """
+        Return the body of the SOAP reply to method called with a dict of
+        its arguments, or None to fault with Timeout.
+        """
+        self._lock.acquire()
+        try:
+            self.requests += 1
+            if self.quota:
+                now = time.time()
+                recent = self._recent
+                while recent and recent[0] <= now - 1:
+                    recent.popleft()
+
+                if len(recent) >= self.quota:
+                    self.throttled += 1
+                    return None
+
+                recent.append(now)
+
+            fault = self.faultRate and random.random() < self.faultRate
+            if fault:
+                self.faults += 1
+        finally:
+            self._lock.release()
+
+        self.wait()
+        if fault:
+            return None
+
+        page = int(args.get('PageIndex') or 1)
+        if method == 'showAllProductIDs':
+            return self.getProductsPage(page)
+
+        return self.getRecordsPage(method, args, page)
+
+
+    def wait(self):
+        """
+        Wait as long as a request to the service would.
+        """
+        delay = self.latency
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+
+        if delay:
+            time.sleep(delay)
+
+
+    def getProductsPage(self, page):
+        start = (page - 1) * self.pageSize
+        end = min(start + self.pageSize, self.productCount)
+        parts = []
+        for index in xrange(start, end):
+            parts.append(
+                '<ProductIDRecord><ProductID>%s</ProductID>'
+                '<ProductIDDescription>%s</ProductIDDescription>'
+                '</ProductIDRecord>' % (
+                    getProductID(index), getDescription(index)))
+
+        parts.append(self.getPager(page, self.productCount, end - start))
+        return ''.join(parts)
+
+
+    def getRecordsPage(self, method, args, page):
+        """
+        Return a page of the EOX records for method. Lookups answer each
+        input value with the record of the product it maps to, or with an
+        error record if it doesn't map to one.
+        """
+        if method == 'showEOXByDates':
+            matches = self.getUpdated(args.get('StartDate'),
+                args.get('EndDate'))
+        else:
+            matches = []
+            for value in args.get('values', []):
+                matches.append((value, self.getProductIndex(method, value)))
+
+        total = len(matches)
+        start = (page - 1) * self.pageSize
+        parts = []
+        for value, index in matches[start:start + self.pageSize]:
+            parts.append(getRecordXML(method, value, index))
+
+        parts.append(self.getPager(page, total, len(parts)))
+
+        return ''.join(parts)
+
+
+    def getUpdated(self, startDate, endDate):
+        matches = []
+        for index in xrange(self.productCount):
+            updated = getUpdatedTimeStamp(index)
+            if (not startDate or updated >= startDate) \
+                and (not endDate or updated <= endDate):
+
+                matches.append((getProductID(index), index))
+
+        return matches
+
+
+    def getProductIndex(self, method, value):
+        """
+        Return the index of the product value maps to, or None.
+        """
+        if method == 'showEOXByProductID':
+            if value.startswith('MOCK-') and value[5:].isdigit():
+                index = int(value[5:])
+                if index < self.productCount:
+                    return index
+
+            return None
+
+        if value.upper().startswith('INVALID'):
+            return None
+
+        return hash(value) % self.productCount
+
+
+    def getPager(self, page, total, records):
+        last = max(1, (total + self.pageSize - 1) // self.pageSize)
+        return ('<PaginationResponseRecord><PageIndex>%s</PageIndex>'
+            '<LastIndex>%s</LastIndex><TotalRecords>%s</TotalRecords>'
+            '<PageRecords>%s</PageRecords></PaginationResponseRecord>' % (
+                page, last, total, records))
+
+
+class MockRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server._lock.acquire()
+        try:
+            self.server.connections += 1
+        finally:
+            self.server._lock.release()
+
+
+    def do_GET(self):
+        if self.path.endswith('/bulkeoxlookupservice-1.xml'):
+            wsdl = getWSDL('BulkEOXLookupService', BULK_OPERATIONS,
+                self.server.getURL('bulk'))
+        elif self.path.endswith('/eoxlookupservice-1.xml'):
+            wsdl = getWSDL('EOXLookupService', OPERATIONS,
+                self.server.getURL('eox'))
+        else:
+            self.send_error(404)
+            return
+
+        self.server.wait()
+        self.reply(200, wsdl)
+
+
+    def do_POST(self):
+        request = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            method, args = parseRequest(request)
+        except Exception, ex:
+            self.reply(500, getFault('Client', 'bad request: %s' % ex))
+            return
+
+        if method not in OPERATIONS and method not in BULK_OPERATIONS:
+            self.reply(500, getFault('Client', 'unknown operation: %s' % (
+                method,)))
+
+            return
+
+        body = self.server.answer(method, args)
+        if body is None:
+            self.reply(500, getFault('Server', 'Timeout'))
+            return
+
+        self.reply(200, getEnvelope('<tns:%sResponse xmlns:tns="%s">%s'
+            '</tns:%sResponse>' % (method, NAMESPACE, body, method)))
+
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            compressed = StringIO()
+            output = gzip.GzipFile(fileobj=compressed, mode='wb')
+            output.write(body)
+            output.close()
+            body = compressed.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+def parseRequest(xml):
+    """
+    Return the operation a SOAP request calls and a dict of its arguments.
+    Input values, whether comma-separated or in repeated elements, are
+    listed under values. PageIndex comes from the PaginationRequestRecord.
+    """
+    envelope = fromstring(xml)
+    body = [e for e in envelope if localName(e.tag) == 'Body'][0]
+    call = list(body)[0]
+    method = localName(call.tag)
+
+    args = {'values': []}
+    for child in call:
+        name = localName(child.tag)
+        if name == 'PaginationRequestRecord':
+            for field in child:
+                args[localName(field.tag)] = field.text
+        elif name in ('OID', 'SWReleaseString'):
+            for field in child:
+                if localName(field.tag) == name and field.text:
+                    args['values'].append(field.text.strip())
+        elif name in ('ProductID', 'SerialNumber'):
+            for value in (child.text or '').split(','):
+                if value.strip():
+                    args['values'].append(value.strip())
+        else:
+            args[name] = child.text
+
+    return method, args
+
+
+def getRecordXML(method, value, index):
+    fields = dict.fromkeys(RECORD_COLUMNS, '')
+    fields['EOXInputType'] = INPUT_TYPES[method]
+    fields['EOXInputValue'] = value
+    error = ''
+    if index is None:
+        error = ('<EOXError><ErrorID>SSA_ERR_026</ErrorID>'
+            '<ErrorDescription>EOX information does not exist for the '
+            'following product ID(s): %s</ErrorDescription>'
+            '<ErrorDataType>%s</ErrorDataType>'
+            '<ErrorDataValue>%s</ErrorDataValue></EOXError>' % (
+                escape(value), INPUT_TYPES[method], escape(value)))
+    else:
+        year = 2010 + index % 5
+        fields.update({
+            'EOLProductID': getProductID(index),
+            'ProductIDDescription': getDescription(index),
+            'ProductBulletinNumber': 'EOL%s' % (index % 9000 + 1000),
+            'LinkToProductBulletinURL':
+                'http://www.cisco.com/mock/eol%s.html' % index,
+            'EOXExternalAnnouncementDate': '%s-01-15' % year,
+            'EndOfSaleDate': '%s-07-15' % year,
+            'EndOfSWMaintenanceReleases': '%s-07-15' % (year + 1),
+            'EndOfRoutineFailureAnalysisDate': '%s-07-15' % (year + 1),
+            'EndOfServiceContractRenewal': '%s-10-15' % (year + 4),
+            'LastDateOfSupport': '%s-07-31' % (year + 5),
+            'EndOfSvcAttachDate': '%s-07-15' % (year + 1),
+            'UpdatedTimeStamp': getUpdatedTimeStamp(index),
+            })
+
+    return '<EOXRecord>%s%s</EOXRecord>' % (''.join([
+        '<%s>%s</%s>' % (name, escape(fields[name]), name)
+        for name in RECORD_COLUMNS]), error)
+
+
+def getProductID(index):
+    return 'MOCK-%06d' % index
+
+
+def getDescription(index):
+    return 'Mock product %s' % index
+
+
+def getUpdatedTimeStamp(index):
+    return time.strftime('%Y-%m-%d',
+        time.gmtime(1262304000 + (index % 365) * 24 * 60 * 60))
+
+
+def getEnvelope(body):
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+        '<soap:Envelope xmlns:soap="%s"><soap:Body>%s</soap:Body>'
+        '</soap:Envelope>' % (SOAP_NAMESPACE, body))
+
+
+def getFault(code, message):
+    return getEnvelope('<soap:Fault><faultcode>soap:%s</faultcode>'
+        '<faultstring>%s</faultstring></soap:Fault>' % (
+            code, escape(message)))
+
+
+def getWSDL(name, operations, location):
+    """
+    Return a document/literal WSDL of the operations served at location.
+    """
+    types = []
+    for type_name, fields in sorted(COMPLEX_TYPES.items()):
+        types.append('<xsd:complexType name="%s"><xsd:sequence>%s'
+            '</xsd:sequence></xsd:complexType>' % (type_name, ''.join([
+                '<xsd:element name="%s" type="%s" minOccurs="0"/>' % field
+                for field in fields])))
+
+    types.append('<xsd:complexType name="ResponseType"><xsd:sequence>%s'
+        '</xsd:sequence></xsd:complexType>' % ''.join([
+            '<xsd:element name="%s" type="%s" minOccurs="0" '
+            'maxOccurs="%s"/>' % field for field in RESPONSE_ELEMENTS]))
+
+    elements = []
+    messages = []
+    port_operations = []
+    binding_operations = []
+    for method, args in sorted(operations.items()):
+        args = args + [('PaginationRequestRecord',
+            'tns:PaginationRequestRecordType', 1, 1)]
+
+        elements.append('<xsd:element name="%s"><xsd:complexType>'
+            '<xsd:sequence>%s</xsd:sequence></xsd:complexType>'
+            '</xsd:element>' % (method, ''.join([
+                '<xsd:element name="%s" type="%s" minOccurs="%s" '
+                'maxOccurs="%s"/>' % arg for arg in args])))
+
+        elements.append('<xsd:element name="%sResponse" '
+            'type="tns:ResponseType"/>' % method)
+
+        messages.append('<message name="%sRequest">'
+            '<part name="parameters" element="tns:%s"/></message>'
+            '<message name="%sResponse">'
+            '<part name="parameters" element="tns:%sResponse"/></message>' % (
+                method, method, method, method))
+
+        port_operations.append('<operation name="%s">'
+            '<input message="tns:%sRequest"/>'
+            '<output message="tns:%sResponse"/></operation>' % (
+                method, method, method))
+
+        binding_operations.append('<operation name="%s">'
+            '<soap:operation soapAction="%s"/>'
+            '<input><soap:body use="literal"/></input>'
+            '<output><soap:body use="literal"/></output></operation>' % (
+                method, method))
+
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+        '<definitions name="%(name)s" targetNamespace="%(ns)s" '
+        'xmlns="http://schemas.xmlsoap.org/wsdl/" '
+        'xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/" '
+        'xmlns:tns="%(ns)s" xmlns:xsd="http://www.w3.org/2001/XMLSchema">'
+        '<types><xsd:schema targetNamespace="%(ns)s" '
+        'elementFormDefault="unqualified">%(types)s%(elements)s'
+        '</xsd:schema></types>%(messages)s'
+        '<portType name="%(name)sPortType">%(ports)s</portType>'
+        '<binding name="%(name)sBinding" type="tns:%(name)sPortType">'
+        '<soap:binding style="document" '
+        'transport="http://schemas.xmlsoap.org/soap/http"/>%(bindings)s'
+        '</binding><service name="%(name)s">'
+        '<port name="%(name)sPort" binding="tns:%(name)sBinding">'
+        '<soap:address location="%(location)s"/></port></service>'
+        '</definitions>' % {
+            'name': name,
+            'ns': NAMESPACE,
+            'types': ''.join(types),
+            'elements': ''.join(elements),
+            'messages': ''.join(messages),
+            'ports': ''.join(port_operations),
+            'bindings': ''.join(binding_operations),
+            'location': location,
+            })
+
+
+def localName(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--host', dest='host', default='127.0.0.1',
+        help='Address to listen on')
+    parser.add_option('--port', dest='port', type='int', default=8080,
+        help='Port to listen on')
+    parser.add_option('--products', dest='productCount', type='int',
+        default=PRODUCT_COUNT, help='Number of products in the dataset')
+    parser.add_option('--page-size', dest='pageSize', type='int',
+        default=PAGE_SIZE, help='Records on each page')
+    parser.add_option('--latency', dest='latency', type='float',
+        default=0.0, help='Seconds each request waits before its reply')
+    parser.add_option('--jitter', dest='jitter', type='float',
+        default=0.0, help='Most random seconds added to the latency')
+    parser.add_option('--fault-rate', dest='faultRate', type='float',
+        default=0.0, help='Fraction of requests failing with Timeout')
+    parser.add_option('--quota', dest='quota', type='int',
+        help='Most requests a second before failing with Timeout')
+    options = parser.parse_args()[0]
+
+    logging.basicConfig(level=logging.INFO)
+    server = MockServer(options.host, options.port,
+        productCount=options.productCount,
+        pageSize=options.pageSize,
+        latency=options.latency,
+        jitter=options.jitter,
+        faultRate=options.faultRate,
+        quota=options.quota)
+
+    print >> sys.stderr, 'Serving %s and %s' % (
+        server.getWSDL(), server.getBulkWSDL())
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,232 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import types
+
+RECORD_COLUMNS = [
+    'EOLProductID',
+    'ProductIDDescription',
+    'ProductBulletinNumber',
+    'LinkToProductBulletinURL',
+    'EOXExternalAnnouncementDate',
+    'EndOfSaleDate',
+    'EndOfSWMaintenanceReleases',
+    'EndOfRoutineFailureAnalysisDate',
+    'EndOfServiceContractRenewal',
+    'LastDateOfSupport',
+    'EndOfSvcAttachDate',
+    'UpdatedTimeStamp',
+    'EOXInputType',
+    'EOXInputValue',
+    ]
+
+ERROR_COLUMNS = [
+    'ErrorID',
+    'ErrorDescription',
+    'ErrorDataType',
+    'ErrorDataValue',
+    ]
+
+PRODUCT_COLUMNS = [
+    'ProductID',
+    'ProductIDDescription',
+    ]
+
+PAGER_COLUMNS = [
+    'PageIndex',
+    'LastIndex',
+    'TotalRecords',
+    'PageRecords',
+    ]
+
+
+class Record(object):
+    """
+    Immutable record with one slot per field.
+
+    Fields are passed to the constructor in the order of fields, which
+    subclasses set along with __slots__. Records have the attribute names
+    of the suds objects they replace but hold nothing except plain strings,
+    integers and other records.
+    """
+
+    __slots__ = fields = ()
+
+    def __init__(self, *values):
+        if len(values) != len(self.fields):
+            raise TypeError('%s takes %s fields, %s given' % (
+                self.__class__.__name__, len(self.fields), len(values)))
+
+        for name, value in zip(self.fields, values):
+            object.__setattr__(self, name, value)
+
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is read-only' % self.__class__.__name__)
+
+
+    def __delattr__(self, name):
+        raise AttributeError('%s is read-only' % self.__class__.__name__)
+
+
+    def __reduce__(self):
+        return (self.__class__, self.getFields())
+
+
+    def __eq__(self, other):
+        return self.__class__ is other.__class__ \
+            and self.getFields() == other.getFields()
+
+
+    def __ne__(self, other):
+        return not self == other
+
+
+    def __hash__(self):
+        return hash(self.getFields())
+
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__,
+            ', '.join(['%s=%r' % (name, getattr(self, name))
+                for name in self.fields]))
+
+
+    def getFields(self):
+        return tuple([getattr(self, name) for name in self.fields])
+
+
+class EOXError(Record):
+    __slots__ = fields = tuple(ERROR_COLUMNS)
+
+
+class EOXRecord(Record):
+    """
+    An EOX record. Every RECORD_COLUMNS field is a stripped string, with
+    dates in the service's YYYY-MM-DD format, and EOXError is an EOXError
+    or None.
+    """
+
+    __slots__ = fields = tuple(RECORD_COLUMNS) + ('EOXError',)
+
+    def fromValues(cls, values, error=None):
+        """
+        Build a record from the values and error dicts returned by
+        eox.getRecordValues.
+        """
+        fields = [values.get(name, '') for name in RECORD_COLUMNS]
+        if error:
+            fields.append(
+                EOXError(*[error.get(name) for name in ERROR_COLUMNS]))
+        else:
+            fields.append(None)
+
+        return cls(*fields)
+
+    fromValues = classmethod(fromValues)
+
+
+class ProductRecord(Record):
+    __slots__ = fields = tuple(PRODUCT_COLUMNS) + ('EOXError',)
+
+
+class Pager(Record):
+    __slots__ = fields = tuple(PAGER_COLUMNS)
+
+
+class Response(Record):
+    """
+    One page of a response. EOXRecord and ProductIDRecord are tuples,
+    either of which may be empty.
+    """
+
+    __slots__ = fields = (
+        'EOXRecord',
+        'ProductIDRecord',
+        'PaginationResponseRecord',
+        'EOXError',
+        )
+
+    def fromRecords(cls, records):
+        """
+        Build a response holding records that were kept locally, such as
+        those answered from a RecordCache.
+        """
+        return cls(tuple(records), (), None, None)
+
+    fromRecords = classmethod(fromRecords)
+
+
+def convertResponse(response):
+    """
+    Return a Response copying everything used from a suds response so that
+    the suds object can be freed.
+    """
+    records = []
+    for record in getattr(response, 'EOXRecord', None) or []:
+        records.append(convertRecord(record))
+
+    products = []
+    for record in getattr(response, 'ProductIDRecord', None) or []:
+        fields = [_getText(record, name) for name in PRODUCT_COLUMNS]
+        fields.append(convertError(getattr(record, 'EOXError', None)))
+        products.append(ProductRecord(*fields))
+
+    pager = getattr(response, 'PaginationResponseRecord', None)
+    if pager:
+        pager = Pager(*[int(getattr(pager, name, 0) or 0)
+            for name in PAGER_COLUMNS])
+    else:
+        pager = None
+
+    return Response(tuple(records), tuple(products), pager,
+        convertError(getattr(response, 'EOXError', None)))
+
+
+def convertRecord(record):
+    fields = [_getText(record, name) for name in RECORD_COLUMNS]
+    fields.append(convertError(getattr(record, 'EOXError', None)))
+    return EOXRecord(*fields)
+
+
+def convertError(error):
+    if not error:
+        return None
+
+    fields = []
+    for name in ERROR_COLUMNS:
+        value = getattr(error, name, None)
+        if value is not None:
+            value = unicode(value)
+
+        fields.append(value)
+
+    return EOXError(*fields)
+
+
+def _getText(record, name):
+    # Dates are suds objects with the date in value.
+    column = getattr(record, name, None)
+    if column is None:
+        return u''
+
+    if not isinstance(column, types.StringTypes):
+        column = column.value or u''
+
+    return unicode(column).strip()
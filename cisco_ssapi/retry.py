@@ -0,0 +1,342 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.retry')
+
+import httplib
+import random
+import socket
+import threading
+import time
+import urllib2
+
+MAX_ATTEMPTS = 5
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+# HTTP statuses worth another try.
+RETRY_STATUSES = [408, 429, 500, 502, 503, 504]
+
+# Faults the service uses when it is overloaded.
+RETRY_FAULTS = ['Timeout']
+
+# HTTP statuses and faults meaning requests are coming too fast.
+THROTTLE_STATUSES = [429, 503]
+THROTTLE_FAULTS = RETRY_FAULTS
+
+
+class RetryPolicy(object):
+    """
+    Decides which failed requests are retried and how long to wait first.
+
+    Timeout faults, retryable HTTP statuses and connection errors are
+    retried up to maxAttempts attempts in total. The wait before attempt n+1
+    is chosen at random between zero and baseDelay * 2 ** (n - 1), capped at
+    maxDelay, so that workers that failed together don't retry together.
+    """
+
+    def __init__(self, maxAttempts=MAX_ATTEMPTS, baseDelay=BASE_DELAY,
+        maxDelay=MAX_DELAY):
+
+        self.maxAttempts = maxAttempts
+        self.baseDelay = baseDelay
+        self.maxDelay = maxDelay
+
+
+    def isRetryable(self, error):
+        WebFault, TransportError = getSudsErrors()
+        if isinstance(error, WebFault):
+            fault = getattr(error, 'fault', None)
+            return bool(fault) and fault.faultstring in RETRY_FAULTS
+
+        if isinstance(error, TransportError):
+            return error.httpcode in RETRY_STATUSES
+
+        if isinstance(error, (socket.error, urllib2.URLError,
+            httplib.HTTPException)):
+
+            return True
+
+        # Suds raises HTTP errors other than faults as Exception((status,
+        # reason)).
+        args = getattr(error, 'args', None)
+        if args and isinstance(args[0], tuple) and len(args[0]) == 2:
+            return args[0][0] in RETRY_STATUSES
+
+        return False
+
+
+    def isThrottling(self, error):
+        """
+        Return True if error says requests are being made too fast.
+        """
+        WebFault, TransportError = getSudsErrors()
+        if isinstance(error, WebFault):
+            fault = getattr(error, 'fault', None)
+            return bool(fault) and fault.faultstring in THROTTLE_FAULTS
+
+        if isinstance(error, TransportError):
+            return error.httpcode in THROTTLE_STATUSES
+
+        args = getattr(error, 'args', None)
+        if args and isinstance(args[0], tuple) and len(args[0]) == 2:
+            return args[0][0] in THROTTLE_STATUSES
+
+        return False
+
+
+    def shouldRetry(self, error, attempt):
+        return attempt < self.maxAttempts and self.isRetryable(error)
+
+
+    def getDelay(self, attempt):
+        return random.uniform(
+            0, min(self.maxDelay, self.baseDelay * 2 ** (attempt - 1)))
+
+
+class RetryBudget(object):
+    """
+    Limits retries to a fraction of the requests made.
+
+    Every first attempt adds ratio to the budget and every retry takes one
+    from it. minimum retries are always allowed so that a quiet Server can
+    still retry. When the budget is spent failing requests aren't retried,
+    which keeps a struggling service from being hit by a retry storm.
+    """
+
+    def __init__(self, ratio=0.2, minimum=10):
+        self.ratio = ratio
+        self.minimum = minimum
+        self._balance = float(minimum)
+        self._lock = threading.Lock()
+
+
+    def deposit(self):
+        self._lock.acquire()
+        try:
+            self._balance += self.ratio
+        finally:
+            self._lock.release()
+
+
+    def withdraw(self):
+        """
+        Take one retry from the budget. Return False if none are left.
+        """
+        self._lock.acquire()
+        try:
+            if self._balance < 1:
+                return False
+
+            self._balance -= 1
+            return True
+        finally:
+            self._lock.release()
+
+
+class CircuitBreaker(object):
+    """
+    Pauses all requests after repeated failures.
+
+    After threshold consecutive failures the circuit opens and wait blocks
+    every worker for resetTimeout seconds. Then one trial request is let
+    through: the circuit closes if it succeeds and opens again if it fails.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=5, resetTimeout=30.0):
+        self.threshold = threshold
+        self.resetTimeout = resetTimeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._openedAt = None
+        self._trial = False
+        self._condition = threading.Condition()
+
+
+    def wait(self):
+        """
+        Block until a request may be made.
+        """
+        self._condition.acquire()
+        try:
+            while True:
+                if self.state == self.CLOSED:
+                    return
+
+                if self.state == self.OPEN:
+                    remaining = self._openedAt + self.resetTimeout \
+                        - time.time()
+
+                    if remaining > 0:
+                        self._condition.wait(remaining)
+                        continue
+
+                    log.info('circuit half-open, sending a trial request')
+                    self.state = self.HALF_OPEN
+                    self._trial = False
+
+                if not self._trial:
+                    self._trial = True
+                    return
+
+                self._condition.wait()
+        finally:
+            self._condition.release()
+
+
+    def recordSuccess(self):
+        self._condition.acquire()
+        try:
+            if self.state != self.CLOSED:
+                log.info('circuit closed')
+
+            self.state = self.CLOSED
+            self._failures = 0
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+
+
+    def recordFailure(self):
+        self._condition.acquire()
+        try:
+            self._failures += 1
+            if self.state == self.HALF_OPEN \
+                or self._failures >= self.threshold:
+
+                if self.state != self.OPEN:
+                    log.warn('circuit open after %s failures, pausing '
+                        'requests for %s seconds',
+                        self._failures, self.resetTimeout)
+
+                self.state = self.OPEN
+                self._openedAt = time.time()
+                self._condition.notifyAll()
+        finally:
+            self._condition.release()
+
+
+class RateLimiter(object):
+    """
+    Token bucket spacing requests out to at most rate a second, in bursts
+    of at most burst requests, one second's worth by default.
+
+    When adaptive, each throttling failure cuts the rate by decrease,
+    though not below minRate, unless its request was made before the rate
+    was last cut, since those were made too fast already. Each success
+    raises it again by increase requests a second spread over a second's
+    worth of requests, up to maxRate. maxRate defaults to the initial rate,
+    so a rate at or above the quota settles just under it instead of
+    triggering waves of retries.
+    """
+
+    def __init__(self, rate, burst=None, adaptive=True, minRate=0.1,
+        maxRate=None, decrease=0.5, increase=0.5):
+
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self.adaptive = adaptive
+        self.minRate = minRate
+        self.maxRate = maxRate or self.rate
+        self.decrease = decrease
+        self.increase = increase
+        self._tokens = float(self.burst)
+        self._updated = time.time()
+        self._decreased = 0
+        self._lock = threading.Lock()
+
+
+    def acquire(self):
+        """
+        Block until a request may be made.
+        """
+        while True:
+            self._lock.acquire()
+            try:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                delay = (1 - self._tokens) / self.rate
+            finally:
+                self._lock.release()
+
+            time.sleep(delay)
+
+
+    def recordSuccess(self):
+        if not self.adaptive:
+            return
+
+        self._lock.acquire()
+        try:
+            self._refill()
+            self.rate = min(self.maxRate,
+                self.rate + self.increase / self.rate)
+        finally:
+            self._lock.release()
+
+
+    def recordThrottle(self, started=None):
+        """
+        Slow down after a request made at started was throttled.
+        """
+        if not self.adaptive:
+            return
+
+        self._lock.acquire()
+        try:
+            now = time.time()
+            if started is not None and started < self._decreased:
+                return
+
+            self._refill()
+            self._decreased = now
+            self.rate = max(self.minRate, self.rate * self.decrease)
+            self._tokens = min(self._tokens, 0)
+            log.warn('throttled, slowing down to %.2f requests a second',
+                self.rate)
+        finally:
+            self._lock.release()
+
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self.burst,
+            self._tokens + (now - self._updated) * self.rate)
+
+        self._updated = now
+
+
+def getSudsErrors():
+    """
+    Return the suds WebFault and TransportError classes, imported only when
+    an error is checked. Some suds versions import suds.client on any suds
+    import, and once a request has failed it is imported anyway.
+    """
+    from suds import WebFault
+    from suds.transport import TransportError
+
+    return WebFault, TransportError
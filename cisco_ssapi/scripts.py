@@ -17,17 +17,23 @@
 #
 ##############################################################################
 
+import datetime
 import logging
-logging.basicConfig(level=logging.INFO)
 log = logging.getLogger('eox')
 
-import csv
 import sys
-import types
+import time
 
 from optparse import OptionParser
 
 import eox
+import metrics
+import retry
+import writers
+import wsdlbundle
+from cache import RecordCache
+from checkpoint import Checkpoint
+from sync import Snapshot
 
 
 def getOptionParser():
@@ -40,36 +46,269 @@ def getOptionParser():
         help='Cisco EOX username')
     parser.add_option('-p', '--password', dest='password',
         help='Cisco EOX password')
-    parser.add_option('-d', '--delimiter', dest='delimiter', default=',',
-        help='Output field delimiter')
+    addOutputOptions(parser)
     parser.add_option('-t', '--threads', dest='threads',
         type='int', default=eox.THREADS,
-        help='Number of EOX server threads to use')
+        help='Maximum number of concurrent EOX requests')
+    parser.add_option('--wsdl-cache', dest='wsdlCache',
+        default=eox.CACHE_LOCATION,
+        help='Directory for caching parsed WSDL definitions')
+    parser.add_option('--ordered', dest='ordered',
+        action='store_true', default=False,
+        help='Write records in input order')
+    parser.add_option('--max-buffered', dest='maxBuffered',
+        type='int', default=eox.MAX_BUFFERED,
+        help='Maximum number of EOX responses held in memory')
+    parser.add_option('--cache', dest='cache',
+        help='EOX record cache file')
+    parser.add_option('--cache-ttl', dest='cacheTTL',
+        type='float', default=7,
+        help='Days to keep EOX records in the cache')
+    parser.add_option('--store', dest='store',
+        help='Add the EOX records received to this local store')
+    parser.add_option('--max-attempts', dest='maxAttempts',
+        type='int', default=retry.MAX_ATTEMPTS,
+        help='Most attempts at each EOX request before giving up')
+    parser.add_option('--fast-parse', dest='fastParse',
+        action='store_true', default=False,
+        help='Parse EOX responses without suds where possible')
+    parser.add_option('--rate', dest='rate', type='float',
+        help='Most EOX requests a second, lowered while throttled')
+    parser.add_option('--burst', dest='burst', type='int',
+        help='Most EOX requests made at once under --rate')
+    parser.add_option('--fixed-rate', dest='fixedRate',
+        action='store_true', default=False,
+        help="Don't lower --rate when throttled")
+    parser.add_option('--keep-alive', dest='keepAlive',
+        action='store_true', default=False,
+        help='Make requests on pooled keep-alive, compressed connections')
+    parser.add_option('--pool-size', dest='poolSize', type='int',
+        help='Most idle connections kept with --keep-alive')
+    parser.add_option('--metrics-prom', dest='metricsProm',
+        help='Write request metrics to this Prometheus text file')
+    parser.add_option('--metrics-json', dest='metricsJSON',
+        help='Write a JSON summary of request metrics to this file')
+    parser.add_option('--wsdl', dest='wsdl', default=eox.WSDL,
+        help='URL of the EOX lookup service WSDL')
+    parser.add_option('--bulk-wsdl', dest='bulkWSDL', default=eox.WSDL_BULK,
+        help='URL of the bulk EOX lookup service WSDL')
+    parser.add_option('--wsdl-bundle', dest='wsdlBundle',
+        default=wsdlbundle.BUNDLE_LOCATION,
+        help='Prebuilt WSDL bundle to load instead of fetching the WSDLs')
     return parser
 
 
-def getOptions(parser, usage=None):
+def addOutputOptions(parser):
+    parser.add_option('-d', '--delimiter', dest='delimiter', default=',',
+        help='Output field delimiter')
+    parser.add_option('--format', dest='format', default='csv',
+        type='choice', choices=sorted(writers.FORMATS.keys()),
+        help='Output format: %s' % ', '.join(sorted(writers.FORMATS.keys())))
+    parser.add_option('--output', dest='output',
+        help='Output file, required for the sqlite format')
+    parser.add_option('--flush-interval', dest='flushInterval',
+        type='float', default=writers.FLUSH_INTERVAL,
+        help='Seconds to hold records for a batched write, checked as '
+            'each response arrives')
+
+
+def getOptions(parser, usage=None, login=True):
     options, args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
 
     # Enforce common required options.
-    if not options.username:
+    if login and not options.username:
         usage("You must specify your EOX username.")
 
-    if not options.password:
+    if login and not options.password:
         usage("You must specify your EOX password.")
 
     # Handle shell-escaped tab delimiter.
     if options.delimiter == '\\t':
         options.delimiter = '\t'
 
+    if options.format == 'sqlite' and not options.output:
+        usage("You must specify the output file for the sqlite format.")
+
     return options, args
 
 
-def writeProductRecords(gen, delimiter):
-    writer = csv.writer(sys.stdout, delimiter=delimiter)
-    writer.writerow(['ProductID', 'ProductIDDescription'])
-    
+def getServer(options):
+    """
+    Convenience method for getting an eox.Server configured from the common
+    options.
+    """
+    cache = None
+    if options.cache:
+        cache = RecordCache(options.cache,
+            ttl=options.cacheTTL * 24 * 60 * 60)
+
+    observers = []
+    if options.metricsProm or options.metricsJSON:
+        observers.append(metrics.Metrics())
+
+    rate_limiter = None
+    if options.rate:
+        rate_limiter = retry.RateLimiter(options.rate, options.burst,
+            adaptive=not options.fixedRate)
+
+    store = None
+    if options.store:
+        from store import RecordStore
+        store = RecordStore(options.store)
+
+    connection_pool = None
+    if options.keepAlive:
+        from transport import ConnectionPool, POOL_SIZE
+        connection_pool = ConnectionPool(options.poolSize or POOL_SIZE)
+
+    return eox.Server(options.username, options.password, options.threads,
+        cacheLocation=options.wsdlCache,
+        ordered=options.ordered,
+        maxBuffered=options.maxBuffered,
+        cache=cache,
+        retryPolicy=retry.RetryPolicy(maxAttempts=options.maxAttempts),
+        fastParse=options.fastParse,
+        observers=observers,
+        rateLimiter=rate_limiter,
+        wsdl=options.wsdl,
+        bulkWSDL=options.bulkWSDL,
+        wsdlBundle=options.wsdlBundle,
+        store=store,
+        connectionPool=connection_pool)
+
+
+def addFileOption(parser, help):
+    parser.add_option('-f', '--file', dest='file',
+        help=help + ' One per line, or - to read from stdin.')
+
+
+def addShardOptions(parser):
+    parser.add_option('--shards', dest='shards', type='int',
+        help='Split the crawl into this many shards run in parallel')
+    parser.add_option('--shard-dir', dest='shardDir',
+        help='Directory shared by every host running the shards')
+    parser.add_option('--processes', dest='processes', type='int',
+        help='Processes running shards on this host, one per CPU by default')
+    parser.add_option('--reclaim', dest='reclaim',
+        action='store_true', default=False,
+        help='Release the shards claimed by workers that died')
+
+
+def readInputs(options, args):
+    """
+    Yield the values given as arguments and then each line of the file
+    option as it is read, so that lookups can start before the whole file
+    has been read.
+    """
+    for arg in args:
+        yield arg
+
+    if not options.file:
+        return
+
+    if options.file == '-':
+        inputfile = sys.stdin
+    else:
+        inputfile = open(options.file, 'r')
+
+    # Iterating over a file reads ahead in large blocks, which would hold
+    # back lines piped in slowly.
+    try:
+        for line in iter(inputfile.readline, ''):
+            yield line.strip()
+    finally:
+        if inputfile is not sys.stdin:
+            inputfile.close()
+
+
+def closeServer(server, options):
+    """
+    Release the server's threads, cache, store and connections, log the
+    cache and connection statistics and any requests that failed and write
+    the request metrics. Return the number of pages that could not be
+    retrieved.
+    """
+    server.close()
+
+    for observer in server.getObservers():
+        if isinstance(observer, metrics.Metrics):
+            if options.metricsProm:
+                observer.writePrometheus(options.metricsProm)
+
+            if options.metricsJSON:
+                observer.writeJSON(options.metricsJSON)
+
+    failures = server.getFailures()
+    if failures:
+        log.error('%s pages could not be retrieved', len(failures))
+
+    cache = server.getCache()
+    if cache is not None:
+        log.info('cache hits: %(hits)s, negative hits: %(negativeHits)s, '
+            'misses: %(misses)s', cache.getStats())
+
+        cache.close()
+
+    store = server.getStore()
+    if store is not None:
+        store.close()
+
+    connection_pool = server.getConnectionPool()
+    if connection_pool is not None:
+        log.info('requests: %(requests)s, connections: %(connections)s, '
+            'reused: %(reused)s, compressed: %(compressed)s, '
+            'bytes received: %(bytesReceived)s of %(bytesDecoded)s',
+            connection_pool.getStats())
+
+        connection_pool.close()
+
+    return len(failures)
+
+
+def getWriter(options, columns, table, append=False):
+    """
+    Return a writers.RecordWriter for the format and output options. Rows
+    written to a sqlite output go in table. With append the output file is
+    added to rather than replaced.
+
+    options may also be just a delimiter, as writeEOXRecords and
+    writeProductRecords used to take, for comma-delimited text on stdout.
+    """
+    if isinstance(options, basestring):
+        return writers.CSVWriter(sys.stdout, columns, delimiter=options)
+
+    cls = writers.FORMATS[options.format]
+    kwargs = {'flushInterval': options.flushInterval, 'header': not append}
+    if cls is writers.CSVWriter:
+        kwargs['delimiter'] = options.delimiter
+    elif cls is writers.SQLiteWriter:
+        return cls(options.output, columns, table=table, **kwargs)
+
+    output = sys.stdout
+    if append:
+        output = open(options.output, 'r+b')
+        output.seek(0, 2)
+    elif options.output:
+        output = open(options.output, 'wb')
+
+    return cls(output, columns, **kwargs)
+
+
+def closeWriter(writer):
+    writer.close()
+    if writer.output is not sys.stdout \
+        and not isinstance(writer, writers.SQLiteWriter):
+
+        writer.output.close()
+
+
+def writeProductRecords(gen, options):
+    writer = getWriter(options, ['ProductID', 'ProductIDDescription'],
+        'products')
+
     for response in gen:
+        writer.poll()
         error = getattr(response, 'EOXError', None)
         if error:
             log.error('%s: %s', error.ErrorID, error.ErrorDescription)
@@ -85,15 +324,17 @@ def writeProductRecords(gen, delimiter):
                     error.ErrorID,
                     error.ErrorDescription)
 
-            writer.writerow([record.ProductID, record.ProductIDDescription])
-            sys.stdout.flush()
+            writer.write([record.ProductID, record.ProductIDDescription])
+
+    closeWriter(writer)
 
 
-def writeEOXRecords(gen, delimiter):
-    writer = csv.writer(sys.stdout, delimiter=delimiter)
-    writer.writerow(eox.RECORD_COLUMNS)
+def writeEOXRecords(gen, options, writer=None):
+    if writer is None:
+        writer = getWriter(options, eox.RECORD_COLUMNS, 'records')
 
     for response in gen:
+        writer.poll()
         error = getattr(response, 'EOXError', None)
         if error:
             log.error('%s: %s', error.ErrorID, error.ErrorDescription)
@@ -103,42 +344,185 @@ def writeEOXRecords(gen, delimiter):
             continue
 
         for record in response.EOXRecord:
-            error = getattr(record, 'EOXError', None)
+            values, error = eox.getRecordValues(record)
             if error:
                 log.warn('%s: %s',
-                    error.ErrorID,
-                    error.ErrorDescription)
+                    error['ErrorID'],
+                    error['ErrorDescription'])
+
+            writer.write(
+                [values[column_name] for column_name in eox.RECORD_COLUMNS])
+
+    closeWriter(writer)
+
+
+def writeShardedEOXRecords(options, method, args=(), inputs=None):
+    """
+    Crawl method split into options.shards shards, run by processes on this
+    host and on any other host given the same --shard-dir, and write the
+    merged records once every shard is done.
+    """
+    import multiprocessing
+    import shutil
+    import tempfile
+
+    import shards
+
+    directory = options.shardDir or tempfile.mkdtemp(prefix='eox-shards-')
+    manifest = shards.Manifest(directory)
+    if manifest.exists():
+        existing = manifest.load()
+        if existing['method'] != method \
+            or existing['shards'] != options.shards:
+
+            log.error('%s holds %s shards of %s', directory,
+                existing['shards'], existing['method'])
+
+            sys.exit(1)
+    else:
+        manifest.create(method, args, options.shards, inputs)
+
+    if options.reclaim:
+        manifest.reclaim()
+
+    processes = min(options.shards,
+        options.processes or multiprocessing.cpu_count())
+
+    workers = []
+    for index in range(processes):
+        worker = multiprocessing.Process(target=crawlShards,
+            args=(manifest, options, index, processes))
+
+        worker.start()
+        workers.append(worker)
+
+    for worker in workers:
+        worker.join()
+
+    missing = manifest.getMissing()
+    if missing:
+        log.error('%s of %s shards are not done; run again with --shard-dir '
+            '%s to finish them and merge', len(missing), options.shards,
+            directory)
+
+        sys.exit(1)
 
-                if getattr(error, 'ErrorDataType', '') == 'PRODUCT_ID': 
-                    setattr(record, 'EOLProductID', error.ErrorDataValue)
-                
-            row = []
-            for column_name in eox.RECORD_COLUMNS:
-                column = getattr(record, column_name, '')
-                value = None
-                if column is None:
-                    value = ''
-                elif isinstance(column, types.StringTypes):
-                    value = column
-                else:
-                    value = column.value
-                    
-                row.append(value.strip())
-
-            writer.writerow(row)
-            sys.stdout.flush()
+    writer = getWriter(options, eox.RECORD_COLUMNS, 'records')
+    manifest.merge(writer)
+    closeWriter(writer)
+
+    if not options.shardDir:
+        shutil.rmtree(directory, True)
+
+
+def crawlShards(manifest, options, index, processes):
+    """
+    Run the shards of manifest until none are left to claim, with a Server
+    of its own. Called in each of processes worker processes, which share
+    the rate limit and write their metrics to files suffixed with index. A
+    worker stops at the first shard that fails.
+    """
+    import shards
+
+    if options.rate:
+        options.rate /= processes
+
+    for name in ('metricsProm', 'metricsJSON'):
+        if getattr(options, name):
+            setattr(options, name, '%s.%s' % (getattr(options, name), index))
+
+    server = getServer(options)
+    failed = False
+    try:
+        while True:
+            shard = manifest.claim()
+            if shard is None:
+                break
+
+            try:
+                manifest.run(server, shard)
+            except shards.ShardError, ex:
+                log.error('%s', ex)
+                failed = True
+                break
+    finally:
+        if closeServer(server, options):
+            failed = True
+
+    sys.exit(int(failed))
 
 
 def getAllEOX():
     def usage(msg=None):
         if msg:
             print >> sys.stderr, msg
-        print >> sys.stderr, "Usage: %s <-u username> <-p password>" % sys.argv[0]
+        print >> sys.stderr, "Usage: %s <-u username> <-p password> [--since-last-sync] [--checkpoint file [--resume]]" % sys.argv[0]
         sys.exit(1)
 
-    options = getOptions(getOptionParser(), usage)[0]
-    server = eox.Server(options.username, options.password, options.threads)
-    writeEOXRecords(server.getAll(), options.delimiter)
+    parser = getOptionParser()
+    parser.add_option('--snapshot', dest='snapshot',
+        help='Snapshot file holding the records from the last sync')
+    parser.add_option('--since-last-sync', dest='sinceLastSync',
+        action='store_true', default=False,
+        help='Only request records updated since the last sync')
+    parser.add_option('--checkpoint', dest='checkpoint',
+        help='Journal file recording the progress of the crawl')
+    parser.add_option('--resume', dest='resume',
+        action='store_true', default=False,
+        help='Continue the crawl journaled in the checkpoint file')
+    addShardOptions(parser)
+    options = getOptions(parser, usage)[0]
+
+    if options.sinceLastSync and not options.snapshot:
+        usage("You must specify the snapshot file to sync since the last sync.")
+
+    if options.checkpoint and options.snapshot:
+        usage("You can't checkpoint a sync.")
+
+    if options.checkpoint and not options.output:
+        usage("You must specify the output file to checkpoint a crawl.")
+
+    if options.resume and not options.checkpoint:
+        usage("You must specify the checkpoint file to resume a crawl.")
+
+    if options.shards and (options.snapshot or options.checkpoint):
+        usage("You can't shard a sync or a checkpointed crawl.")
+
+    if options.shards:
+        writeShardedEOXRecords(options, 'getAll')
+        return
+
+    server = getServer(options)
+    if options.snapshot:
+        snapshot = Snapshot(options.snapshot)
+        writeEOXRecords(
+            server.syncAll(snapshot, full=not options.sinceLastSync), options)
+
+        snapshot.close()
+    elif options.checkpoint:
+        checkpoint = Checkpoint(options.checkpoint)
+        offset = None
+        if options.resume:
+            offset = checkpoint.getOutputOffset()
+
+        if offset is None:
+            checkpoint.clear()
+
+        writer = getWriter(options, eox.RECORD_COLUMNS, 'records',
+            append=offset is not None)
+
+        if offset is not None:
+            log.info('resuming crawl from output offset %s', offset)
+            writer.truncate(offset)
+
+        checkpoint.getOffset = writer.tell
+        writeEOXRecords(server.getAll(checkpoint), options, writer)
+        checkpoint.close()
+    else:
+        writeEOXRecords(server.getAll(), options)
+
+    if closeServer(server, options):
+        sys.exit(1)
 
 
 def getAllProducts():
@@ -149,8 +533,10 @@ def getAllProducts():
         sys.exit(1)
 
     options = getOptions(getOptionParser(), usage)[0]
-    server = eox.Server(options.username, options.password, options.threads)
-    writeProductRecords(server.getAllProductIDs(), options.delimiter)
+    server = getServer(options)
+    writeProductRecords(server.getAllProductIDs(), options)
+    if closeServer(server, options):
+        sys.exit(1)
     
 
 def getEOXByDates():
@@ -165,6 +551,7 @@ def getEOXByDates():
         help='Start date (YYYY-MM-DD)')
     parser.add_option('-e', '--end', dest='end',
         help='End date (YYYY-MM-DD)')
+    addShardOptions(parser)
     options = getOptions(parser, usage)[0]
 
     if not options.start:
@@ -173,69 +560,111 @@ def getEOXByDates():
     if not options.end:
         usage("You must specify the end date (YYYY-MM-DD.")
 
-    server = eox.Server(options.username, options.password, options.threads)
+    if options.shards:
+        writeShardedEOXRecords(options, 'getEOXByDates',
+            [options.start, options.end, None])
+
+        return
+
+    server = getServer(options)
     writeEOXRecords(
-        server.getEOXByDates(options.start, options.end, None),
-        options.delimiter)
+        server.getEOXByDates(options.start, options.end, None), options)
+    if closeServer(server, options):
+        sys.exit(1)
 
 
 def getEOXByOID():
     def usage(msg=None):
         if msg:
             print >> sys.stderr, msg
-        print >> sys.stderr, "Usage: %s <-u username> <-p password> <-h hardwareType> <OID> [OID]" % sys.argv[0]
+        print >> sys.stderr, "Usage: %s <-u username> <-p password> <-H hardwareType> <-f file> [OID] [...]" % sys.argv[0]
         sys.exit(1)
 
     parser = getOptionParser()
-    parser.add_option('-h', '--hardwareType', dest='hardwareType',
+    parser.add_option('-H', '--hardwareType', dest='hardwareType',
         help='Hardware type')
+    addFileOption(parser, 'OID input file.')
+    addShardOptions(parser)
     options, args = getOptions(parser, usage)
 
     if not options.hardwareType:
         usage("You must specify the hardware type.")
 
-    if len(args) < 1:
-        usage("You must specify the OID(s).")
+    if not options.file and len(args) < 1:
+        usage("You must specify the file option or OID(s).")
 
-    server = eox.Server(options.username, options.password, options.threads)
-    writeEOXRecords(server.getEOXByOID(args), options.delimiter)
+    if options.shards:
+        writeShardedEOXRecords(options, 'getEOXByOID',
+            [options.hardwareType], readInputs(options, args))
+
+        return
+
+    server = getServer(options)
+    writeEOXRecords(server.getEOXByOID(readInputs(options, args),
+        options.hardwareType), options)
+    if closeServer(server, options):
+        sys.exit(1)
 
 
 def getEOXByProductID():
     def usage(msg=None):
         if msg:
             print >> sys.stderr, msg
-        print >> sys.stderr, "Usage: %s <-u username> <-p password> <productID> [productID] [...]" % sys.argv[0]
+        print >> sys.stderr, "Usage: %s <-u username> <-p password> <-f file> [productID] [...]" % sys.argv[0]
         sys.exit(1)
 
-    options, args = getOptions(getOptionParser(), usage)
-    if len(args) < 1:
-        usage("You must specify the product ID(s).")
+    parser = getOptionParser()
+    addFileOption(parser, 'Product ID input file.')
+    addShardOptions(parser)
+    options, args = getOptions(parser, usage)
+
+    if not options.file and len(args) < 1:
+        usage("You must specify the file option or product ID(s).")
 
-    server = eox.Server(options.username, options.password, options.threads)
-    writeEOXRecords(server.getEOXByProductID(args), options.delimiter)
+    if options.shards:
+        writeShardedEOXRecords(options, 'getEOXByProductID', [],
+            readInputs(options, args))
+
+        return
+
+    server = getServer(options)
+    writeEOXRecords(server.getEOXByProductID(readInputs(options, args)),
+        options)
+    if closeServer(server, options):
+        sys.exit(1)
 
 
 def getEOXBySWRelease():
     def usage(msg=None):
         if msg:
             print >> sys.stderr, msg
-        print >> sys.stderr, "Usage: %s <-u username> <-p password> <-o osType> <swRelease> [swRelease]" % sys.argv[0]
+        print >> sys.stderr, "Usage: %s <-u username> <-p password> <-o osType> <-f file> [swRelease] [...]" % sys.argv[0]
         sys.exit(1)
 
     parser = getOptionParser()
     parser.add_option('-o', '--osType', dest='osType',
         help='Operating system type')
+    addFileOption(parser, 'Software release input file.')
+    addShardOptions(parser)
     options, args = getOptions(parser, usage)
 
     if not options.osType:
         usage("You must specify the operating system type.")
 
-    if len(args) < 1:
-        usage("You must specify the software release(es).")
+    if not options.file and len(args) < 1:
+        usage("You must specify the file option or software release(es).")
 
-    server = eox.Server(options.username, options.password, options.threads)
-    writeEOXRecords(server.getEOXBySWReleaseString(args), options.delimiter)
+    if options.shards:
+        writeShardedEOXRecords(options, 'getEOXBySWReleaseString',
+            [options.osType], readInputs(options, args))
+
+        return
+
+    server = getServer(options)
+    writeEOXRecords(server.getEOXBySWReleaseString(
+        readInputs(options, args), options.osType), options)
+    if closeServer(server, options):
+        sys.exit(1)
 
 
 def getEOXBySerialNumber():
@@ -246,20 +675,244 @@ def getEOXBySerialNumber():
         sys.exit(1)
 
     parser = getOptionParser()
-    parser.add_option('-f', '--file', dest='file',
-        help='Serial number input file.')
+    addFileOption(parser, 'Serial number input file.')
+    addShardOptions(parser)
     (options, args) = getOptions(parser, usage)
 
     if not options.file and len(args) < 1:
         usage("You must specify the file option or serial number(s).")
 
-    serials = args
-    if options.file:
-        inputfile = open(options.file, 'r')
-        for line in inputfile:
-            serials.append(line.strip())
+    if options.shards:
+        writeShardedEOXRecords(options, 'getEOXBySerialNumber', [],
+            readInputs(options, args))
+
+        return
+
+    server = getServer(options)
+    writeEOXRecords(server.getEOXBySerialNumber(readInputs(options, args)),
+        options)
+    if closeServer(server, options):
+        sys.exit(1)
+
+
+def queryEOX():
+    def usage(msg=None):
+        if msg:
+            print >> sys.stderr, msg
+        print >> sys.stderr, "Usage: %s <--store file> [-P product] [-i input] [-s serial] [-c column] [--from YYYY-MM-DD] [--to YYYY-MM-DD]" % sys.argv[0]
+        sys.exit(1)
+
+    from store import DATE_COLUMNS, RecordStore
+
+    parser = OptionParser()
+    addOutputOptions(parser)
+    parser.add_option('--store', dest='store',
+        help='Local store of EOX records to query')
+    parser.add_option('-P', '--product', dest='product',
+        help='EOLProductID to match')
+    parser.add_option('-i', '--input', dest='input',
+        help='Input value, such as an OID or software release, to match')
+    parser.add_option('-s', '--serial', dest='serial',
+        help='Serial number to match')
+    parser.add_option('-c', '--column', dest='column',
+        type='choice', choices=DATE_COLUMNS,
+        help='Date column to match: %s' % ', '.join(DATE_COLUMNS))
+    parser.add_option('--from', dest='start',
+        help='First date of --column to match (YYYY-MM-DD)')
+    parser.add_option('--to', dest='end',
+        help='Last date of --column to match (YYYY-MM-DD)')
+    parser.add_option('--within', dest='within', type='int',
+        help='Match dates of --column from today to this many days ahead')
+    parser.add_option('--limit', dest='limit', type='int',
+        help='Most records to write')
+    options = getOptions(parser, usage, login=False)[0]
+
+    if not options.store:
+        usage("You must specify the store file.")
+
+    if (options.start or options.end or options.within is not None) \
+        and not options.column:
+
+        usage("You must specify the date column to match.")
+
+    if options.serial:
+        if options.input:
+            usage("You can't specify both an input and a serial number.")
+
+        options.input = eox.normalizeSerialNumber(options.serial)
+
+    if options.within is not None:
+        today = datetime.date.today()
+        options.start = today.isoformat()
+        options.end = (
+            today + datetime.timedelta(days=options.within)).isoformat()
+
+    store = RecordStore(options.store)
+    freshness = store.getFreshness()
+    if freshness['records']:
+        log.info('%s records stored between %s and %s', freshness['records'],
+            time.strftime('%Y-%m-%d %H:%M:%S',
+                time.localtime(freshness['oldest'])),
+            time.strftime('%Y-%m-%d %H:%M:%S',
+                time.localtime(freshness['newest'])))
+    else:
+        log.warn('%s holds no records', options.store)
+
+    writer = getWriter(options, eox.RECORD_COLUMNS, 'records')
+    records = 0
+    for values, stored in store.query(productID=options.product,
+        inputValue=options.input, column=options.column,
+        start=options.start, end=options.end, limit=options.limit):
+
+        writer.write([values[column] for column in eox.RECORD_COLUMNS])
+        records += 1
+
+    closeWriter(writer)
+    store.close()
+    log.info('%s records matched', records)
+
+
+def readBatchInputs(lines):
+    """
+    Yield (queryType, value, qualifier) for each line of the form
+    "type[:qualifier] value", skipping blank lines and warning of those
+    that don't parse.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        parts = line.split(None, 1)
+        query_type, _, qualifier = parts[0].partition(':')
+        query_type = query_type.lower()
+        if len(parts) < 2 or query_type not in eox.BATCH_TYPES:
+            log.warn('skipping unrecognized input: %s', line)
+            continue
+
+        if query_type not in ('oid', 'sw') and qualifier:
+            log.warn('ignoring the qualifier of input: %s', line)
 
-        inputfile.close()
+        yield query_type, parts[1].strip(), qualifier or None
 
-    server = eox.Server(options.username, options.password, options.threads)
-    writeEOXRecords(server.getEOXBySerialNumber(serials), options.delimiter)
+
+def getEOXBatch():
+    def usage(msg=None):
+        if msg:
+            print >> sys.stderr, msg
+        print >> sys.stderr, "Usage: %s <-u username> <-p password> <-f file> ['type[:qualifier] value'] [...]" % sys.argv[0]
+        sys.exit(1)
+
+    parser = getOptionParser()
+    addFileOption(parser, 'Input file of lines such as "serial FOC123", '
+        '"product WS-C2960-24TT-L", "oid:hardwareType OID" or '
+        '"sw:osType release".')
+    (options, args) = getOptions(parser, usage)
+
+    if not options.file and len(args) < 1:
+        usage("You must specify the file option or input(s).")
+
+    server = getServer(options)
+    writeEOXRecords(
+        server.getEOXBatch(readBatchInputs(readInputs(options, args))),
+        options)
+    if closeServer(server, options):
+        sys.exit(1)
+
+
+def addSortOptions(parser):
+    parser.add_option('--input-format', dest='inputFormat', default='csv',
+        type='choice', choices=sorted(writers.FORMATS.keys()),
+        help='Format the input records were written in')
+    parser.add_option('--buffer-rows', dest='bufferRows', type='int',
+        help='Most records sorted in memory before spilling to disk')
+    parser.add_option('--temp-dir', dest='tempDir',
+        help='Directory for the sorted runs spilled to disk')
+
+
+def readSortedRecords(path, options, sorter):
+    """
+    Yield the records written to path in options.inputFormat as lists of
+    RECORD_COLUMNS values sorted by EOLProductID and UpdatedTimeStamp, with
+    duplicates dropped.
+    """
+    from extsort import dedupeRecords
+
+    rows = writers.readRecords(path, options.inputFormat, options.delimiter)
+    values = ([row.get(column, '') for column in eox.RECORD_COLUMNS]
+        for row in rows)
+
+    return dedupeRecords(sorter.sort(values), sorter.key)
+
+
+def getSorter(options):
+    from extsort import BUFFER_ROWS, ExternalSorter, getKey
+
+    return ExternalSorter(getKey(), options.bufferRows or BUFFER_ROWS,
+        directory=options.tempDir)
+
+
+def dedupeEOX():
+    def usage(msg=None):
+        if msg:
+            print >> sys.stderr, msg
+        print >> sys.stderr, "Usage: %s [--input-format format] <input>" % sys.argv[0]
+        sys.exit(1)
+
+    parser = OptionParser()
+    addOutputOptions(parser)
+    addSortOptions(parser)
+    (options, args) = getOptions(parser, usage, login=False)
+
+    if len(args) != 1:
+        usage("You must specify one input file, or - for stdin.")
+
+    sorter = getSorter(options)
+    writer = getWriter(options, eox.RECORD_COLUMNS, 'records')
+    records = 0
+    try:
+        for values in readSortedRecords(args[0], options, sorter):
+            writer.write(values)
+            records += 1
+    finally:
+        sorter.close()
+
+    closeWriter(writer)
+    log.info('wrote %s unique records', records)
+
+
+def diffEOX():
+    def usage(msg=None):
+        if msg:
+            print >> sys.stderr, msg
+        print >> sys.stderr, "Usage: %s [--input-format format] <old> <new>" % sys.argv[0]
+        sys.exit(1)
+
+    from extsort import ADDED, CHANGED, REMOVED, diffRecords
+
+    parser = OptionParser()
+    addOutputOptions(parser)
+    addSortOptions(parser)
+    (options, args) = getOptions(parser, usage, login=False)
+
+    if len(args) != 2:
+        usage("You must specify the old and the new input files.")
+
+    old_sorter = getSorter(options)
+    new_sorter = getSorter(options)
+    writer = getWriter(options, ['Change'] + eox.RECORD_COLUMNS, 'changes')
+    counts = {}
+    try:
+        for change, values in diffRecords(
+            readSortedRecords(args[0], options, old_sorter),
+            readSortedRecords(args[1], options, new_sorter)):
+
+            writer.write([change] + values)
+            counts[change] = counts.get(change, 0) + 1
+    finally:
+        old_sorter.close()
+        new_sorter.close()
+
+    closeWriter(writer)
+    log.info('added: %s, changed: %s, removed: %s', counts.get(ADDED, 0),
+        counts.get(CHANGED, 0), counts.get(REMOVED, 0))
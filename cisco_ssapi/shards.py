@@ -0,0 +1,344 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.shards')
+
+import errno
+import glob
+import json
+import os
+import socket
+import zlib
+
+import writers
+from eox import FailedResponse, RECORD_COLUMNS
+from eox import getRecordValues, normalizeInput, normalizeSerialNumber
+from extsort import BUFFER_ROWS, ExternalSorter, dedupeRecords, getKey
+
+MANIFEST = 'manifest.json'
+INPUTS = 'inputs.txt'
+
+# Server methods that can be sharded. Paged methods are split by page of the
+# showAllProductIDs or showEOXByDates listing, the others by input value.
+PAGED_METHODS = {
+    'getAll': 'showAllProductIDs',
+    'getEOXByDates': 'showEOXByDates',
+    }
+
+LOOKUP_METHODS = {
+    'getEOXByOID': normalizeInput,
+    'getEOXByProductID': normalizeInput,
+    'getEOXBySWReleaseString': normalizeInput,
+    'getEOXBySerialNumber': normalizeSerialNumber,
+    }
+
+
+class ShardError(Exception):
+    pass
+
+
+def getShard(value, count, normalize=normalizeInput):
+    """
+    Return the shard of count that value belongs to. The same value always
+    lands in the same shard, whatever the host or Python version.
+    """
+    return (zlib.crc32(normalize(value)) & 0xffffffff) % count
+
+
+def getShardPages(shard, count, lastIndex):
+    """
+    Return the page numbers of shard out of count for a listing of
+    lastIndex pages. Pages are dealt out in turn so that every shard gets
+    about as many.
+    """
+    return range(shard + 1, lastIndex + 1, count)
+
+
+class Manifest(object):
+    """
+    Description and progress of a sharded crawl, kept in a directory that
+    every process and host taking part can reach, such as a shared
+    filesystem.
+
+    The manifest names the Server method, its arguments and the number of
+    shards, and holds the input values of lookup methods so that every
+    host sees the same ones. Each shard is claimed by creating a claim file
+    exclusively, so only one worker runs it, and is done once its records
+    have been renamed into place as a BinaryWriter dump. A worker that
+    fails releases its claim for another to take. Claims left by a host
+    that died are only released by reclaim.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._manifest = None
+
+
+    def exists(self):
+        return os.path.exists(self.getPath(MANIFEST))
+
+
+    def create(self, method, args, count, inputs=None):
+        """
+        Write the manifest for count shards of method called with args, a
+        list of JSON values. The input values of a lookup method go in
+        inputs, any iterable, and each shard calls it with its own values
+        ahead of args. They are written out a line at a time as they are
+        read, so they are never all held in memory.
+        """
+        if method not in PAGED_METHODS and method not in LOOKUP_METHODS:
+            raise ShardError('%s cannot be sharded' % method)
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        if inputs is not None:
+            self._writeAtomically(INPUTS,
+                ('%s\n' % value for value in inputs))
+
+        self._manifest = {
+            'method': method,
+            'args': list(args),
+            'shards': count,
+            'inputs': inputs is not None,
+            }
+
+        self._writeAtomically(MANIFEST, [json.dumps(self._manifest)])
+
+
+    def load(self):
+        """
+        Return the manifest as a dict of method, args, shards and inputs.
+        """
+        if self._manifest is None:
+            manifest = open(self.getPath(MANIFEST))
+            try:
+                self._manifest = json.load(manifest)
+            finally:
+                manifest.close()
+
+        return self._manifest
+
+
+    def getPath(self, name):
+        return os.path.join(self.directory, name)
+
+
+    def getOutputPath(self, shard):
+        return self.getPath('shard-%04d.bin' % shard)
+
+
+    def getClaimPath(self, shard):
+        return self.getPath('shard-%04d.claim' % shard)
+
+
+    def getMissing(self):
+        """
+        Return the shards whose records aren't in place yet.
+        """
+        return [shard for shard in range(self.load()['shards'])
+            if not os.path.exists(self.getOutputPath(shard))]
+
+
+    def isComplete(self):
+        return not self.getMissing()
+
+
+    def claim(self):
+        """
+        Claim the first shard that is neither done nor claimed and return
+        it, or None if there are none left.
+        """
+        for shard in self.getMissing():
+            try:
+                fd = os.open(self.getClaimPath(shard),
+                    os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            except OSError, ex:
+                if ex.errno == errno.EEXIST:
+                    continue
+
+                raise
+
+            os.write(fd, '%s %s\n' % (socket.gethostname(), os.getpid()))
+            os.close(fd)
+            return shard
+
+        return None
+
+
+    def release(self, shard):
+        try:
+            os.remove(self.getClaimPath(shard))
+        except OSError, ex:
+            if ex.errno != errno.ENOENT:
+                raise
+
+
+    def reclaim(self):
+        """
+        Release the claims of every shard not done and remove what their
+        workers left behind, for when those workers are known to be gone.
+        """
+        for shard in self.getMissing():
+            for partial in glob.glob(self.getOutputPath(shard) + '.*'):
+                os.remove(partial)
+
+            self.release(shard)
+
+
+    def run(self, server, shard):
+        """
+        Request the records of shard with server and put them in place.
+        Raises ShardError if any page failed. Whatever the failure, the
+        claim is released so the shard can be claimed again.
+        """
+        manifest = self.load()
+        path = self.getOutputPath(shard)
+        partial = '%s.%s.%s' % (path, socket.gethostname(), os.getpid())
+        output = open(partial, 'wb')
+        failed = 0
+        records = 0
+        try:
+            try:
+                writer = writers.BinaryWriter(output, RECORD_COLUMNS)
+                for response in self.getResponses(server, shard):
+                    if isinstance(response, FailedResponse):
+                        failed += 1
+                        continue
+
+                    for record in getattr(response, 'EOXRecord', None) or []:
+                        values, error = getRecordValues(record)
+                        writer.write(
+                            [values[column] for column in RECORD_COLUMNS])
+
+                        records += 1
+
+                writer.close()
+            finally:
+                output.close()
+
+            if failed:
+                raise ShardError('%s pages of shard %s failed' % (
+                    failed, shard + 1))
+        except:
+            os.remove(partial)
+            self.release(shard)
+            raise
+
+        os.rename(partial, path)
+        log.info('shard %s of %s done with %s records',
+            shard + 1, manifest['shards'], records)
+
+
+    def getResponses(self, server, shard):
+        """
+        Yield the responses of shard's part of the crawl from server.
+        """
+        manifest = self.load()
+        method = manifest['method']
+        args = manifest['args']
+        count = manifest['shards']
+
+        if method in PAGED_METHODS:
+            listing_args = []
+            if method == 'getEOXByDates':
+                listing_args = (args + [None, None, None])[:3]
+
+            last_index = server.getPageCount(
+                PAGED_METHODS[method], listing_args)
+
+            pages = getShardPages(shard, count, last_index)
+            log.info('shard %s of %s has %s of %s pages',
+                shard + 1, count, len(pages), last_index)
+
+            # pylint: disable-msg=W0142
+            return getattr(server, method)(*args, **{'pages': pages})
+
+        normalize = LOOKUP_METHODS[method]
+
+        def getValues():
+            inputs = open(self.getPath(INPUTS))
+            try:
+                for line in inputs:
+                    value = line.rstrip('\n')
+                    if getShard(value, count, normalize) == shard:
+                        yield value
+            finally:
+                inputs.close()
+
+        # pylint: disable-msg=W0142
+        return getattr(server, method)(getValues(), *args)
+
+
+    def merge(self, writer, bufferRows=BUFFER_ROWS):
+        """
+        Write the records of every shard to a writers.RecordWriter, sorted
+        and with duplicate rows dropped. Returns the number of rows written.
+
+        Rows are sorted with an extsort.ExternalSorter that spills sorted
+        runs of bufferRows rows to the manifest's directory, so the merge
+        holds no more than that many rows however big the shards are.
+        """
+        # Rows read from the shards, counted as they are read.
+        read = [0]
+
+        def readShards():
+            for shard in range(self.load()['shards']):
+                dump = open(self.getOutputPath(shard), 'rb')
+                try:
+                    for row in writers.readBinary(dump):
+                        read[0] += 1
+                        yield [row[column] for column in RECORD_COLUMNS]
+                finally:
+                    dump.close()
+
+        sorter = ExternalSorter(getKey(RECORD_COLUMNS, RECORD_COLUMNS),
+            bufferRows=bufferRows, directory=self.directory)
+
+        written = 0
+        try:
+            rows = sorter.sort(readShards())
+            for values in dedupeRecords(rows, sorter.key):
+                writer.write(values)
+                written += 1
+        finally:
+            sorter.close()
+
+        log.info('merged %s records, dropped %s duplicates', written,
+            read[0] - written)
+
+        return written
+
+
+    def _writeAtomically(self, name, parts):
+        """
+        Write an iterable of strings to a partial file and rename it to
+        name once they are all written.
+        """
+        path = self.getPath(name)
+        partial = '%s.%s.%s' % (path, socket.gethostname(), os.getpid())
+        output = open(partial, 'wb')
+        try:
+            for part in parts:
+                output.write(part)
+        finally:
+            output.close()
+
+        os.rename(partial, path)
@@ -0,0 +1,199 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.store')
+
+import sqlite3
+import threading
+import time
+
+from records import RECORD_COLUMNS
+
+# Columns of RECORD_COLUMNS holding YYYY-MM-DD dates.
+DATE_COLUMNS = [
+    'EOXExternalAnnouncementDate',
+    'EndOfSaleDate',
+    'EndOfSWMaintenanceReleases',
+    'EndOfRoutineFailureAnalysisDate',
+    'EndOfServiceContractRenewal',
+    'LastDateOfSupport',
+    'EndOfSvcAttachDate',
+    'UpdatedTimeStamp',
+    ]
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS records (
+        id INTEGER PRIMARY KEY,
+        %s,
+        stored REAL NOT NULL,
+        UNIQUE (EOLProductID, EOXInputType, EOXInputValue))""" % (
+        ', '.join(['%s TEXT NOT NULL' % name for name in RECORD_COLUMNS])),
+    """CREATE TABLE IF NOT EXISTS inputs (
+        value TEXT NOT NULL,
+        record INTEGER NOT NULL,
+        PRIMARY KEY (value, record))""",
+    """CREATE INDEX IF NOT EXISTS inputs_record ON inputs (record)""",
+    """CREATE INDEX IF NOT EXISTS records_stored ON records (stored)""",
+    ] + [
+    """CREATE INDEX IF NOT EXISTS records_%s ON records (%s)""" % (
+        name, name) for name in DATE_COLUMNS]
+
+
+class RecordStore(object):
+    """
+    Local queryable store of EOX records, filled by a Server as it receives
+    them.
+
+    Each record is kept once per EOLProductID and input, with the time it
+    was stored, replacing the record stored earlier. Records are indexed by
+    EOLProductID, by each of the comma-separated input values in their
+    EOXInputValue and by each of the DATE_COLUMNS, so lookups by any of
+    those don't scan the store. Records that only hold an EOXError aren't
+    stored.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        for statement in SCHEMA:
+            self._connection.execute(statement)
+
+        self._connection.commit()
+
+
+    def update(self, records):
+        """
+        Store a list of (values, error) records as returned by
+        eox.getRecordValues.
+        """
+        now = time.time()
+        self._lock.acquire()
+        try:
+            for values, error in records:
+                if error or not values['EOLProductID']:
+                    continue
+
+                key = (values['EOLProductID'], values['EOXInputType'],
+                    values['EOXInputValue'])
+
+                self._connection.execute(
+                    "DELETE FROM inputs WHERE record IN (SELECT id "
+                    "FROM records WHERE EOLProductID = ? "
+                    "AND EOXInputType = ? AND EOXInputValue = ?)", key)
+
+                cursor = self._connection.execute(
+                    "INSERT OR REPLACE INTO records (%s, stored) "
+                    "VALUES (%s, ?)" % (
+                        ', '.join(RECORD_COLUMNS),
+                        ', '.join(['?'] * len(RECORD_COLUMNS))),
+                    [values[name] for name in RECORD_COLUMNS] + [now])
+
+                inputs = [value.strip()
+                    for value in values['EOXInputValue'].split(',')]
+
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO inputs (value, record) "
+                    "VALUES (?, ?)", [(value, cursor.lastrowid)
+                        for value in inputs if value])
+
+            self._connection.commit()
+        finally:
+            self._lock.release()
+
+
+    def query(self, productID=None, inputValue=None, column=None,
+        start=None, end=None, limit=None):
+        """
+        Yield (values, stored) for every record matching all the criteria
+        given, in EOLProductID order. values is a dict of RECORD_COLUMNS
+        and stored the time the record was stored.
+
+        column names one of DATE_COLUMNS to match records whose date in it
+        falls between start and end, YYYY-MM-DD dates, inclusive. Either
+        may be left out for an open range. Records without that date never
+        match.
+        """
+        clauses = []
+        params = []
+        if productID is not None:
+            clauses.append('EOLProductID = ?')
+            params.append(productID)
+
+        if inputValue is not None:
+            clauses.append(
+                'id IN (SELECT record FROM inputs WHERE value = ?)')
+
+            params.append(inputValue)
+
+        if column is not None:
+            if column not in DATE_COLUMNS:
+                raise ValueError('%s is not a date column' % column)
+
+            clauses.append("%s != ''" % column)
+            if start is not None:
+                clauses.append("%s >= ?" % column)
+                params.append(start)
+
+            if end is not None:
+                clauses.append("%s <= ?" % column)
+                params.append(end)
+
+        sql = "SELECT %s, stored FROM records" % ', '.join(RECORD_COLUMNS)
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+
+        sql += " ORDER BY EOLProductID, EOXInputValue"
+        if limit is not None:
+            sql += " LIMIT %d" % limit
+
+        self._lock.acquire()
+        try:
+            rows = self._connection.execute(sql, params).fetchall()
+        finally:
+            self._lock.release()
+
+        for row in rows:
+            yield dict(zip(RECORD_COLUMNS, row[:-1])), row[-1]
+
+
+    def getFreshness(self):
+        """
+        Return a dict of the number of records stored and the times the
+        oldest and newest of them were stored, None when there are none.
+        """
+        self._lock.acquire()
+        try:
+            count, oldest, newest = self._connection.execute(
+                "SELECT COUNT(*), MIN(stored), MAX(stored) "
+                "FROM records").fetchone()
+        finally:
+            self._lock.release()
+
+        return {'records': count, 'oldest': oldest, 'newest': newest}
+
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            self._connection.commit()
+            self._connection.close()
+        finally:
+            self._lock.release()
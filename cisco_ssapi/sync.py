@@ -0,0 +1,134 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.sync')
+
+import cPickle as pickle
+import sqlite3
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS records (
+        product_id TEXT PRIMARY KEY,
+        record BLOB NOT NULL)""",
+    """CREATE TABLE IF NOT EXISTS sync (
+        name TEXT PRIMARY KEY,
+        value TEXT)""",
+    ]
+
+
+class Snapshot(object):
+    """
+    Local copy of the full EOX dataset as of the last sync.
+
+    Records are stored as the (values, error) pairs returned by
+    eox.getRecordValues, keyed by EOLProductID. The date of the last
+    successful sync is kept alongside them so later syncs only need the
+    records updated since then.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        for statement in SCHEMA:
+            self._connection.execute(statement)
+
+        self._connection.commit()
+
+
+    def getLastSync(self):
+        """
+        Return the YYYY-MM-DD date of the last successful sync or None.
+        """
+        row = self._connection.execute(
+            "SELECT value FROM sync WHERE name = 'lastSync'").fetchone()
+
+        if row is None:
+            return None
+
+        return row[0]
+
+
+    def setLastSync(self, date):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO sync (name, value) "
+            "VALUES ('lastSync', ?)", (date,))
+
+        self._connection.commit()
+
+
+    def clear(self):
+        """
+        Remove every record and forget the last sync.
+        """
+        self._connection.execute("DELETE FROM records")
+        self._connection.execute("DELETE FROM sync")
+        self._connection.commit()
+
+
+    def get(self, productID):
+        row = self._connection.execute(
+            "SELECT record FROM records WHERE product_id = ?",
+            (productID,)).fetchone()
+
+        if row is None:
+            return None
+
+        return pickle.loads(str(row[0]))
+
+
+    def update(self, records):
+        """
+        Store a list of (values, error) records, replacing any stored record
+        with the same EOLProductID.
+        """
+        rows = []
+        for values, error in records:
+            if not values['EOLProductID']:
+                continue
+
+            rows.append((values['EOLProductID'],
+                sqlite3.Binary(pickle.dumps((values, error), 2))))
+
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO records (product_id, record) "
+            "VALUES (?, ?)", rows)
+
+        self._connection.commit()
+
+
+    def getRecords(self):
+        """
+        Yield every stored (values, error) record in EOLProductID order.
+        """
+        cursor = self._connection.execute(
+            "SELECT record FROM records ORDER BY product_id")
+
+        for row in cursor:
+            yield pickle.loads(str(row[0]))
+
+
+    def getCount(self):
+        return self._connection.execute(
+            "SELECT COUNT(*) FROM records").fetchone()[0]
+
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
@@ -0,0 +1,232 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.transport')
+
+import httplib
+import socket
+import threading
+import urlparse
+import zlib
+
+# Most idle connections kept to each host.
+POOL_SIZE = 10
+
+# Seconds a connection waits to connect or for a reply.
+TIMEOUT = 90
+
+ACCEPT_ENCODING = 'gzip, deflate'
+
+
+class ConnectionPool(object):
+    """
+    Keep-alive HTTP connections shared by the transports of every worker
+    thread of a Server.
+
+    A connection is taken for one request and put back once its reply has
+    been read, so each carries one request at a time and only as many are
+    open as requests are in flight. Up to size idle connections are kept to
+    each host and any more are closed.
+
+    The service may close an idle connection at any time. A request that
+    fails on a reused connection is sent again once on a new one; EOX
+    requests only read, so sending one twice is harmless.
+    """
+
+    def __init__(self, size=POOL_SIZE, timeout=TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self.requests = 0
+        self.connections = 0
+        self.reused = 0
+        self.stale = 0
+        self.compressed = 0
+        self.bytesReceived = 0
+        self.bytesDecoded = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        """
+        Make an HTTP request and return (status, reason, headers, body) of
+        its reply. Reply headers are a dict with lower case names and the
+        body is decoded if it came compressed.
+        """
+        scheme, netloc, path, query = urlparse.urlsplit(str(url))[:4]
+        if query:
+            path = '%s?%s' % (path, query)
+
+        key = (scheme, netloc)
+        connection, reused = self._get(key, timeout)
+        try:
+            response = self._send(connection, method, path or '/', body,
+                headers or {})
+        except socket.timeout:
+            connection.close()
+            raise
+        except (socket.error, httplib.HTTPException):
+            connection.close()
+            if not reused:
+                raise
+
+            self._lock.acquire()
+            try:
+                self.stale += 1
+            finally:
+                self._lock.release()
+
+            log.debug('%s closed a reused connection, reconnecting', netloc)
+            connection = self._connect(key, timeout)
+            try:
+                response = self._send(connection, method, path or '/', body,
+                    headers or {})
+            except:
+                connection.close()
+                raise
+
+        status, reason, reply_headers, data = response
+        self._put(key, connection, reply_headers)
+
+        encoding = reply_headers.get('content-encoding', '').lower()
+        received = len(data)
+        if encoding in ('gzip', 'x-gzip'):
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            try:
+                data = zlib.decompress(data)
+            except zlib.error:
+                # Some servers send deflate without the zlib header.
+                data = zlib.decompress(data, -zlib.MAX_WBITS)
+
+        self._lock.acquire()
+        try:
+            self.requests += 1
+            self.bytesReceived += received
+            self.bytesDecoded += len(data)
+            if encoding:
+                self.compressed += 1
+        finally:
+            self._lock.release()
+
+        return status, reason, reply_headers, data
+
+
+    def getStats(self):
+        """
+        Return a dict of the number of requests made, connections opened,
+        requests sent on a reused connection and reused connections found
+        closed, responses that came compressed, and the bytes received
+        before and after decoding them.
+        """
+        self._lock.acquire()
+        try:
+            return {
+                'requests': self.requests,
+                'connections': self.connections,
+                'reused': self.reused,
+                'stale': self.stale,
+                'compressed': self.compressed,
+                'bytesReceived': self.bytesReceived,
+                'bytesDecoded': self.bytesDecoded,
+                }
+        finally:
+            self._lock.release()
+
+
+    def close(self):
+        """
+        Close every idle connection.
+        """
+        self._lock.acquire()
+        try:
+            idle = self._idle
+            self._idle = {}
+        finally:
+            self._lock.release()
+
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+    def _get(self, key, timeout):
+        """
+        Return (connection, reused) with an idle connection to key if there
+        is one or a new one.
+        """
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(key)
+            if idle:
+                self.reused += 1
+                return idle.pop(), True
+        finally:
+            self._lock.release()
+
+        return self._connect(key, timeout), False
+
+
+    def _put(self, key, connection, headers):
+        """
+        Keep connection idle for the next request to key unless the reply
+        headers say it closes or enough are kept already.
+        """
+        if headers.get('connection', '').lower() != 'close':
+            self._lock.acquire()
+            try:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.size:
+                    idle.append(connection)
+                    return
+            finally:
+                self._lock.release()
+
+        connection.close()
+
+
+    def _connect(self, key, timeout):
+        scheme, netloc = key
+        if scheme == 'https':
+            cls = httplib.HTTPSConnection
+        else:
+            cls = httplib.HTTPConnection
+
+        if timeout is None:
+            timeout = self.timeout
+
+        self._lock.acquire()
+        try:
+            self.connections += 1
+        finally:
+            self._lock.release()
+
+        return cls(netloc, timeout=timeout)
+
+
+    def _send(self, connection, method, path, body, headers):
+        connection.request(method, path, body, headers)
+        response = connection.getresponse()
+        data = response.read()
+        reply_headers = dict(response.getheaders())
+        if response.will_close:
+            reply_headers['connection'] = 'close'
+
+        return response.status, response.reason, reply_headers, data
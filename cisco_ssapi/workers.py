@@ -0,0 +1,238 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.workers')
+
+import atexit
+import threading
+import weakref
+
+from collections import deque
+
+
+class FairQueue(object):
+    """
+    Blocking queue that hands out items from each of its groups in turn.
+
+    Items within a group come out in the order they were put. A group with a
+    long backlog only gets one item out for every item of every other group.
+    """
+
+    def __init__(self):
+        self._groups = {}
+        self._order = deque()
+        self._condition = threading.Condition()
+
+
+    def put(self, item, group=None):
+        self._condition.acquire()
+        try:
+            items = self._groups.get(group)
+            if items is None:
+                items = self._groups[group] = deque()
+                self._order.append(group)
+
+            items.append(item)
+            self._condition.notify()
+        finally:
+            self._condition.release()
+
+
+    def get(self):
+        self._condition.acquire()
+        try:
+            while not self._order:
+                self._condition.wait()
+
+            group = self._order.popleft()
+            items = self._groups[group]
+            item = items.popleft()
+            if items:
+                self._order.append(group)
+            else:
+                del self._groups[group]
+
+            return item
+        finally:
+            self._condition.release()
+
+
+    def __len__(self):
+        self._condition.acquire()
+        try:
+            return sum([len(items) for items in self._groups.values()])
+        finally:
+            self._condition.release()
+
+
+class Scheduler(object):
+    """
+    Runs tasks on a fixed set of worker threads.
+
+    The number of workers is a hard limit on how many tasks run at once.
+    Queued tasks are taken from their groups in turn so that no single group
+    can starve the others. The threads are started on the first submit and
+    then reused for every task until stop is called. Each task's outcome is
+    put on the completion queue given to submit as a (tag, result, error)
+    tuple.
+    """
+
+    def __init__(self, size, name='worker'):
+        self._size = size
+        self._name = name
+        self._tasks = FairQueue()
+        self._threads = []
+        self._lock = threading.Lock()
+        _schedulers[self] = True
+
+
+    def start(self):
+        self._lock.acquire()
+        try:
+            while len(self._threads) < self._size:
+                thread = threading.Thread(target=self._work,
+                    name="%s %s" % (self._name, len(self._threads) + 1))
+
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+        finally:
+            self._lock.release()
+
+
+    def stop(self, timeout=None):
+        """
+        Stop the worker threads once they finish their current task. Wait up
+        to timeout seconds for each of them when timeout isn't None.
+        """
+        self._lock.acquire()
+        try:
+            threads = self._threads
+            self._threads = []
+            for thread in threads:
+                self._tasks.put(None, self)
+        finally:
+            self._lock.release()
+
+        if timeout is not None:
+            for thread in threads:
+                thread.join(timeout)
+
+
+    def submit(self, func, args, tag, completions, group=None):
+        if len(self._threads) < self._size:
+            self.start()
+
+        self._tasks.put((func, args, tag, completions), group)
+
+
+    def getQueued(self):
+        return len(self._tasks)
+
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                break
+
+            func, args, tag, completions = task
+            try:
+                # pylint: disable-msg=W0142
+                result = func(*args)
+            except Exception, ex:
+                completions.put((tag, None, ex))
+            else:
+                completions.put((tag, result, None))
+
+
+class Feeder(object):
+    """
+    Reads items from an iterator on a thread of its own so that a slow
+    source, such as a pipe, never blocks the consumer.
+
+    Each item is put on queue as a (feeder, item, None) tuple. The end of
+    the iterator is put as (feeder, None, StopIteration()) and an error
+    raised by it as (feeder, None, error). At most readAhead items are read
+    before the consumer calls take for them.
+    """
+
+    def __init__(self, iterator, queue, readAhead, name='feeder'):
+        self._iterator = iterator
+        self._queue = queue
+        self._credits = threading.Semaphore(readAhead)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._feed, name=name)
+        self._thread.setDaemon(True)
+
+
+    def start(self):
+        self._thread.start()
+        return self
+
+
+    def take(self):
+        """
+        Let another item be read in place of one the consumer has taken.
+        """
+        self._credits.release()
+
+
+    def stop(self):
+        """
+        Stop reading and close the iterator once the item being read, if
+        any, has been read.
+        """
+        self._stopped = True
+        self._credits.release()
+
+
+    def _feed(self):
+        try:
+            while True:
+                self._credits.acquire()
+                if self._stopped:
+                    break
+
+                try:
+                    item = self._iterator.next()
+                except StopIteration, ex:
+                    self._queue.put((self, None, ex))
+                    return
+
+                self._queue.put((self, item, None))
+        except Exception, ex:
+            self._queue.put((self, None, ex))
+            return
+
+        close = getattr(self._iterator, 'close', None)
+        if close is not None:
+            close()
+
+
+_schedulers = weakref.WeakKeyDictionary()
+
+def _stopSchedulers():
+    # Daemon threads blocked on a queue at interpreter shutdown raise noisy
+    # exceptions under Python 2, so let idle workers exit first.
+    for scheduler in _schedulers.keys():
+        scheduler.stop(timeout=1)
+
+atexit.register(_stopSchedulers)
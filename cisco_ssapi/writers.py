@@ -0,0 +1,338 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.writers')
+
+import csv
+import json
+import marshal
+import sqlite3
+import sys
+import time
+
+from cStringIO import StringIO
+
+# Rows written together and the most seconds a row waits to be written.
+BATCH_SIZE = 1000
+FLUSH_INTERVAL = 1.0
+
+
+class RecordWriter(object):
+    """
+    Writes rows of column values in batches.
+
+    Rows are collected and written BATCH_SIZE at a time with a single write
+    to output, or sooner once the first row collected has waited
+    flushInterval seconds. That wait is checked whenever a row is written
+    or poll is called, so rows collected before a lull wait for the next
+    of them. A flushInterval of 0 writes every row as soon as it is given,
+    as the scripts used to.
+
+    Unless header is false, the writer starts by writing what its format
+    needs before the first row. Pass a false header when appending to
+    output written earlier.
+    """
+
+    def __init__(self, output, columns, flushInterval=FLUSH_INTERVAL,
+        batchSize=BATCH_SIZE, header=True):
+
+        self.output = output
+        self.columns = list(columns)
+        self.flushInterval = flushInterval
+        self.batchSize = batchSize
+        self._rows = []
+        self._started = None
+        if header:
+            self.writeHeader()
+
+
+    def write(self, values):
+        """
+        Write a row of values in the order of columns.
+        """
+        if not self._rows:
+            self._started = time.time()
+
+        self._rows.append(values)
+        if len(self._rows) >= self.batchSize:
+            self.flush()
+        else:
+            self.poll()
+
+
+    def poll(self):
+        """
+        Write the rows collected if the first of them has waited
+        flushInterval seconds.
+        """
+        if self._rows and time.time() - self._started >= self.flushInterval:
+            self.flush()
+
+
+    def flush(self):
+        if self._rows:
+            rows = self._rows
+            self._rows = []
+            self.writeRows(rows)
+
+        self.output.flush()
+
+
+    def close(self):
+        """
+        Write any rows left. The output is flushed but left open.
+        """
+        self.flush()
+
+
+    def tell(self):
+        """
+        Write any rows collected and return the offset of the end of the
+        output.
+        """
+        self.flush()
+        return self.output.tell()
+
+
+    def truncate(self, offset):
+        """
+        Discard everything written after offset and continue from there.
+        """
+        self.flush()
+        self.output.seek(offset)
+        self.output.truncate()
+
+
+    def writeHeader(self):
+        pass
+
+
+    def writeRows(self, rows):
+        raise NotImplementedError
+
+
+class CSVWriter(RecordWriter):
+    """
+    Writes delimited text with a header row of the column names.
+    """
+
+    def __init__(self, output, columns, flushInterval=FLUSH_INTERVAL,
+        batchSize=BATCH_SIZE, header=True, delimiter=','):
+
+        self.delimiter = delimiter
+        RecordWriter.__init__(
+            self, output, columns, flushInterval, batchSize, header)
+
+
+    def writeHeader(self):
+        self.writeRows([self.columns])
+
+
+    def writeRows(self, rows):
+        buffer = StringIO()
+        csv.writer(buffer, delimiter=self.delimiter).writerows(rows)
+        self.output.write(buffer.getvalue())
+
+
+class JSONLinesWriter(RecordWriter):
+    """
+    Writes each row as a JSON object of column names to values on a line of
+    its own.
+    """
+
+    def writeRows(self, rows):
+        columns = self.columns
+        self.output.write(''.join([
+            json.dumps(dict(zip(columns, values))) + '\n'
+            for values in rows]))
+
+
+class BinaryWriter(RecordWriter):
+    """
+    Writes a compact column-oriented dump as a stream of marshalled objects.
+
+    The first object is the list of column names. Each one after it is a
+    batch of rows as a list of column value lists. Read it back with
+    readBinary.
+    """
+
+    def writeHeader(self):
+        self.output.write(marshal.dumps(self.columns))
+
+
+    def writeRows(self, rows):
+        self.output.write(marshal.dumps(map(list, zip(*rows))))
+
+
+class SQLiteWriter(RecordWriter):
+    """
+    Inserts rows into table in the SQLite database at output, creating it
+    with a TEXT column for each column if need be, whatever header is. Each
+    batch is inserted in one transaction. Offsets are rowids.
+    """
+
+    def __init__(self, output, columns, flushInterval=FLUSH_INTERVAL,
+        batchSize=BATCH_SIZE, header=True, table='records'):
+
+        self.table = table
+        RecordWriter.__init__(self, sqlite3.connect(output), columns,
+            flushInterval, batchSize)
+
+
+    def writeHeader(self):
+        self.output.execute('CREATE TABLE IF NOT EXISTS %s (%s)' % (
+            self.table,
+            ', '.join(['%s TEXT' % column for column in self.columns])))
+
+        self.output.commit()
+
+
+    def writeRows(self, rows):
+        self.output.executemany('INSERT INTO %s (%s) VALUES (%s)' % (
+            self.table,
+            ', '.join(self.columns),
+            ', '.join(['?'] * len(self.columns))), rows)
+
+
+    def flush(self):
+        if self._rows:
+            rows = self._rows
+            self._rows = []
+            self.writeRows(rows)
+
+        self.output.commit()
+
+
+    def close(self):
+        self.flush()
+        self.output.close()
+
+
+    def tell(self):
+        self.flush()
+        return self.output.execute('SELECT COALESCE(MAX(rowid), 0) FROM %s'
+            % self.table).fetchone()[0]
+
+
+    def truncate(self, offset):
+        self.flush()
+        self.output.execute(
+            'DELETE FROM %s WHERE rowid > ?' % self.table, (offset,))
+
+        self.output.commit()
+
+
+FORMATS = {
+    'csv': CSVWriter,
+    'jsonl': JSONLinesWriter,
+    'binary': BinaryWriter,
+    'sqlite': SQLiteWriter,
+    }
+
+
+def readBinary(input):
+    """
+    Yield each row of a dump written by BinaryWriter as a dict of column
+    names to values. input must be a real file, not a file-like object.
+    """
+    try:
+        columns = marshal.load(input)
+    except EOFError:
+        return
+
+    while True:
+        try:
+            batch = marshal.load(input)
+        except EOFError:
+            return
+
+        for values in zip(*batch):
+            yield dict(zip(columns, values))
+
+
+def readCSV(input, delimiter=','):
+    """
+    Yield each row written by CSVWriter as a dict of column names to
+    values.
+    """
+    reader = csv.reader(input, delimiter=delimiter)
+    try:
+        columns = reader.next()
+    except StopIteration:
+        return
+
+    for values in reader:
+        yield dict(zip(columns, values))
+
+
+def readJSONLines(input):
+    """
+    Yield each row written by JSONLinesWriter as a dict of column names to
+    values.
+    """
+    for line in input:
+        if line.strip():
+            yield json.loads(line)
+
+
+def readSQLite(path, table='records'):
+    """
+    Yield each row SQLiteWriter inserted into table, in insertion order, as
+    a dict of column names to values.
+    """
+    connection = sqlite3.connect(path)
+    try:
+        cursor = connection.execute('SELECT * FROM %s ORDER BY rowid' % table)
+        columns = [description[0] for description in cursor.description]
+        for values in cursor:
+            yield dict(zip(columns, values))
+    finally:
+        connection.close()
+
+
+def readRecords(path, format, delimiter=',', table='records'):
+    """
+    Yield each row of the output the writer of format wrote to path, or to
+    stdin for a path of -, as a dict of column names to values.
+    """
+    if format == 'sqlite':
+        for row in readSQLite(path, table):
+            yield row
+
+        return
+
+    if path == '-':
+        input = sys.stdin
+    else:
+        input = open(path, 'rb')
+
+    try:
+        if format == 'csv':
+            rows = readCSV(input, delimiter)
+        elif format == 'jsonl':
+            rows = readJSONLines(input)
+        else:
+            rows = readBinary(input)
+
+        for row in rows:
+            yield row
+    finally:
+        if input is not sys.stdin:
+            input.close()
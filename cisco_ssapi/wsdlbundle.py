@@ -0,0 +1,134 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import logging
+log = logging.getLogger('cisco_ssapi.wsdlbundle')
+
+import cPickle as pickle
+import os
+import sys
+import threading
+
+from optparse import OptionParser
+
+# Bundle shipped with the package, built by eox_wsdl_bundle.
+BUNDLE_LOCATION = os.path.join(os.path.dirname(__file__), 'wsdl.bundle')
+
+# Changes whenever the layout of a bundle does.
+BUNDLE_FORMAT = 1
+
+
+def buildBundle(path, wsdls):
+    """
+    Fetch and parse each WSDL in wsdls, with the schemas it imports, and
+    write the parsed definitions to a bundle at path.
+
+    Suds caches definitions under an id hashed from the WSDL URL, so a
+    bundle only answers for the URLs it was built from, and only on
+    platforms hashing strings the same way with the same version of suds.
+    """
+    import suds
+    from suds.client import Client
+
+    from clients import RecordingCache
+
+    recorder = RecordingCache()
+    for wsdl in wsdls:
+        log.info('parsing %s', wsdl)
+        Client(wsdl, cache=recorder, cachingpolicy=1)
+
+    bundle = {
+        'format': BUNDLE_FORMAT,
+        'suds': suds.__version__,
+        'maxint': sys.maxint,
+        'wsdls': list(wsdls),
+        'entries': recorder.entries,
+        }
+
+    partial = '%s.%s' % (path, os.getpid())
+    output = open(partial, 'wb')
+    try:
+        pickle.dump(bundle, output, 2)
+    finally:
+        output.close()
+
+    os.rename(partial, path)
+    log.info('wrote %s definitions to %s', len(recorder.entries), path)
+
+
+_bundles = {}
+_bundlesLock = threading.Lock()
+
+def loadBundle(path=BUNDLE_LOCATION):
+    """
+    Return the entries of the bundle at path as a dict of suds cache ids to
+    pickled definitions, or an empty dict if there is no bundle there or it
+    can't be used with this suds or platform. Each path is read once.
+    """
+    _bundlesLock.acquire()
+    try:
+        entries = _bundles.get(path)
+        if entries is None:
+            entries = _bundles[path] = readBundle(path)
+
+        return entries
+    finally:
+        _bundlesLock.release()
+
+
+def readBundle(path):
+    try:
+        input = open(path, 'rb')
+    except IOError:
+        return {}
+
+    try:
+        try:
+            bundle = pickle.load(input)
+        except Exception, ex:
+            log.warn('ignoring unreadable WSDL bundle %s: %s', path, ex)
+            return {}
+    finally:
+        input.close()
+
+    import suds
+
+    if bundle.get('format') != BUNDLE_FORMAT \
+        or bundle.get('suds') != suds.__version__ \
+        or bundle.get('maxint') != sys.maxint:
+
+        log.info('ignoring WSDL bundle %s built for suds %s', path,
+            bundle.get('suds'))
+
+        return {}
+
+    return bundle['entries']
+
+
+def main():
+    from eox import WSDL, WSDL_BULK
+
+    parser = OptionParser(usage='%prog [options] [WSDL URL] [...]')
+    parser.add_option('-o', '--output', dest='output',
+        default=BUNDLE_LOCATION,
+        help='Bundle file to write, by default the one Server loads')
+    options, args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    buildBundle(options.output, args or [WSDL, WSDL_BULK])
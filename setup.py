@@ -38,9 +38,9 @@ setup(
         'Natural Language :: English',
         'Operating System :: OS Independent',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 2.4',
-        'Programming Language :: Python :: 2.5',
+        'Programming Language :: Python :: 2',
         'Programming Language :: Python :: 2.6',
+        'Programming Language :: Python :: 2.7',
         'Topic :: Software Development :: Libraries :: Python Modules',
         'Topic :: Utilities',
         ],
@@ -52,10 +52,11 @@ setup(
     license='GPLv3',
     packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
     include_package_data=True,
+    package_data={'cisco_ssapi': ['wsdl.bundle']},
     zip_safe=False,
 
     install_requires=[
-        'suds >= 0.3.8',
+        'suds >= 0.4',
         ],
 
     entry_points={
@@ -67,6 +68,13 @@ setup(
             'get_eox_by_product = cisco_ssapi.scripts:getEOXByProductID',
             'get_eox_by_sw = cisco_ssapi.scripts:getEOXBySWRelease',
             'get_eox_by_serial = cisco_ssapi.scripts:getEOXBySerialNumber',
+            'eox_mock_server = cisco_ssapi.mockserver:main',
+            'eox_benchmark = cisco_ssapi.benchmark:main',
+            'eox_wsdl_bundle = cisco_ssapi.wsdlbundle:main',
+            'get_eox_batch = cisco_ssapi.scripts:getEOXBatch',
+            'eox_query = cisco_ssapi.scripts:queryEOX',
+            'eox_dedupe = cisco_ssapi.scripts:dedupeEOX',
+            'eox_diff = cisco_ssapi.scripts:diffEOX',
             ]
         },
     )
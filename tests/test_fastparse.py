@@ -0,0 +1,131 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""
+Checks fastparse.parseResponse against suds on SOAP replies recorded from a
+local stand-in for the EOX services, plus hand-written ones for what it
+never sends.
+"""
+
+import os
+import unittest
+
+from suds.client import Client
+
+from cisco_ssapi.eox import setInjectable
+from cisco_ssapi.fastparse import parseResponse
+from cisco_ssapi.records import convertResponse
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'fixtures')
+
+# WSDL fixture describing each method's reply.
+WSDLS = {
+    'showEOXByProductID': 'eoxlookupservice-1.xml',
+    'showEOXByDates': 'bulkeoxlookupservice-1.xml',
+    'showAllProductIDs': 'bulkeoxlookupservice-1.xml',
+    }
+
+
+def getFixture(name):
+    input = open(os.path.join(FIXTURES, name), 'rb')
+    try:
+        return input.read()
+    finally:
+        input.close()
+
+
+class ParseResponseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clients = {}
+        for name in set(WSDLS.values()):
+            client = Client('file://%s' % os.path.join(FIXTURES, name),
+                cache=None)
+
+            setInjectable(client)
+            self.clients[name] = client
+
+
+    def unmarshal(self, method, xml):
+        """
+        Return the records.Response suds makes of xml as the reply to
+        method.
+        """
+        client = self.clients[WSDLS[method]]
+        # pylint: disable-msg=W0142
+        return convertResponse(getattr(client.service, method)(
+            **{'__inject': {'reply': xml}}))
+
+
+    def assertParsedLikeSuds(self, method, name):
+        xml = getFixture(name)
+        response = parseResponse(xml)
+        self.assertNotEqual(response, None)
+        self.assertEqual(response, self.unmarshal(method, xml))
+        return response
+
+
+    def testRecords(self):
+        response = self.assertParsedLikeSuds('showEOXByProductID',
+            'records.xml')
+
+        self.assertEqual(len(response.EOXRecord), 3)
+        self.assertEqual(response.EOXRecord[0].EOLProductID, u'MOCK-000001')
+        self.assertEqual(response.EOXRecord[0].EOXError, None)
+
+
+    def testPaginated(self):
+        response = self.assertParsedLikeSuds('showEOXByDates',
+            'paginated.xml')
+
+        self.assertEqual(len(response.EOXRecord), 5)
+        self.assertEqual(response.PaginationResponseRecord.getFields(),
+            (2, 3, 12, 5))
+
+
+    def testProducts(self):
+        response = self.assertParsedLikeSuds('showAllProductIDs',
+            'products.xml')
+
+        self.assertEqual(len(response.ProductIDRecord), 2)
+        self.assertEqual(response.EOXRecord, ())
+
+
+    def testError(self):
+        response = self.assertParsedLikeSuds('showEOXByDates', 'error.xml')
+        self.assertEqual(response.EOXRecord, ())
+        self.assertEqual(response.EOXError.ErrorID, u'SSA_ERR_013')
+
+
+    def testRecordError(self):
+        response = self.assertParsedLikeSuds('showEOXByProductID',
+            'record-error.xml')
+
+        self.assertEqual(response.EOXRecord[0].EOXError, None)
+        self.assertEqual(response.EOXRecord[1].EOXError.ErrorID,
+            u'SSA_ERR_026')
+
+
+    def testUnrecognized(self):
+        self.assertEqual(parseResponse(getFixture('unrecognized.xml')), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
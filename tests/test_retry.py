@@ -0,0 +1,97 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""
+Checks that a Server with a retry.RateLimiter backs off when the local
+stand-in for the EOX services throttles it for going over its quota.
+"""
+
+import shutil
+import tempfile
+import unittest
+
+from cisco_ssapi.eox import Server
+from cisco_ssapi.mockserver import MockServer, getProductID
+from cisco_ssapi.retry import RateLimiter, RetryBudget, RetryPolicy
+
+# Requests a second the mock server answers before throttling.
+QUOTA = 5
+
+# Requests a second the limiter starts at, well over QUOTA.
+RATE = 40
+
+PRODUCTS = 20
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = MockServer(productCount=PRODUCTS, quota=QUOTA).start()
+        self.directory = tempfile.mkdtemp(prefix='eox-test-')
+
+
+    def tearDown(self):
+        self.mock.stop()
+        shutil.rmtree(self.directory)
+
+
+    def lookup(self, limiter):
+        """
+        Look up every product ID, one to a request, through limiter and
+        check that each is answered.
+        """
+        server = Server('user', 'password', threads=4,
+            cacheLocation=self.directory,
+            groupLimit=1,
+            retryPolicy=RetryPolicy(maxAttempts=20, baseDelay=0.01,
+                maxDelay=0.1),
+            retryBudget=RetryBudget(minimum=1000),
+            wsdl=self.mock.getWSDL(),
+            bulkWSDL=self.mock.getBulkWSDL(),
+            wsdlBundle=None,
+            rateLimiter=limiter)
+
+        product_ids = [getProductID(index) for index in range(PRODUCTS)]
+        found = []
+        for response in server.getEOXByProductID(product_ids):
+            for record in response.EOXRecord:
+                found.append(record.EOLProductID)
+
+        self.assertEqual(sorted(found), product_ids)
+
+
+    def testBacksOffWhenThrottled(self):
+        limiter = RateLimiter(RATE)
+        self.lookup(limiter)
+
+        self.assertTrue(self.mock.throttled > 0)
+        self.assertTrue(limiter.rate < RATE)
+        self.assertTrue(limiter.rate >= limiter.minRate)
+
+
+    def testUnderQuota(self):
+        limiter = RateLimiter(QUOTA - 1, burst=1)
+        self.lookup(limiter)
+
+        self.assertEqual(self.mock.throttled, 0)
+        self.assertEqual(limiter.rate, QUOTA - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
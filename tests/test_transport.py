@@ -0,0 +1,141 @@
+##############################################################################
+#
+# Copyright (C) 2010, Chet Luther <chet.luther@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""
+Checks that transport.ConnectionPool reuses keep-alive connections and
+decodes compressed replies from the local stand-in for the EOX services,
+on its own and under a Server.
+"""
+
+import shutil
+import tempfile
+import unittest
+
+from cisco_ssapi.eox import Server
+from cisco_ssapi.mockserver import MockServer, getProductID
+from cisco_ssapi.transport import ACCEPT_ENCODING, ConnectionPool
+
+PRODUCTS = 40
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = MockServer(productCount=PRODUCTS).start()
+        self.pool = ConnectionPool()
+
+
+    def tearDown(self):
+        self.pool.close()
+        self.mock.stop()
+
+
+    def get(self, headers=None):
+        status, reason, reply_headers, body = self.pool.request('GET',
+            self.mock.getWSDL(), headers=headers)
+
+        self.assertEqual(status, 200)
+        return reply_headers, body
+
+
+    def testReused(self):
+        for i in range(3):
+            self.get()
+
+        stats = self.pool.getStats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['reused'], 2)
+        self.assertEqual(self.mock.connections, 1)
+
+
+    def testDecoded(self):
+        plain_headers, plain = self.get()
+        reply_headers, body = self.get({'Accept-Encoding': ACCEPT_ENCODING})
+
+        self.assertEqual(plain_headers.get('content-encoding'), None)
+        self.assertEqual(reply_headers['content-encoding'], 'gzip')
+        self.assertEqual(body, plain)
+
+        stats = self.pool.getStats()
+        self.assertEqual(stats['compressed'], 1)
+        self.assertTrue(stats['bytesReceived'] < stats['bytesDecoded'])
+
+
+    def testStale(self):
+        self.get()
+        for connections in self.pool._idle.values():
+            for connection in connections:
+                connection.sock.close()
+
+        self.get()
+
+        stats = self.pool.getStats()
+        self.assertEqual(stats['stale'], 1)
+        self.assertEqual(stats['connections'], 2)
+
+
+class PooledTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = MockServer(productCount=PRODUCTS).start()
+        self.pool = ConnectionPool()
+        self.directory = tempfile.mkdtemp(prefix='eox-test-')
+
+
+    def tearDown(self):
+        self.pool.close()
+        self.mock.stop()
+        shutil.rmtree(self.directory)
+
+
+    def testServer(self):
+        threads = 4
+        server = Server('user', 'password', threads=threads,
+            cacheLocation=self.directory,
+            groupLimit=1,
+            wsdl=self.mock.getWSDL(),
+            bulkWSDL=self.mock.getBulkWSDL(),
+            wsdlBundle=None,
+            connectionPool=self.pool)
+
+        product_ids = [getProductID(index) for index in range(PRODUCTS)]
+        found = []
+        for response in server.getEOXByProductID(product_ids):
+            for record in response.EOXRecord:
+                found.append(record.EOLProductID)
+
+        self.assertEqual(sorted(found), product_ids)
+
+        # Every request, and the WSDL fetches the mock doesn't count, went
+        # through the pool on at most one connection per thread, and every
+        # reply came compressed.
+        stats = self.pool.getStats()
+        self.assertTrue(stats['requests'] >= self.mock.requests)
+        self.assertTrue(stats['connections'] <= threads)
+        self.assertEqual(self.mock.connections, stats['connections'])
+        self.assertEqual(stats['reused'],
+            stats['requests'] - stats['connections'])
+
+        self.assertEqual(stats['compressed'], stats['requests'])
+        self.assertTrue(stats['bytesReceived'] < stats['bytesDecoded'])
+
+
+if __name__ == '__main__':
+    unittest.main()